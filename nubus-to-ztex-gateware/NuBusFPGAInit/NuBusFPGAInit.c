@@ -13,6 +13,12 @@
 #define kINITid 0
 
 #define _BitBlt 0xAB00
+#define _StdLine 0xA890
+#define _StdText 0xA882
+#define _StdBits 0xA8EB
+#define _ShieldCursor 0xA855
+#define _HideCursor 0xA852
+#define _ShowCursor 0xA853
 
 // #define QEMU
 
@@ -24,6 +30,32 @@ short check_slots(char list[6]);
 typedef pascal void (*BitBltProc)(BitMap *srcBits, BitMap *maskBits, BitMap *dstBits, Rect *srcRect, Rect *maskRect, Rect *dstRect, short mode, Pattern *pat, RgnHandle rgnA, RgnHandle rgnB, RgnHandle rgnC, short multColor);
 static BitBltProc oldBitBlt;
 
+#ifdef GOBLIN_CMDQ
+pascal void myStdText(short count, const void *textAddr, Point numer, Point denom);
+pascal void myStdBits(const BitMap *srcBits, const Rect *srcRect, const Rect *dstRect, short mode, RgnHandle maskRgn);
+pascal void myShieldCursor(const Rect *shieldRect, Point offsetPt);
+pascal void myHideCursor(void);
+pascal void myShowCursor(void);
+typedef pascal void (*StdTextProc)(short count, const void *textAddr, Point numer, Point denom);
+typedef pascal void (*StdBitsProc)(const BitMap *srcBits, const Rect *srcRect, const Rect *dstRect, short mode, RgnHandle maskRgn);
+typedef pascal void (*ShieldCursorProc)(const Rect *shieldRect, Point offsetPt);
+typedef pascal void (*CursorProc)(void);
+static StdTextProc oldStdText;
+static StdBitsProc oldStdBits;
+static ShieldCursorProc oldShieldCursor;
+static CursorProc oldHideCursor;
+static CursorProc oldShowCursor;
+#endif
+
+#ifdef GOBLIN_LINES
+#ifndef GOBLIN_CMDQ
+#error "GOBLIN_LINES needs GOBLIN_CMDQ"
+#endif
+pascal void myStdLine(Point newPt);
+typedef pascal void (*StdLineProc)(Point newPt);
+static StdLineProc oldStdLine;
+#endif
+
 void* fb_base;
 void* bt_base;
 void* accel_base;
@@ -38,29 +70,80 @@ static inline unsigned long brev(const unsigned long r) {
 #define WAIT_FOR_HW_LE(accel_le)						\
 	while (accel_le->reg_status & (1<<WORK_IN_PROGRESS_BIT))
 
+#ifdef GOBLIN_CMDQ
+// command queue: wait until there's room for a whole command
+#define WAIT_FOR_ROOM_LE(accel_le)						\
+	while (((u_int32_t*)(accel_le))[GOBLIN_CMDQ_FREE] < GOBLIN_CMDQ_ROOM)
+
+// the software cursor is drawn over the screen (with a saved copy of what's under it) when ShowCursor
+// runs after us: a queued blit under the cursor must be finished by then, or the cursor comes back over it
+#define CrsrRectLM (*(Rect*)0x083C) // low-memory CrsrRect, global coordinates
+static int under_cursor(const Rect* r) {
+	const Rect* c = &CrsrRectLM;
+	return ((r->left < c->right) && (c->left < r->right) && (r->top < c->bottom) && (c->top < r->bottom));
+}
+#endif
+
 #define uint8_t unsigned char
 #define uint16_t unsigned short
 #define uint32_t unsigned long
 
 #include "NuBusFPGA_QD.h"
 
+#ifdef GOBLIN_HOSTBLIT
+#ifndef GOBLIN_CMDQ
+#error "GOBLIN_HOSTBLIT needs GOBLIN_CMDQ"
+#endif
+#include <GestaltEqu.h>
+#include <Events.h>
+#ifndef __GNUC__
+#define __builtin_bswap32 brev
+#endif
+#include "nubusfpga_csr_dma_ring.h"
+static int hostblit_ok; // no VM, Mac RAM addresses are what the NuBus sees
+static int hostblit_late; // a band timed out, we keep the ring until its completion comes
+static int hostblit(char* p_fb_base, struct goblin_accel_regs* accel_le, short op, PixMapPtr dstpix, PixMapPtr srcpix, Rect *srcv, Rect *dstv, short width, short height, short bpp);
+#endif
+
 #ifdef QEMU
 #define DLOG(x) bt->debug = (x);
 #else
 #define DLOG(X)
 #endif
 
-int hwblit(char* stack, char* p_fb_base, /* short dstshift, */ short mode, Pattern* pat, PixMapPtr dstpix, PixMapPtr srcpix, Rect *dstrect, Rect *srcrect) {
+// QuickDraw transfer mode to the accelerator raster op (X11 GX*), -1 if not handled
+// the xor modes are bitwise on the pixel values in Color QuickDraw as well, the others would need the colors
+static short hwblit_op(short mode) {
+	switch (mode) {
+	case srcCopy:
+	case patCopy:
+		return 0x3; // GXcopy
+	case srcXor:
+	case patXor:
+		return 0x6; // GXxor
+	}
+	return -1;
+}
+
+// with GOBLIN_CMDQ, the blits go through the command queue (--goblin-cmdq) and we don't wait for them;
+// they must be done before QuickDraw touches the pixels itself, i.e. whenever we fall back to the old _BitBlt
+// (and in the other patched traps, see cmdq_drain), and before the pattern buffer is rewritten
+static int hwblit_try(char* stack, char* p_fb_base, /* short dstshift, */ short mode, Pattern* pat, PixMapPtr dstpix, PixMapPtr srcpix, Rect *dstrect, Rect *srcrect) {
 	struct goblin_bt_regs* bt = (struct goblin_bt_regs*)(p_fb_base + GOBLIN_BT_OFFSET);
+#ifdef GOBLIN_CMDQ
+	struct goblin_accel_regs* accel_le = (struct goblin_accel_regs*)(p_fb_base + GOBLIN_CMDQ_OFFSET);
+#else
 	struct goblin_accel_regs* accel_le = (struct goblin_accel_regs*)(p_fb_base + GOBLIN_ACCEL_OFFSET_LE);
+#endif
 	struct qdstuff* qdstack = (struct qdstuff*)(stack - sizeof(struct qdstuff));
 	short height = qdstack->MINRECT.bottom - qdstack->MINRECT.top;
 	short dstshift = qdstack->DSTSHIFT;
 	short srcshift = qdstack->SRCSHIFT;
 	short expat_size = 0;
 	short expat_const = 0;
+	short op = hwblit_op(mode);
 	
- 	if ((mode != 0) && (mode != 8)) { // only copy handled for now
+ 	if (op < 0) {
 #if 0
 		DLOG(-2L)
 		DLOG(mode)
@@ -68,7 +151,7 @@ int hwblit(char* stack, char* p_fb_base, /* short dstshift, */ short mode, Patte
 		return 0;
 	}
 	
-	if (mode == 8) {
+	if (mode & 8) { // pattern
 		register int i, n;
 		register unsigned long expat0 = qdstack->EXPAT[0];
 		if (qdstack->PATROW != 0) {
@@ -145,6 +228,9 @@ int hwblit(char* stack, char* p_fb_base, /* short dstshift, */ short mode, Patte
 	
 	if ((srcpix->baseAddr != p_fb_base)
 	   //   && ((unsigned long)srcpix->baseAddr >= 0x40000000) // and neither is main memory
+#ifdef GOBLIN_HOSTBLIT
+	    && (!hostblit_ok || (mode & 8) || (dstshift < 3) || ((unsigned long)StripAddress(srcpix->baseAddr) >= 0x40000000)) // unless it's main memory, 8 bits or more
+#endif
 	   ){ 
 #if 0//def QEMU
 		DLOG(-5L)
@@ -194,6 +280,10 @@ int hwblit(char* stack, char* p_fb_base, /* short dstshift, */ short mode, Patte
 		}
 		if (width < 4)
 			return 0;
+#ifdef GOBLIN_HOSTBLIT
+		if (srcpix->baseAddr != p_fb_base)
+			return hostblit(p_fb_base, accel_le, op, dstpix, srcpix, &srcv, &dstv, width, height, 1 << (dstshift - 3));
+#endif
 		
 		/* if .baseAddr of both pix are different, no overlap */
 		/*
@@ -224,9 +314,13 @@ int hwblit(char* stack, char* p_fb_base, /* short dstshift, */ short mode, Patte
 		
 			return 0;
 #else
+#ifndef GOBLIN_CMDQ
 		WAIT_FOR_HW_LE(accel_le);
+#else
+		WAIT_FOR_ROOM_LE(accel_le);
+#endif
 		
-		accel_le->reg_op = 0x3; // GXcopy
+		accel_le->reg_op = op;
 		accel_le->reg_depth = 0; // current
 		
 		accel_le->reg_width = (width); // pixels
@@ -239,7 +333,7 @@ int hwblit(char* stack, char* p_fb_base, /* short dstshift, */ short mode, Patte
 			accel_le->reg_dst_ptr = 0; // let the HW pick its internal address
 		accel_le->reg_dst_stride = (dstpix->rowBytes); // bytes // we should strip the high-order bit, but the HW ignore that for us anyway
 		
-		if (mode == 0) {
+		if (!(mode & 8)) {
 			accel_le->reg_bitblt_src_x = (srcv.left); // pixels
 			accel_le->reg_bitblt_src_y = (srcv.top);
 			if (srcpix->baseAddr != p_fb_base)
@@ -248,7 +342,7 @@ int hwblit(char* stack, char* p_fb_base, /* short dstshift, */ short mode, Patte
 				accel_le->reg_src_ptr = 0; // let the HW pick its internal address
 			accel_le->reg_src_stride = (srcpix->rowBytes); // bytes // we should strip the high-order bit, but the HW ignore that for us anyway
 			accel_le->reg_cmd = (1<<DO_BLIT_BIT);
-		} else if (mode == 8) {
+		} else {
 			register unsigned short i;
 			if (expat_const) {
 				accel_le->reg_fgcolor = qdstack->EXPAT[0];
@@ -264,13 +358,18 @@ int hwblit(char* stack, char* p_fb_base, /* short dstshift, */ short mode, Patte
 					accel_le->reg_bitblt_src_y = ((qdstack->PATVMASK+1)/qdstack->PATROW)-1;
 					accel_le->reg_src_stride = qdstack->PATROW;
 				}
+#ifdef GOBLIN_CMDQ
+				WAIT_FOR_HW_LE(accel_le); // a queued pattern blit may still use the buffer
+#endif
 				for (i = 0 ; i < expat_size ; i++) {
 					((unsigned long*)(p_fb_base + GOBLIN_PATTERN_OFFSET))[i] = qdstack->EXPAT[i];
 				}
 				accel_le->reg_cmd = (1<<DO_PATT_BIT);
 			}
 		}
+#ifndef GOBLIN_CMDQ
 		WAIT_FOR_HW_LE(accel_le);
+#endif
 		
 		return 1;
 #endif
@@ -279,6 +378,280 @@ int hwblit(char* stack, char* p_fb_base, /* short dstshift, */ short mode, Patte
 	return 0;
 }
 
+#ifdef GOBLIN_HOSTBLIT
+// the ring is shared with the RAM disk driver: we claim it for each band, and only if its last owner left nothing
+// in flight (nothing queued, all completions consumed); it is released as soon as the band is fetched
+static int hostblit_claim(uint32_t a32) {
+	if (hostblit_late) { // finish the band that timed out first
+		if (dma_ring_cpl_producer_read(a32) == dma_ring_cpl_consumer_read(a32))
+			return 0;
+		dma_ring_cpl_consumer_write(a32, dma_ring_cpl_consumer_read(a32) + 1);
+		hostblit_late = 0;
+	} else {
+		dma_ring_owner_write(a32, DMA_RING_OWNER_INIT);
+		if (dma_ring_owner_read(a32) != DMA_RING_OWNER_INIT)
+			return 0;
+	}
+	if ((dma_ring_consumer_read(a32) != dma_ring_producer_read(a32)) ||
+	    (dma_ring_cpl_producer_read(a32) != dma_ring_cpl_consumer_read(a32))) {
+		dma_ring_owner_write(a32, 0);
+		return 0;
+	}
+	// no interrupt from us, we poll; leave irq_enable alone
+	dma_ring_ctrl_write(a32, dma_ring_ctrl_read(a32) | (1 << CSR_DMA_RING_CTRL_ENABLE_OFFSET));
+	return 1;
+}
+
+// source in Mac RAM: the DMA ring fetches the rows into the staging area of the VRAM in NuBus blocks (2D descriptor),
+// then the accelerator blits from there; the rows keep their host stride and their offset in the blocks, and the
+// staging area is addressed as rows/columns of the framebuffer (src_ptr 0) with that stride
+// done in bands of rows when the staging area is too small; there is a single staging area, so each band is
+// waited for (polling, up to DMA_RING_TIMEOUT) before its blit is queued; a band that doesn't make it in time
+// is left to QuickDraw (and the ring kept until it's done, see hostblit_claim)
+static int hostblit(char* p_fb_base, struct goblin_accel_regs* accel_le, short op, PixMapPtr dstpix, PixMapPtr srcpix, Rect *srcv, Rect *dstv, short width, short height, short bpp) {
+	uint32_t a32 = (uint32_t)p_fb_base;
+	u_int32_t* desc = (u_int32_t*)(p_fb_base + DMA_RING_OFFSET);
+	u_int32_t* cpl = desc + DMA_RING_SIZE * 4;
+	unsigned long hs = srcpix->rowBytes & 0x3FFF;
+	unsigned long len = (unsigned long)width * bpp;
+	unsigned long y0, band;
+	short done = 0;
+	
+	if ((hs & (bpp - 1)) || (len > hs))
+		return 0;
+	if ((unsigned long)(dstpix->rowBytes & 0x3FFF) * (dstpix->bounds.bottom - dstpix->bounds.top) > GOBLIN_STAGING_OFFSET) // the screen is in the way
+		return 0;
+	y0 = (GOBLIN_STAGING_OFFSET + hs - 1) / hs; // first row of the staging area
+	band = (GOBLIN_STAGING_OFFSET + GOBLIN_STAGING_SIZE - 2 * DMA_RING_BLOCK) / hs; // each row may start up to a block late and end in a partial block
+	if (band <= y0)
+		return 0;
+	band -= y0;
+	if ((op != 0x3) && (band < height)) // only copies can be redone by QuickDraw after a failed band
+		return 0;
+	
+	FlushDataCache(); // the pixels must be in memory, not in a copyback cache
+	while (done < height) {
+		short rows = ((height - done) < band) ? (height - done) : band;
+		unsigned long hb = (unsigned long)StripAddress(srcpix->baseAddr) + (srcv->top + done) * hs + srcv->left * bpp;
+		unsigned long x0 = (hb - y0 * hs) & (DMA_RING_BLOCK - 1); // bytes, same offset in the block as the host
+		unsigned short prod, cprod;
+		unsigned long t, status;
+		
+		WAIT_FOR_HW_LE(accel_le); // the staging area may still be read by a queued blit
+		if (!hostblit_claim(a32))
+			return 0;
+		prod = dma_ring_producer_read(a32);
+		cprod = dma_ring_cpl_producer_read(a32);
+		desc[(prod & (DMA_RING_SIZE - 1)) * 4 + 0] = brev(GOBLIN_FB_SDRAM + y0 * hs + x0);
+		desc[(prod & (DMA_RING_SIZE - 1)) * 4 + 1] = brev(hb);
+		desc[(prod & (DMA_RING_SIZE - 1)) * 4 + 2] = brev(len);
+		desc[(prod & (DMA_RING_SIZE - 1)) * 4 + 3] = brev(DMA_RING_FROM_HOST | DMA_RING_2D);
+		desc[((prod + 1) & (DMA_RING_SIZE - 1)) * 4 + 0] = brev(rows);
+		desc[((prod + 1) & (DMA_RING_SIZE - 1)) * 4 + 1] = brev(hs);
+		desc[((prod + 1) & (DMA_RING_SIZE - 1)) * 4 + 2] = brev(hs);
+		dma_ring_producer_write(a32, prod + 2);
+		t = TickCount();
+		while (dma_ring_cpl_producer_read(a32) == cprod) {
+			if ((TickCount() - t) > DMA_RING_TIMEOUT) {
+				hostblit_late = 1;
+				return 0;
+			}
+		}
+		dma_ring_cpl_consumer_write(a32, cprod + 1);
+		status = brev(cpl[cprod & (DMA_RING_SIZE - 1)]);
+		dma_ring_owner_write(a32, 0);
+		if (status & DMA_RING_CPL_ERROR)
+			return 0;
+		
+		accel_le->reg_op = op;
+		accel_le->reg_depth = 0; // current
+		accel_le->reg_width = (width); // pixels
+		accel_le->reg_height = (rows);
+		accel_le->reg_bitblt_dst_x = (dstv->left); // pixels
+		accel_le->reg_bitblt_dst_y = (dstv->top + done);
+		accel_le->reg_dst_ptr = 0;
+		accel_le->reg_dst_stride = (dstpix->rowBytes);
+		accel_le->reg_bitblt_src_x = (x0 / bpp); // pixels
+		accel_le->reg_bitblt_src_y = (y0);
+		accel_le->reg_src_ptr = 0;
+		accel_le->reg_src_stride = (hs); // bytes
+		accel_le->reg_cmd = (1<<DO_BLIT_BIT);
+		done += rows;
+	}
+	
+	return 1;
+}
+#endif
+
+int hwblit(char* stack, char* p_fb_base, /* short dstshift, */ short mode, Pattern* pat, PixMapPtr dstpix, PixMapPtr srcpix, Rect *dstrect, Rect *srcrect) {
+	int r = hwblit_try(stack, p_fb_base, mode, pat, dstpix, srcpix, dstrect, srcrect);
+#ifdef GOBLIN_CMDQ
+	struct qdstuff* qdstack = (struct qdstuff*)(stack - sizeof(struct qdstuff));
+	if (!r || under_cursor(&qdstack->MINRECT)) { // MINRECT is the destination, in the (global) coordinates of the screen
+		struct goblin_accel_regs* accel_le = (struct goblin_accel_regs*)(p_fb_base + GOBLIN_CMDQ_OFFSET);
+		WAIT_FOR_HW_LE(accel_le);
+	}
+#endif
+	return r;
+}
+
+#ifdef GOBLIN_LINES
+// is the rectangle inside the region, which must be a rectangle too
+static int rect_in_rgn(const Rect* r, RgnHandle rgn) {
+	const Rect* b = &(**rgn).rgnBBox;
+	if ((**rgn).rgnSize != sizeof(Region))
+		return 0;
+	return ((r->left >= b->left) && (r->right <= b->right) && (r->top >= b->top) && (r->bottom <= b->bottom));
+}
+
+// lines with a 1x1 solid pen, in patCopy or patXor, on our screen and not clipped go to the line engine
+// (through the command queue, after the blits queued before them); the pen location is updated by LineTo, not here
+static int hwline_try(char* p_fb_base, Point newPt) {
+	struct goblin_accel_regs* accel_le = (struct goblin_accel_regs*)(p_fb_base + GOBLIN_CMDQ_OFFSET);
+	u_int32_t* cmdq = (u_int32_t*)accel_le;
+	CGrafPtr port;
+	PixMapPtr pix;
+	PixPatPtr ppat;
+	Rect r, g;
+	unsigned long color;
+	short op, depth, i;
+	int cursor;
+	
+	GetPort((GrafPtr*)&port);
+	if ((port->portVersion & 0xC000) != 0xC000) // not a color port
+		return 0;
+	if (port->picSave || (port->pnVis < 0) || (port->pnSize.h != 1) || (port->pnSize.v != 1))
+		return 0;
+	pix = *(port->portPixMap);
+	if (pix->baseAddr != p_fb_base)
+		return 0;
+	switch (pix->pixelSize) {
+	case 8: depth = 0; break;
+	case 16: depth = 1; break;
+	case 32: depth = 2; break;
+	default: return 0;
+	}
+	ppat = *(port->pnPixPat);
+	if (ppat->patType != 0) // only old-style patterns
+		return 0;
+	for (i = 0 ; i < 8 ; i++)
+		if (((unsigned char*)&ppat->pat1Data)[i] != 0xFF) // only black (solid foreground)
+			return 0;
+	switch (port->pnMode) {
+	case patCopy:
+		op = 0x3; // GXcopy
+		color = port->fgColor; // pixel value of the foreground
+		break;
+	case patXor:
+		op = 0x6; // GXxor
+		color = 0xFFFFFFFF; // black inverts
+		break;
+	default:
+		return 0;
+	}
+	
+	r.left = (port->pnLoc.h < newPt.h) ? port->pnLoc.h : newPt.h;
+	r.right = ((port->pnLoc.h < newPt.h) ? newPt.h : port->pnLoc.h) + 1;
+	r.top = (port->pnLoc.v < newPt.v) ? port->pnLoc.v : newPt.v;
+	r.bottom = ((port->pnLoc.v < newPt.v) ? newPt.v : port->pnLoc.v) + 1;
+	if (!rect_in_rgn(&r, port->visRgn) || !rect_in_rgn(&r, port->clipRgn))
+		return 0;
+	if ((r.left < pix->bounds.left) || (r.right > pix->bounds.right) || (r.top < pix->bounds.top) || (r.bottom > pix->bounds.bottom))
+		return 0;
+	
+	// the cursor only needs the line done if it is over it (CrsrRect is global, r is local to the port)
+	g = r;
+	OffsetRect(&g, -pix->bounds.left, -pix->bounds.top);
+	cursor = under_cursor(&g);
+	
+	WAIT_FOR_ROOM_LE(accel_le);
+	// the unpatched traps, our versions would always drain the queue (see cmdq_drain)
+	if (cursor)
+		WAIT_FOR_HW_LE(accel_le); // hiding the cursor puts back what was under it
+	oldShieldCursor(&r, pix->bounds.topLeft);
+	cmdq[GOBLIN_CMDQ_LINE_X0] = port->pnLoc.h - pix->bounds.left;
+	cmdq[GOBLIN_CMDQ_LINE_Y0] = port->pnLoc.v - pix->bounds.top;
+	cmdq[GOBLIN_CMDQ_LINE_X1] = newPt.h - pix->bounds.left;
+	cmdq[GOBLIN_CMDQ_LINE_Y1] = newPt.v - pix->bounds.top;
+	cmdq[GOBLIN_CMDQ_LINE_COLOR] = color;
+	cmdq[GOBLIN_CMDQ_LINE_OP] = op;
+	cmdq[GOBLIN_CMDQ_LINE_GEOM] = (pix->rowBytes & 0x3FFF) | ((unsigned long)depth << 16);
+	cmdq[GOBLIN_CMDQ_LINE_CMD] = 1;
+	if (cursor)
+		WAIT_FOR_HW_LE(accel_le); // the cursor comes back over the line
+	oldShowCursor();
+	
+	return 1;
+}
+
+pascal void myStdLine(Point newPt) {
+	long oldA4 = SetCurrentA4();
+	StdLineProc old = oldStdLine;
+	int r = hwline_try(fb_base, newPt);
+	
+	if (!r) { // QuickDraw will draw, the queue must be empty
+		struct goblin_accel_regs* accel_le = (struct goblin_accel_regs*)((char*)fb_base + GOBLIN_CMDQ_OFFSET);
+		WAIT_FOR_HW_LE(accel_le);
+	}
+	SetA4(oldA4);
+	if (!r)
+		old(newPt);
+}
+#endif
+
+#ifdef GOBLIN_CMDQ
+// the queue must also be empty before QuickDraw touches the screen without going through _BitBlt or _StdLine:
+// text (drawn by _StdText's own loops), _StdBits (its stretching/color-mapping paths don't all end in _BitBlt),
+// and the cursor, whose hide/shield puts back the saved pixels and whose show saves the pixels under it
+// Not covered: the cursor moved by the VBL task (jCrsrTask), for which hwblit only waits when the blit is under
+// CrsrRect at the time; programs writing to the frame buffer directly; reads of the screen outside of _BitBlt
+// (GetCPixel and the like) may see it before the queued commands are done
+static void cmdq_drain(void) {
+	struct goblin_accel_regs* accel_le = (struct goblin_accel_regs*)((char*)fb_base + GOBLIN_CMDQ_OFFSET);
+	WAIT_FOR_HW_LE(accel_le);
+}
+
+pascal void myStdText(short count, const void *textAddr, Point numer, Point denom) {
+	long oldA4 = SetCurrentA4();
+	StdTextProc old = oldStdText;
+	cmdq_drain();
+	SetA4(oldA4);
+	old(count, textAddr, numer, denom);
+}
+
+pascal void myStdBits(const BitMap *srcBits, const Rect *srcRect, const Rect *dstRect, short mode, RgnHandle maskRgn) {
+	long oldA4 = SetCurrentA4();
+	StdBitsProc old = oldStdBits;
+	cmdq_drain();
+	SetA4(oldA4);
+	old(srcBits, srcRect, dstRect, mode, maskRgn);
+}
+
+pascal void myShieldCursor(const Rect *shieldRect, Point offsetPt) {
+	long oldA4 = SetCurrentA4();
+	ShieldCursorProc old = oldShieldCursor;
+	cmdq_drain();
+	SetA4(oldA4);
+	old(shieldRect, offsetPt);
+}
+
+pascal void myHideCursor(void) {
+	long oldA4 = SetCurrentA4();
+	CursorProc old = oldHideCursor;
+	cmdq_drain();
+	SetA4(oldA4);
+	old();
+}
+
+pascal void myShowCursor(void) {
+	long oldA4 = SetCurrentA4();
+	CursorProc old = oldShowCursor;
+	cmdq_drain();
+	SetA4(oldA4);
+	old();
+}
+#endif
+
 pascal asm void myBitBlt(BitMap *srcBits, BitMap *maskBits, BitMap *dstBits, Rect *srcRect, Rect *maskRect, Rect *dstRect, short mode, Pattern *pat, RgnHandle rgnA, RgnHandle rgnB, RgnHandle rgnC, short multColor) {
 	// a2: srcrect
 	// a3: dstrect
@@ -372,6 +745,28 @@ void main(void)
 	oldBitBlt = (BitBltProc)GetToolTrapAddress(_BitBlt);
 	//*debug_ptr = (unsigned long)oldBitBlt;
 	SetToolTrapAddress((UniversalProcPtr)myBitBlt, _BitBlt);
+#ifdef GOBLIN_HOSTBLIT
+	{
+		long vm;
+		hostblit_ok = !((Gestalt(gestaltVMAttr, &vm) == noErr) && (vm & (1 << gestaltVMPresent))); // the ring is claimed for each band, see hostblit_claim
+	}
+#endif
+#ifdef GOBLIN_CMDQ
+	oldStdText = (StdTextProc)GetToolTrapAddress(_StdText);
+	SetToolTrapAddress((UniversalProcPtr)myStdText, _StdText);
+	oldStdBits = (StdBitsProc)GetToolTrapAddress(_StdBits);
+	SetToolTrapAddress((UniversalProcPtr)myStdBits, _StdBits);
+	oldShieldCursor = (ShieldCursorProc)GetToolTrapAddress(_ShieldCursor);
+	SetToolTrapAddress((UniversalProcPtr)myShieldCursor, _ShieldCursor);
+	oldHideCursor = (CursorProc)GetToolTrapAddress(_HideCursor);
+	SetToolTrapAddress((UniversalProcPtr)myHideCursor, _HideCursor);
+	oldShowCursor = (CursorProc)GetToolTrapAddress(_ShowCursor);
+	SetToolTrapAddress((UniversalProcPtr)myShowCursor, _ShowCursor);
+#endif
+#ifdef GOBLIN_LINES
+	oldStdLine = (StdLineProc)GetToolTrapAddress(_StdLine);
+	SetToolTrapAddress((UniversalProcPtr)myStdLine, _StdLine);
+#endif
 	
 	ShowInitIcon(121 + slot, true);
 	
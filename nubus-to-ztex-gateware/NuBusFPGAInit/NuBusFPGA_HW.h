@@ -6,10 +6,22 @@
 #define GOBLIN_BT_OFFSET       0x00900000
 #define GOBLIN_ACCEL_OFFSET    0x00901000
 #define GOBLIN_ACCEL_OFFSET_LE 0x00901800
+// generated with the gateware: GOBLIN_CMDQ_OFFSET (--goblin-cmdq, same layout as the _LE registers, then the words below),
+// DMA_RING_OFFSET (--dma-ring, descriptor ring then completion ring)
+#include "nubusfpga_soc.h"
+#if defined(GOBLIN_CMDQ) && !defined(GOBLIN_CMDQ_OFFSET)
+#error "GOBLIN_CMDQ needs a gateware built with --goblin-cmdq"
+#endif
+#if defined(GOBLIN_HOSTBLIT) && !defined(DMA_RING_OFFSET)
+#error "GOBLIN_HOSTBLIT needs a gateware built with --dma-ring"
+#endif
 
 
 #define GOBLIN_FB_OFFSET       0x00000000
 #define GOBLIN_PATTERN_OFFSET  0x007F0000 // 8 MiB - 64 KiB
+#define GOBLIN_STAGING_OFFSET  0x00700000 // host-source blits, sources fetched by the DMA ring
+#define GOBLIN_STAGING_SIZE    0x000F0000 // up to the pattern buffer
+#define GOBLIN_FB_SDRAM        0x0F800000 // where the first 8 MiB of the slot are in the SDRAM (for the DMA ring)
 
 #define u_int32_t volatile unsigned long 
 
@@ -26,6 +38,31 @@
 
 #define FUN_DONE_BIT           31
 
+// command queue, word offsets after the accelerator registers
+#define GOBLIN_CMDQ_SUBMITTED  0x20 // commands queued so far
+#define GOBLIN_CMDQ_DONE       0x21 // commands finished so far
+#define GOBLIN_CMDQ_FENCE      0x22 // write: queue a fence, read: last fence reached
+#define GOBLIN_CMDQ_FREE       0x23 // free entries
+#define GOBLIN_CMDQ_ROOM       32 // free entries needed before queuing a command (a full queue holds writes until a command is done: NuBus timeout)
+// DMA ring (--dma-ring), 4 words per descriptor (little-endian), see nubus_dma_ring.py
+#define DMA_RING_SIZE          64 // descriptors
+#define DMA_RING_BLOCK         16 // bytes per NuBus block
+#define DMA_RING_FROM_HOST     0x1 // flags
+#define DMA_RING_2D            0x2 // ... the next descriptor has the rows, SDRAM stride, host stride
+#define DMA_RING_CPL_ERROR     (1ul<<16) // completion word
+#define DMA_RING_OWNER_INIT    0x47 // id written to the owner CSR by the INIT (host blits), for one band at a time
+#define DMA_RING_TIMEOUT       30 // ticks to wait for a band before giving up
+
+// line engine (--goblin-lines), word offsets in the command queue window; writing LINE_CMD queues the line
+#define GOBLIN_CMDQ_LINE_X0    0x30 // pixels, from the top-left of the framebuffer
+#define GOBLIN_CMDQ_LINE_Y0    0x31
+#define GOBLIN_CMDQ_LINE_X1    0x32
+#define GOBLIN_CMDQ_LINE_Y1    0x33
+#define GOBLIN_CMDQ_LINE_COLOR 0x34 // pixel value
+#define GOBLIN_CMDQ_LINE_OP    0x35 // GX raster op, like reg_op
+#define GOBLIN_CMDQ_LINE_GEOM  0x36 // stride (bytes) in bits 0-15, log2 of the bytes per pixel in bits 16-17
+#define GOBLIN_CMDQ_LINE_CMD   0x37
+
 struct goblin_bt_regs {
 	u_int32_t mode;
 	u_int32_t vblmask;
@@ -0,0 +1,14 @@
+from migen import *
+
+from litex.soc.interconnect.csr import *
+
+# Snapshot trigger for a group of status CSRs
+# A write to a SnapshotControl pulses 'latch' for one cycle; the module owning it copies its counters into
+# its plain CSRStatus registers on that pulse (in whichever domain they are counted, see nubus_dma_sched)
+# and bumps a sequence number, so software reads a consistent set once the sequence has changed
+# The header generator emits <bank>_<control>() for the write (see nubus_to_fpga_export)
+class SnapshotControl(CSRStorage):
+    def __init__(self, name=None, description="Write to latch the snapshot registers"):
+        CSRStorage.__init__(self, fields = [CSRField("latch", size = 1, pulse = True, description = "Latch (any write does)")], name = name, description = description)
+        self.snapshot_control = True
+        self.latch = self.re
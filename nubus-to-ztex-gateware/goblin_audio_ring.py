@@ -0,0 +1,246 @@
+from migen import *
+
+import litex
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.csr import *
+
+from nubus_status_mirror import find_csr
+
+# Ring-buffer front-end for the goblin audio (HDMI), so the driver doesn't have to refill the two goblin buffers
+# on every buffer interrupt: the ring is 'periods' periods of 'period_bytes' bytes ('period_samples' samples) at 'base',
+# played continuously in order; the driver fills periods ahead and counts them in 'producer'
+# 'producer' counts from the enable (the hardware's count restarts at 0 then): before setting ctrl.enable, the driver writes
+# it with the number of periods already filled (0 if none), never the count left over from the previous run
+# The goblin still plays (format in its buf_desc, set by the driver); its two buffers are reprogrammed here (through
+# bus_mst and its CSRs, named as in the headers) with the next period each time one is finished
+# 'base' is a SoC address: in the SDRAM the goblin plays the periods where they are; with ctrl.host, it is a host
+# address (DMA region) and each period is first copied by incrementing Wishbone bursts (NuBus block reads
+# with --dma-bursts) to half of the 'staging' area (default: the goblin audio SRAM), the other half being played
+# ev: read: bit 0: half of the ring played, bit 1: all of it (i.e. a half can be refilled), bit 2: underrun
+#     write: 1s clear; raises irq when set and ctrl.irq_enable
+# When the next period isn't counted in 'producer' yet (underrun), a period of silence is played instead: the staging
+# half is zeroed and handed to the goblin, the ring doesn't move, and the period is retried on the next buffer
+# While not enabled, the goblin interrupt goes through unchanged for the old double-buffer driver ('owned' low)
+# Gateware only: NuBusFPGAHDMIAudio.c still uses the goblin double buffer directly, which this leaves alone
+goblin_audio_csrs = ["ctrl", "irqctrl", "buf0_addr", "buf0_size", "buf1_addr", "buf1_size"]
+
+# goblin audio register values, as NuBusFPGAHDMIAudio.c uses them (the goblin audio core itself is in VintageBusFPGA_Common)
+goblin_audio_ctrl_play = 0x00000100 # ctrl: play, starting with the buffer in bit 0 (CopySamplesToHardware: "play buf0")
+goblin_audio_ctrl_autostop = 0x00010000 # ctrl: stop after the buffer being played (StopHardware: "add auto-stop")
+goblin_audio_irq_enable = 0x1 # irqctrl: interrupt at the end of each buffer (ResumeHardware)
+goblin_audio_irq_clear = 0x2 # irqctrl: clear the pending interrupt (irqFct, with enable cleared: "clear & suspend")
+
+class GoblinAudioRing(Module, AutoCSR):
+    def __init__(self, soc, prefix="goblin_goblin_audio_", staging=0xF0920000):
+        self.soc = soc
+        self.prefix = prefix
+        self.bus_mst = wishbone.Interface()
+        self.goblin_irq = Signal() # active high, from the goblin audio
+        self.irq = Signal() # active high
+        self.owned = Signal() # the goblin audio is driven from here
+        self.period_done = Signal() # pulses once per period played (for irq_ctrl coalescing)
+
+        self.ctrl = CSRStorage(fields = [CSRField("enable", size = 1, description = "Play the ring (cleared: stop at the end of the current period)"),
+                                         CSRField("irq_enable", size = 1, description = "Interrupt on ev"),
+                                         CSRField("host", size = 1, description = "The ring is in host memory, copied to 'staging' period by period"),])
+        self.base = CSRStorage(32, description = "SoC address of the ring")
+        self.period_bytes = CSRStorage(32, description = "Bytes per period (multiple of 16)")
+        self.period_samples = CSRStorage(32, description = "Samples per period (goblin buffer size)")
+        self.periods = CSRStorage(8, reset = 2, description = "Periods in the ring (even)")
+        self.staging = CSRStorage(32, reset = staging, description = "SoC address of the two staging periods (host ring)")
+        self.producer = CSRStorage(16, description = "Periods filled by the driver since ctrl.enable was set (rewrite it before each enable)")
+        self.played = CSRStatus(16, description = "Periods played so far")
+        self.underruns = CSRStatus(32, description = "Periods of silence played because the next one wasn't filled")
+        self.ev = CSR(3)
+
+    def do_finalize(self):
+        bus_mst = self.bus_mst
+        regs = {}
+        for name in goblin_audio_csrs:
+            (adr, csr, nwords, busword) = find_csr(self.soc, self.prefix + name)
+            assert(nwords == 1)
+            regs[name] = adr >> 2
+
+        played = Signal(16)
+        underruns = Signal(32)
+        ev = Signal(3)
+        ev_set = Signal(3)
+        self.comb += [
+            self.played.status.eq(played),
+            self.underruns.status.eq(underruns),
+            self.ev.w.eq(ev),
+            self.irq.eq(self.ctrl.fields.irq_enable & (ev != 0)),
+        ]
+        self.sync += ev.eq((ev & ~Mux(self.ev.re, self.ev.r, 0)) | ev_set)
+
+        buf = Signal() # goblin buffer being (re)loaded
+        silence = Signal() # the load is a period of silence (underrun)
+        silent = Signal(2) # per goblin buffer, it holds silence
+        starting = Signal() # loading both buffers before playing
+        slot = Signal(8) # ring period of the next load
+        slot_adr = Signal(32)
+        queued = Signal(16) # periods handed to the goblin so far
+        src = Signal(32)
+        dst = Signal(32)
+        left = Signal(32 - 4)
+        idx = Signal(2)
+        blk = Signal(128)
+        pos = Signal(8) # period of the ring being played
+        ahead = Signal(16) # periods filled but not handed to the goblin yet
+        self.comb += ahead.eq(self.producer.storage - queued)
+
+        def csr_write(state, adr, value, next_state, *extra):
+            audio_fsm.act(state,
+                          bus_mst.cyc.eq(1),
+                          bus_mst.stb.eq(1),
+                          bus_mst.we.eq(1),
+                          bus_mst.adr.eq(adr),
+                          bus_mst.dat_w.eq(value),
+                          bus_mst.sel.eq(0xf),
+                          If(bus_mst.ack | bus_mst.err,
+                             *extra,
+                             NextState(next_state),
+                          )
+            )
+
+        self.submodules.audio_fsm = audio_fsm = FSM(reset_state = "Reset")
+        self.comb += self.owned.eq(~audio_fsm.ongoing("Idle"))
+        audio_fsm.act("Reset",
+                      NextState("Idle"),)
+        audio_fsm.act("Idle",
+                      If(self.ctrl.fields.enable,
+                         NextValue(played, 0),
+                         NextValue(pos, 0),
+                         NextValue(queued, 0),
+                         NextValue(slot, 0),
+                         NextValue(slot_adr, self.base.storage),
+                         NextValue(buf, 0),
+                         NextValue(starting, 1),
+                         NextState("Load"),
+                      )
+        )
+        # next period to goblin buffer 'buf'
+        audio_fsm.act("Load",
+                      If(ahead[15] | (ahead == 0), # the driver is behind: zero the staging half and play that
+                         ev_set[2].eq(1),
+                         NextValue(underruns, underruns + 1),
+                         NextValue(silence, 1),
+                         NextValue(blk, 0),
+                         NextValue(dst, self.staging.storage + Mux(buf, self.period_bytes.storage, 0)),
+                         NextValue(left, self.period_bytes.storage[4:32]),
+                         NextValue(idx, 0),
+                         If(self.period_bytes.storage[4:32] != 0,
+                            NextState("CopyWrite"),
+                         ).Else(
+                             NextState("SetAddr"),
+                         )
+                      ).Else(
+                          NextValue(silence, 0),
+                          NextValue(src, slot_adr),
+                          NextValue(dst, self.staging.storage + Mux(buf, self.period_bytes.storage, 0)),
+                          NextValue(left, self.period_bytes.storage[4:32]),
+                          NextValue(idx, 0),
+                          If(self.ctrl.fields.host & (self.period_bytes.storage[4:32] != 0),
+                             NextState("CopyRead"),
+                          ).Else(
+                              NextState("SetAddr"),
+                          )
+                      )
+        )
+        # one block from the host, in a single burst
+        audio_fsm.act("CopyRead",
+                      bus_mst.cyc.eq(1),
+                      bus_mst.stb.eq(1),
+                      bus_mst.we.eq(0),
+                      bus_mst.adr.eq(src[2:32] + idx),
+                      bus_mst.sel.eq(0xf),
+                      bus_mst.cti.eq(Mux(idx == 3, 0b111, 0b010)),
+                      bus_mst.bte.eq(0b00),
+                      If(bus_mst.ack | bus_mst.err,
+                         NextValue(blk, Cat(blk[32:128], bus_mst.dat_r)),
+                         NextValue(idx, idx + 1),
+                         If(idx == 3,
+                            NextState("CopyWrite"),
+                         )
+                      )
+        )
+        audio_fsm.act("CopyWrite",
+                      bus_mst.cyc.eq(1),
+                      bus_mst.stb.eq(1),
+                      bus_mst.we.eq(1),
+                      bus_mst.adr.eq(dst[2:32] + idx),
+                      bus_mst.dat_w.eq(blk[0:32]),
+                      bus_mst.sel.eq(0xf),
+                      If(bus_mst.ack | bus_mst.err,
+                         NextValue(blk, blk[32:128]),
+                         NextValue(idx, idx + 1),
+                         If(idx == 3,
+                            NextValue(src, src + 16),
+                            NextValue(dst, dst + 16),
+                            NextValue(left, left - 1),
+                            If(left == 1,
+                               NextState("SetAddr"),
+                            ).Elif(~silence, # silence: blk is all zeroes, only writes
+                                   NextState("CopyRead"),
+                            )
+                         )
+                      )
+        )
+        # buf1 registers like buf0's
+        csr_write("SetAddr", Mux(buf, regs["buf1_addr"], regs["buf0_addr"]),
+                  Mux(self.ctrl.fields.host | silence, self.staging.storage + Mux(buf, self.period_bytes.storage, 0), slot_adr), "SetSize")
+        csr_write("SetSize", Mux(buf, regs["buf1_size"], regs["buf0_size"]), self.period_samples.storage, "Loaded")
+        audio_fsm.act("Loaded",
+                      NextValue(buf, ~buf),
+                      If(buf,
+                         NextValue(silent[1], silence),
+                      ).Else(
+                          NextValue(silent[0], silence),
+                      ),
+                      If(~silence, # the ring only moves for a real period
+                         NextValue(queued, queued + 1),
+                         If(slot == self.periods.storage - 1,
+                            NextValue(slot, 0),
+                            NextValue(slot_adr, self.base.storage),
+                         ).Else(
+                             NextValue(slot, slot + 1),
+                             NextValue(slot_adr, slot_adr + self.period_bytes.storage),
+                         ),
+                      ),
+                      If(starting & ~buf,
+                         NextState("Load"), # and the other one
+                      ).Elif(starting,
+                             NextValue(starting, 0),
+                             NextState("StartIrq"),
+                      ).Else(
+                          NextState("Run"),
+                      )
+        )
+        csr_write("StartIrq", regs["irqctrl"], goblin_audio_irq_enable | goblin_audio_irq_clear, "StartPlay")
+        csr_write("StartPlay", regs["ctrl"], goblin_audio_ctrl_play, "Run") # play buf0, then buf1 and so on
+        # 'buf' is being played
+        audio_fsm.act("Run",
+                      If(~self.ctrl.fields.enable,
+                         NextState("Stop"),
+                      ).Elif(self.goblin_irq, # finished, the goblin went on with the other one: refill it
+                             NextState("Ack"),
+                      )
+        )
+        # 'buf' is the one that just finished
+        csr_write("Ack", regs["irqctrl"], goblin_audio_irq_enable | goblin_audio_irq_clear, "Load",
+                  If(~Mux(buf, silent[1], silent[0]),
+                     self.period_done.eq(1),
+                     NextValue(played, played + 1),
+                     If(pos == self.periods.storage - 1,
+                        NextValue(pos, 0),
+                        ev_set[1].eq(1),
+                     ).Else(
+                         NextValue(pos, pos + 1),
+                         If(pos + 1 == self.periods.storage[1:8],
+                            ev_set[0].eq(1),
+                         )
+                     )
+                  )
+        )
+        csr_write("Stop", regs["ctrl"], goblin_audio_ctrl_autostop | goblin_audio_ctrl_play | buf, "StopIrq") # auto-stop after the current one
+        csr_write("StopIrq", regs["irqctrl"], goblin_audio_irq_clear, "Idle") # disable, clear
@@ -0,0 +1,193 @@
+from migen import *
+from migen.genlib.fifo import *
+
+import litex
+from litex.soc.interconnect import wishbone
+
+from goblin_line import line_regs
+
+# Command queue in front of the Goblin accelerator
+# bus_slv is a window laid out like the accelerator registers (struct goblin_accel_regs, 68k byte order like the _LE window),
+# writes are queued instead of going to the accelerator, so the Mac doesn't wait for the previous operation
+# bus_mst replays them to the accelerator registers (at 'accel_base', Wishbone byte order), one command at a time:
+# before anything is written, the command in progress (if any) has to be finished (WORK_IN_PROGRESS down)
+# Word addresses of the window:
+# 0x00-0x13: accelerator registers; writing reg_cmd (0x01) queues the command with the registers written before it
+#            reading reg_status (0x00) gives WORK_IN_PROGRESS while anything is queued or running, like the accelerator
+# 0x20: read: commands queued so far (sequence number of the last one)
+# 0x21: read: commands finished so far
+# 0x22: write: queue a fence; read: value of the last fence reached (everything queued before it is finished)
+# 0x23: read: free entries in the queue (writes wait when it's full, until a whole command is done: long enough for
+#       a NuBus timeout, so the driver checks there's room for a command before queuing it)
+# 0x30-0x37: line engine (goblin_line) when there is one: x0, y0, x1, y1, color, op, geom, and writing 0x37 queues the line;
+#            lines are commands like the others (submitted/done/fences/status), run after the previous command is finished
+goblin_cmdq_nregs = 20
+goblin_cmdq_reg_status = 0x00
+goblin_cmdq_reg_cmd = 0x01
+goblin_cmdq_submitted = 0x20
+goblin_cmdq_done = 0x21
+goblin_cmdq_fence = 0x22
+goblin_cmdq_free = 0x23
+goblin_cmdq_line = 0x30
+goblin_cmdq_line_cmd = 0x37
+
+class GoblinCmdQueue(Module):
+    def __init__(self, accel_base, depth=256, line=None):
+        self.bus_slv = bus_slv = wishbone.Interface()
+        self.bus_mst = bus_mst = wishbone.Interface()
+        self.fence_event = Signal() # a fence was reached (for a CompletionWriter)
+        self.fence_status = Signal(16) # ... low bits of its value
+
+        fence_idx = 0x1F
+        line_idx = goblin_cmdq_nregs # line registers go in the queue after the accelerator's
+        line_cmd_idx = line_idx + len(line_regs)
+        self.submodules.fifo = fifo = SyncFIFOBuffered(width = 5 + 32, depth = depth)
+        fifo_idx = Signal(5)
+        fifo_val = Signal(32)
+        self.comb += [
+            fifo_idx.eq(fifo.dout[0:5]),
+            fifo_val.eq(fifo.dout[5:37]),
+        ]
+
+        submitted = Signal(32)
+        done = Signal(32)
+        fence = Signal(32)
+        running = Signal() # a command was started and hasn't been seen finished
+        line_running = Signal() # same for a line
+        busy = Signal()
+        self.comb += busy.eq(fifo.readable | running | line_running)
+
+        def be(v): # 68k byte order
+            w = Signal(32)
+            self.comb += w.eq(v)
+            return Cat(w[24:32], w[16:24], w[ 8:16], w[ 0: 8])
+
+        # window
+        adr = Signal(10)
+        self.comb += adr.eq(bus_slv.adr[0:10])
+        read_cases = {
+            goblin_cmdq_reg_status: [ NextValue(bus_slv.dat_r, be(busy)), ],
+            goblin_cmdq_submitted: [ NextValue(bus_slv.dat_r, be(submitted)), ],
+            goblin_cmdq_done: [ NextValue(bus_slv.dat_r, be(done)), ],
+            goblin_cmdq_fence: [ NextValue(bus_slv.dat_r, be(fence)), ],
+            goblin_cmdq_free: [ NextValue(bus_slv.dat_r, be(depth - fifo.level)), ],
+            "default": [ NextValue(bus_slv.dat_r, 0), ],
+        }
+        queued = Signal() # the write goes in the queue
+        is_line = Signal()
+        is_cmd = Signal()
+        if (line is not None):
+            self.comb += is_line.eq((adr >= goblin_cmdq_line) & (adr <= goblin_cmdq_line_cmd))
+        self.comb += [
+            queued.eq(((adr < goblin_cmdq_nregs) & (adr != goblin_cmdq_reg_status)) | (adr == goblin_cmdq_fence) | is_line),
+            is_cmd.eq((adr == goblin_cmdq_reg_cmd) | (is_line & (adr == goblin_cmdq_line_cmd))),
+            fifo.din.eq(Cat(Mux(adr == goblin_cmdq_fence, fence_idx, Mux(is_line, adr - goblin_cmdq_line + line_idx, adr))[0:5], be(bus_slv.dat_w))),
+        ]
+        self.submodules.wishbone_fsm = wishbone_fsm = FSM(reset_state = "Reset")
+        wishbone_fsm.act("Reset",
+                         NextValue(bus_slv.ack, 0),
+                         NextState("Idle"))
+        wishbone_fsm.act("Idle",
+                         If(bus_slv.cyc & bus_slv.stb & bus_slv.we & ~bus_slv.ack, #write
+                            If(queued,
+                               If(fifo.writable,
+                                  fifo.we.eq(1),
+                                  If(is_cmd,
+                                     NextValue(submitted, submitted + 1),
+                                  ),
+                                  NextValue(bus_slv.ack, 1),
+                               ), # else wait for room
+                            ).Else(
+                                NextValue(bus_slv.ack, 1),
+                            )
+                         ).Elif(bus_slv.cyc & bus_slv.stb & ~bus_slv.we & ~bus_slv.ack, #read
+                                Case(adr, read_cases),
+                                NextValue(bus_slv.ack, 1),
+                         ).Else(
+                             NextValue(bus_slv.ack, 0),
+                         )
+        )
+
+        # replay
+        accel_adr = accel_base >> 2
+        self.comb += [
+            bus_mst.sel.eq(0xf),
+            bus_mst.cti.eq(0b000),
+        ]
+        self.submodules.replay_fsm = replay_fsm = FSM(reset_state = "Reset")
+        replay_fsm.act("Reset",
+                       NextState("Idle"))
+        # the line engine takes its registers from here, they don't go on the bus
+        line_starts = []
+        if (line is not None):
+            line_setters = {
+                line_idx + 0: [ NextValue(line.x0, fifo_val[0:16]), ],
+                line_idx + 1: [ NextValue(line.y0, fifo_val[0:16]), ],
+                line_idx + 2: [ NextValue(line.x1, fifo_val[0:16]), ],
+                line_idx + 3: [ NextValue(line.y1, fifo_val[0:16]), ],
+                line_idx + 4: [ NextValue(line.color, fifo_val), ],
+                line_idx + 5: [ NextValue(line.op, fifo_val[0:4]), ],
+                line_idx + 6: [ NextValue(line.stride, fifo_val[0:16]), NextValue(line.depth, fifo_val[16:18]), ],
+            }
+            self.sync += If(line_running & ~line.busy,
+                            line_running.eq(0),
+                            done.eq(done + 1),
+            )
+            line_starts = [
+                If((fifo_idx >= line_idx) & (fifo_idx < line_cmd_idx),
+                   fifo.re.eq(1),
+                   Case(fifo_idx, line_setters),
+                ).Elif(fifo_idx == line_cmd_idx,
+                       fifo.re.eq(1),
+                       line.start.eq(1),
+                       NextValue(line_running, 1),
+                )
+            ]
+        replay_fsm.act("Idle",
+                       If(running,
+                          NextState("Poll"),
+                       ).Elif(fifo.readable & ~line_running,
+                              If(fifo_idx == fence_idx,
+                                 fifo.re.eq(1),
+                                 NextValue(fence, fifo_val),
+                                 self.fence_event.eq(1),
+                                 self.fence_status.eq(fifo_val[0:16]),
+                              ).Elif(fifo_idx >= line_idx,
+                                     *line_starts,
+                              ).Else(
+                                  NextState("Write"),
+                              )
+                       )
+        )
+        replay_fsm.act("Write",
+                       bus_mst.cyc.eq(1),
+                       bus_mst.stb.eq(1),
+                       bus_mst.we.eq(1),
+                       bus_mst.adr.eq(accel_adr + fifo_idx),
+                       bus_mst.dat_w.eq(fifo_val),
+                       If(bus_mst.ack | bus_mst.err,
+                          fifo.re.eq(1),
+                          If(fifo_idx == goblin_cmdq_reg_cmd,
+                             NextValue(running, 1),
+                          ),
+                          NextState("Idle"),
+                       )
+        )
+        # the accelerator raises WORK_IN_PROGRESS when reg_cmd is written, so the first read already sees it
+        replay_fsm.act("Poll",
+                       bus_mst.cyc.eq(1),
+                       bus_mst.stb.eq(1),
+                       bus_mst.we.eq(0),
+                       bus_mst.adr.eq(accel_adr + goblin_cmdq_reg_status),
+                       If(bus_mst.err,
+                          NextValue(running, 0),
+                          NextValue(done, done + 1),
+                          NextState("Idle"),
+                       ).Elif(bus_mst.ack,
+                              If(~bus_mst.dat_r[0],
+                                 NextValue(running, 0),
+                                 NextValue(done, done + 1),
+                              ),
+                              NextState("Idle"),
+                       )
+        )
@@ -0,0 +1,92 @@
+from migen import *
+
+import litex
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.csr import *
+
+from nubus_status_mirror import find_csr
+
+# Double-buffered scanout for the goblin framebuffer: the driver renders into a back buffer in the SDRAM,
+# writes its base in 'pending', and the flip happens at the next vertical blank, no copy and no tearing
+# The scanout base itself is a CSR of the goblin ('target', named as in the generated headers), written here
+# through bus_mst when the vertical blank starts, so 'pending' is in the same units as that register
+# 'vbl' is the goblin's VBL interrupt (active high, sys), so its VBL interrupt must be enabled (vblmask)
+# active: current scanout base (the goblin's register)
+# status: a flip is armed (pending written, vertical blank not reached yet)
+# done: read: flips done since last cleared, write: 1 clears; raises irq when irq_enable is set
+class GoblinFlip(Module, AutoCSR):
+    def __init__(self, soc, target):
+        self.soc = soc
+        self.target = target
+        self.bus_mst = wishbone.Interface()
+        self.vbl = Signal() # active high
+        self.irq = Signal() # active high
+
+        self.pending = CSRStorage(32, description = "Scanout base of the next frame (writing it arms the flip)")
+        self.active = CSRStatus(32, description = "Scanout base of the current frame")
+        self.status = CSRStatus(fields = [CSRField("armed", size = 1, description = "A flip waits for the vertical blank"),])
+        self.ctrl = CSRStorage(fields = [CSRField("irq_enable", size = 1, description = "Interrupt (fb) when a flip is done"),])
+        self.done = CSR(1)
+        self.flips = CSRStatus(32, description = "Flips done so far")
+
+    def do_finalize(self):
+        bus_mst = self.bus_mst
+        (adr, csr, nwords, busword) = find_csr(self.soc, self.target)
+        step = self.soc.csr.alignment//8
+
+        armed = Signal()
+        done = Signal()
+        flips = Signal(32)
+        vbl_d = Signal()
+        flipped = Signal() # the new base was written
+        word = Signal(max = max(2, nwords))
+        base = Signal(32)
+        self.comb += [
+            self.active.status.eq(csr.storage),
+            self.status.fields.armed.eq(armed),
+            self.done.w.eq(done),
+            self.flips.status.eq(flips),
+            self.irq.eq(done & self.ctrl.fields.irq_enable),
+        ]
+        self.sync += [
+            vbl_d.eq(self.vbl),
+            If(self.pending.re, # again for the next one if written during the flip
+               armed.eq(1),
+            ).Elif(flipped,
+                   armed.eq(0),
+            ),
+            If(flipped,
+               done.eq(1),
+               flips.eq(flips + 1),
+            ).Elif(self.done.re & self.done.r,
+                   done.eq(0),
+            ),
+        ]
+
+        self.submodules.flip_fsm = flip_fsm = FSM(reset_state = "Reset")
+        flip_fsm.act("Reset",
+                     NextState("Idle"),)
+        flip_fsm.act("Idle",
+                     If(self.vbl & ~vbl_d & armed, # start of the vertical blank
+                        NextValue(base, self.pending.storage),
+                        NextValue(word, 0),
+                        NextState("Write"),
+                     )
+        )
+        # big ordering, most significant word first
+        flip_fsm.act("Write",
+                     bus_mst.cyc.eq(1),
+                     bus_mst.stb.eq(1),
+                     bus_mst.we.eq(1),
+                     bus_mst.adr.eq((adr >> 2) + word*(step >> 2)),
+                     bus_mst.dat_w.eq(Array([ base[(nwords - 1 - k)*busword:min((nwords - k)*busword, 32)] for k in range(nwords) ])[word]),
+                     bus_mst.sel.eq(0xf),
+                     bus_mst.cti.eq(0b000),
+                     If(bus_mst.ack | bus_mst.err,
+                        NextValue(word, word + 1),
+                        If(word == (nwords - 1),
+                           flipped.eq(1),
+                           NextState("Idle"),
+                        )
+                     )
+        )
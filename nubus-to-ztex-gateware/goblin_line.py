@@ -0,0 +1,142 @@
+from migen import *
+
+import litex
+from litex.soc.interconnect import wishbone
+
+# Bresenham line engine for the framebuffer, driven through the Goblin command queue (goblin_cmdq)
+# Draws from (x0, y0) to (x1, y1), both ends included, one pixel at a time through 'bus' (to the SDRAM)
+# 'op' is an X11-style raster op like the accelerator's reg_op (3: GXcopy, 6: GXxor, ...), applied between
+# 'color' (the pixel value) and the framebuffer; GXcopy is a plain write, the others a read-modify-write
+# 'depth' is log2 of the bytes per pixel (0: 8 bits, 1: 16 bits, 2: 32 bits), 'stride' the bytes per line
+# Pixels are in 68k byte order in the framebuffer (the first byte of a pixel is its most significant)
+# No clipping, the driver only sends lines that are entirely visible
+line_regs = ["x0", "y0", "x1", "y1", "color", "op", "geom"] # geom: stride in bits 0-15, depth in bits 16-17
+
+class GoblinLineEngine(Module):
+    def __init__(self, fb_base):
+        self.bus = bus = wishbone.Interface()
+
+        self.start = Signal()
+        self.busy = Signal()
+        self.x0 = Signal(16)
+        self.y0 = Signal(16)
+        self.x1 = Signal(16)
+        self.y1 = Signal(16)
+        self.color = Signal(32)
+        self.op = Signal(4)
+        self.stride = Signal(16)
+        self.depth = Signal(2)
+
+        x = Signal((18, True))
+        y = Signal((18, True))
+        x_end = Signal((18, True))
+        y_end = Signal((18, True))
+        dx = Signal((18, True)) # |x1 - x0|
+        dy = Signal((18, True)) # -|y1 - y0|
+        sx = Signal() # x decreases
+        sy = Signal() # y decreases
+        err = Signal((20, True))
+        e2 = Signal((21, True))
+        adr = Signal(32) # byte address of the pixel
+        xstep = Signal((32, True))
+        ystep = Signal((32, True))
+        old = Signal(32)
+        op = Signal(4)
+        color = Signal(32)
+        depth = Signal(2)
+        step_x = Signal()
+        step_y = Signal()
+        self.comb += [
+            e2.eq(err << 1),
+            step_x.eq(e2 >= dy),
+            step_y.eq(e2 <= dx),
+        ]
+
+        # the pixel in its byte lanes
+        cword = Signal(32)
+        sel = Signal(4)
+        self.comb += [
+            Case(depth, {
+                0: [ cword.eq(Replicate(color[0:8], 4)),
+                     sel.eq(1 << adr[0:2]), ],
+                1: [ cword.eq(Replicate(Cat(color[8:16], color[0:8]), 2)),
+                     sel.eq(Mux(adr[1], 0b1100, 0b0011)), ],
+                "default": [ cword.eq(Cat(color[24:32], color[16:24], color[8:16], color[0:8])),
+                             sel.eq(0b1111), ],
+            }),
+        ]
+        # raster op, bit k of 'op' is the result for (src, dst) = (~k[1], ~k[0]) like GXcopy = 0b0011
+        rop = Signal(32)
+        self.comb += rop.eq((Replicate(op[0], 32) &  cword &  old) |
+                            (Replicate(op[1], 32) &  cword & ~old) |
+                            (Replicate(op[2], 32) & ~cword &  old) |
+                            (Replicate(op[3], 32) & ~cword & ~old))
+
+        self.submodules.line_fsm = line_fsm = FSM(reset_state = "Reset")
+        self.comb += self.busy.eq(~line_fsm.ongoing("Idle"))
+        line_fsm.act("Reset",
+                     NextState("Idle"),)
+        line_fsm.act("Idle",
+                     If(self.start,
+                        NextValue(x, self.x0),
+                        NextValue(y, self.y0),
+                        NextValue(x_end, self.x1),
+                        NextValue(y_end, self.y1),
+                        NextValue(sx, self.x1 < self.x0),
+                        NextValue(sy, self.y1 < self.y0),
+                        NextValue(dx, Mux(self.x1 < self.x0, self.x0 - self.x1, self.x1 - self.x0)),
+                        NextValue(dy, -Mux(self.y1 < self.y0, self.y0 - self.y1, self.y1 - self.y0)),
+                        NextValue(err, Mux(self.x1 < self.x0, self.x0 - self.x1, self.x1 - self.x0) - Mux(self.y1 < self.y0, self.y0 - self.y1, self.y1 - self.y0)),
+                        NextValue(adr, fb_base + self.y0 * self.stride + (self.x0 << self.depth)),
+                        NextValue(xstep, Mux(self.x1 < self.x0, -(1 << self.depth), (1 << self.depth))),
+                        NextValue(ystep, Mux(self.y1 < self.y0, -self.stride, self.stride)),
+                        NextValue(op, self.op),
+                        NextValue(color, self.color),
+                        NextValue(depth, self.depth),
+                        NextState("Pixel"),
+                     )
+        )
+        line_fsm.act("Pixel",
+                     If(op == 0b0011, # GXcopy
+                        NextState("Write"),
+                     ).Else(
+                         NextState("Read"),
+                     )
+        )
+        line_fsm.act("Read",
+                     bus.cyc.eq(1),
+                     bus.stb.eq(1),
+                     bus.we.eq(0),
+                     bus.adr.eq(adr[2:32]),
+                     bus.sel.eq(0xf),
+                     If(bus.ack | bus.err,
+                        NextValue(old, bus.dat_r),
+                        NextState("Write"),
+                     )
+        )
+        line_fsm.act("Write",
+                     bus.cyc.eq(1),
+                     bus.stb.eq(1),
+                     bus.we.eq(1),
+                     bus.adr.eq(adr[2:32]),
+                     bus.dat_w.eq(rop),
+                     bus.sel.eq(sel),
+                     If(bus.ack | bus.err,
+                        NextState("Step"),
+                     )
+        )
+        line_fsm.act("Step",
+                     If((x == x_end) & (y == y_end),
+                        NextState("Idle"),
+                     ).Else(
+                         NextValue(err, err + Mux(step_x, dy, 0) + Mux(step_y, dx, 0)),
+                         If(step_x,
+                            NextValue(x, Mux(sx, x - 1, x + 1)),
+                         ),
+                         If(step_y,
+                            NextValue(y, Mux(sy, y - 1, y + 1)),
+                         ),
+                         NextValue(adr, adr + Mux(step_x, xstep, 0) + Mux(step_y, ystep, 0)),
+                         NextState("Pixel"),
+                     )
+        )
@@ -6,14 +6,26 @@ from litex.soc.interconnect.csr import *
 
 import litex
 
+# MDIO (clause 22) master
+# Accesses come from a command queue: the driver stages entries in queue_cmd, then writes doorbell to run them all
+# Read results go to the result FIFO (result / result_next)
+# The single-access interface (reg_addr, phy_addr, mdio_write, mdio_command, mdio_status, mdio_read) still works,
+# it queues one access and runs it at once; don't mix it with staged entries
+# Autopoll reads one or two PHY registers every 'autopoll_interval' cycles when the queue is idle,
+# and raises the 'change' event when a value differs from the previous poll
+# irq is active high, (ev_pending & ev_enable) != 0, pending events are cleared by writing 1s to ev_clear
 class MDIOCtrl(Module, AutoCSR):
-    def __init__(self, platform):
-        
-        div_clk_begin = 39
-        div_clk_half = 20
+    def __init__(self, platform, sys_clk_freq=100e6, queue_depth=16):
+
+        mdc_freq = 2.5e6 # maximum for clause 22
+        div_clk_begin = int(-(-sys_clk_freq // mdc_freq)) - 1 # round the period up, 39 at 100 MHz
+        div_clk_half = (div_clk_begin + 1) // 2
 
         div_clk_state_change = 2
-        
+        assert(div_clk_half > div_clk_state_change)
+
+        self.irq = Signal()
+
         sig_mdc = platform.request("sep_mdc");
         sig_mdio = platform.request("sep_mdio");
         mdio_o = Signal()
@@ -22,9 +34,8 @@ class MDIOCtrl(Module, AutoCSR):
 
         clk_div = Signal(log2_int(div_clk_begin, False))
         int_cnt = Signal(log2_int(32))
-        rdata = Signal(32) # DEBUG, should be 16, FIXME
-        cmd_recv = Signal()
-        
+        rdata = Signal(16)
+
         self.specials += Tristate(sig_mdio, mdio_o, mdio_oe, mdio_i)
 
         self.reg_addr = reg_addr = CSRStorage(fields = [CSRField("reg_addr",  5, description = "Reg Addr"),
@@ -39,15 +50,154 @@ class MDIOCtrl(Module, AutoCSR):
                                                              CSRField("reserved", 30, description = "Reserved"),])
         self.mdio_write = mdio_write = CSRStorage(fields = [CSRField("val",  16, description = "writeval"),
                                                             CSRField("reserved", 16, description = "Reserved"),])
-        #self.mdio_read = mdio_read = CSRStatus(fields = [CSRField("val",  16, description = "readval"),
-        #                                                 CSRField("reserved", 16, description = "Reserved"),])
-        self.mdio_read = mdio_read = CSRStatus(fields = [CSRField("val",  32, description = "readval"),]) # DEBUG, should be 16, FIXME
-        
+        self.mdio_read = mdio_read = CSRStatus(fields = [CSRField("val",  16, description = "readval"),
+                                                         CSRField("reserved", 16, description = "Reserved"),])
+
+        # queue
+        self.queue_cmd = queue_cmd = CSRStorage(fields = [CSRField("val", 16, description = "Value to write"),
+                                                          CSRField("reg_addr", 5, description = "Reg Addr"),
+                                                          CSRField("phy_addr", 5, description = "Phy Addr"),
+                                                          CSRField("write", 1, description = "Write (1) or read (0)"),
+                                                          CSRField("reserved", 5, description = "Reserved"),])
+        self.doorbell = doorbell = CSRStorage(fields = [CSRField("run", 1, pulse = True, description = "Run the staged entries"),])
+        self.queue_status = queue_status = CSRStatus(fields = [CSRField("pending", 8, description = "Entries in the queue (staged or not)"),
+                                                               CSRField("results", 8, description = "Entries in the result FIFO"),
+                                                               CSRField("full", 1, description = "Queue full, new entries are dropped"),])
+        self.result = result = CSRStatus(fields = [CSRField("val", 16, description = "Value read"),
+                                                   CSRField("reg_addr", 5, description = "Reg Addr"),
+                                                   CSRField("phy_addr", 5, description = "Phy Addr"),
+                                                   CSRField("valid", 1, description = "The result FIFO isn't empty"),])
+        self.result_next = result_next = CSRStorage(fields = [CSRField("pop", 1, pulse = True, description = "Drop the current result"),])
+
+        # autopoll
+        self.autopoll_ctrl = autopoll_ctrl = CSRStorage(fields = [CSRField("enable", 1, description = "Enable autopoll"),
+                                                                  CSRField("phy_addr", 5, description = "Phy Addr"),
+                                                                  CSRField("reg0", 5, reset = 1, description = "First register (BMSR)"),
+                                                                  CSRField("reg1", 5, description = "Second register"),
+                                                                  CSRField("reg1_enable", 1, description = "Poll the second register too"),])
+        self.autopoll_interval = autopoll_interval = CSRStorage(32, reset = int(sys_clk_freq) // 10, description = "Cycles between polls")
+        self.autopoll_value = autopoll_value = CSRStatus(fields = [CSRField("reg0", 16, description = "Last value of the first register"),
+                                                                   CSRField("reg1", 16, description = "Last value of the second register"),])
+
+        # events
+        self.ev_enable = ev_enable = CSRStorage(fields = [CSRField("done", 1, description = "Interrupt when the queue has run"),
+                                                          CSRField("change", 1, description = "Interrupt when a polled register changes"),])
+        self.ev_pending = ev_pending = CSRStatus(fields = [CSRField("done", 1, description = "The queue has run"),
+                                                           CSRField("change", 1, description = "A polled register has changed"),])
+        self.ev_clear = ev_clear = CSRStorage(fields = [CSRField("done", 1, description = "Clear done"),
+                                                        CSRField("change", 1, description = "Clear change"),])
+
+        cmd_layout = [
+            ("val", 16),
+            ("reg_addr", 5),
+            ("phy_addr", 5),
+            ("write", 1),
+            ("noresult", 1), # single-access interface, result only in mdio_read
+        ]
+        res_layout = [
+            ("val", 16),
+            ("reg_addr", 5),
+            ("phy_addr", 5),
+        ]
+        self.submodules.cmd_fifo = cmd_fifo = SyncFIFOBuffered(width = layout_len(cmd_layout), depth = queue_depth)
+        self.submodules.res_fifo = res_fifo = SyncFIFOBuffered(width = layout_len(res_layout), depth = queue_depth)
+        cmd_din = Record(cmd_layout)
+        cmd_dout = Record(cmd_layout)
+        res_din = Record(res_layout)
+        res_dout = Record(res_layout)
+        self.comb += [
+            cmd_fifo.din.eq(cmd_din.raw_bits()),
+            cmd_dout.raw_bits().eq(cmd_fifo.dout),
+            res_fifo.din.eq(res_din.raw_bits()),
+            res_dout.raw_bits().eq(res_fifo.dout),
+        ]
+
+        staged = Signal(max = queue_depth + 2) # pushed since the last doorbell
+        armed = Signal(max = queue_depth + 2) # may run
+        arm_inc = Signal(max = queue_depth + 2)
+        arm_dec = Signal()
+        self.comb += [
+            If(queue_cmd.re,
+               cmd_din.val.eq(queue_cmd.fields.val),
+               cmd_din.reg_addr.eq(queue_cmd.fields.reg_addr),
+               cmd_din.phy_addr.eq(queue_cmd.fields.phy_addr),
+               cmd_din.write.eq(queue_cmd.fields.write),
+               cmd_din.noresult.eq(0),
+            ).Else(
+                cmd_din.val.eq(mdio_write.fields.val),
+                cmd_din.reg_addr.eq(reg_addr.fields.reg_addr),
+                cmd_din.phy_addr.eq(phy_addr.fields.phy_addr),
+                cmd_din.write.eq(mdio_command.fields.write),
+                cmd_din.noresult.eq(1),
+            ),
+            cmd_fifo.we.eq(queue_cmd.re | mdio_command.re),
+            If(mdio_command.re & cmd_fifo.writable,
+               arm_inc.eq(1),
+            ).Elif(doorbell.fields.run,
+                   arm_inc.eq(staged),
+            ),
+        ]
+        self.sync += [
+            armed.eq(armed + arm_inc - arm_dec),
+            If(doorbell.fields.run,
+               staged.eq(0),
+            ).Elif(queue_cmd.re & cmd_fifo.writable,
+                   staged.eq(staged + 1),
+            ),
+        ]
+
+        self.comb += [
+            queue_status.fields.pending.eq(cmd_fifo.level),
+            queue_status.fields.results.eq(res_fifo.level),
+            queue_status.fields.full.eq(~cmd_fifo.writable),
+            result.fields.val.eq(res_dout.val),
+            result.fields.reg_addr.eq(res_dout.reg_addr),
+            result.fields.phy_addr.eq(res_dout.phy_addr),
+            result.fields.valid.eq(res_fifo.readable),
+            res_fifo.re.eq(result_next.fields.pop),
+        ]
+
+        # autopoll
+        poll_timer = Signal(32)
+        poll_due = Signal()
+        poll_idx = Signal() # register being polled
+        poll_last = Array(Signal(16) for i in range(2))
+        poll_seen = Signal(2) # poll_last is valid
+        self.comb += [
+            autopoll_value.fields.reg0.eq(poll_last[0]),
+            autopoll_value.fields.reg1.eq(poll_last[1]),
+        ]
+        self.sync += [
+            If(~autopoll_ctrl.fields.enable,
+               poll_timer.eq(0),
+               poll_due.eq(0),
+               poll_seen.eq(0),
+            ).Elif(poll_timer == 0,
+                   poll_timer.eq(autopoll_interval.storage),
+                   poll_due.eq(1),
+            ).Else(
+                poll_timer.eq(poll_timer - 1),
+            ),
+        ]
+
+        # events
+        ev_done = Signal()
+        ev_change = Signal()
+        pending = Signal(2)
+        self.sync += [
+            pending.eq((pending & ~Mux(ev_clear.re, ev_clear.storage[0:2], 0)) | Cat(ev_done, ev_change)),
+        ]
+        self.comb += [
+            ev_pending.fields.done.eq(pending[0]),
+            ev_pending.fields.change.eq(pending[1]),
+            self.irq.eq((pending & ev_enable.storage[0:2]) != 0),
+        ]
+
         self.submodules.wishbone_fsm = mdio_fsm = FSM(reset_state = "Reset")
 
         self.comb += [
-            mdio_status.fields.access_complete.eq(mdio_fsm.ongoing("Idle")),
-            mdio_status.fields.busy.eq(cmd_recv),
+            mdio_status.fields.access_complete.eq(mdio_fsm.ongoing("Idle") & (armed == 0)),
+            mdio_status.fields.busy.eq(~mdio_fsm.ongoing("Idle") | (armed != 0)),
             mdio_read.fields.val.eq(rdata),
         ]
 
@@ -60,21 +210,8 @@ class MDIOCtrl(Module, AutoCSR):
             ),
         ]
         self.comb += [
-            #If(in_preamble,
-            #   mdio_o.eq(1),
-            #).Else(
-            #    mdio_o.eq(output_data[31]),
-            #),
             mdio_o.eq(in_preamble | output_data[31]),
         ]
-        shift_rd = Signal()
-        shift_rd2 = Signal()
-        self.sync += [
-            shift_rd2.eq(shift_rd), # delay by one cycle
-            If(shift_rd2,
-               output_data.eq(Cat(rdata[1:32], Signal(1, reset = 0))), # DEBUG, should be 16, FIXME
-            ),
-        ]
 
         mdc = Signal()
         self.comb += [ sig_mdc.eq(mdc), ]
@@ -88,13 +225,41 @@ class MDIOCtrl(Module, AutoCSR):
                 ),
                 clk_div.eq(clk_div - 1),
             ),
-            If(mdio_command.re,
-               cmd_recv.eq(1),
-            ),
         ]
 
+        # current access
         write = Signal()
-        
+        from_poll = Signal()
+        noresult = Signal()
+        cur_reg = Signal(5)
+        cur_phy = Signal(5)
+
+        # queued accesses first; a read waits for room in the result FIFO
+        start_cmd = Signal()
+        start_poll = Signal()
+        self.comb += [
+            start_cmd.eq((armed != 0) & cmd_fifo.readable & (cmd_dout.write | cmd_dout.noresult | res_fifo.writable)),
+            start_poll.eq(~start_cmd & (armed == 0) & poll_due),
+        ]
+
+        def load(wr, val, reg, phy):
+            return [
+                NextValue(write, wr),
+                NextValue(cur_reg, reg),
+                NextValue(cur_phy, phy),
+                NextValue(output_data[0:16], val),
+                NextValue(output_data[16:18], 0x2), # TA
+                NextValue(output_data[18:23], reg),
+                NextValue(output_data[23:28], phy),
+                If(wr,
+                   NextValue(output_data[28:30], 0x1), # write
+                ).Else(
+                    NextValue(output_data[28:30], 0x2), # read
+                    NextValue(rdata, 0xFFFF),
+                ),
+                NextValue(output_data[30:32], 0x1), # start
+            ]
+
         mdio_fsm.act("Reset",
                      NextState("Idle")
         )
@@ -102,28 +267,25 @@ class MDIOCtrl(Module, AutoCSR):
                      in_preamble.eq(0),
                      mdio_oe.eq(0), # don't drive
                      #mdio_oe.eq(1), # drive 0 at idle ?
-                     If(cmd_recv & (clk_div == div_clk_state_change), # CHECKME
-                        NextValue(cmd_recv, 0),
-                        NextValue(write, mdio_command.fields.write),
-                        
-                        NextValue(output_data[0:16], mdio_write.fields.val),
-                        NextValue(output_data[16:18], 0x2), # TA
-                        NextValue(output_data[18:23], reg_addr.fields.reg_addr),
-                        NextValue(output_data[23:28], phy_addr.fields.phy_addr),
-                        If(mdio_command.fields.write,
-                           NextValue(output_data[28:30], 0x1), # write
+                     If((start_cmd | start_poll) & (clk_div == div_clk_state_change), # CHECKME
+                        If(start_cmd,
+                           cmd_fifo.re.eq(1),
+                           arm_dec.eq(1),
+                           NextValue(from_poll, 0),
+                           NextValue(noresult, cmd_dout.noresult),
+                           *load(cmd_dout.write, cmd_dout.val, cmd_dout.reg_addr, cmd_dout.phy_addr),
                         ).Else(
-                            NextValue(output_data[28:30], 0x2), # read
-                            NextValue(rdata, 0xFFFFFFFF),
+                            NextValue(from_poll, 1),
+                            NextValue(noresult, 1),
+                            *load(0, 0, Mux(poll_idx, autopoll_ctrl.fields.reg1, autopoll_ctrl.fields.reg0), autopoll_ctrl.fields.phy_addr),
                         ),
-                        NextValue(output_data[30:32], 0x1), # start
                         in_preamble.eq(1),
                         mdio_oe.eq(1),
                         NextValue(int_cnt, 31),
                         NextState("Preamble"),
                      )
         )
-        
+
         mdio_fsm.act("Preamble",
                      in_preamble.eq(1),
                      mdio_oe.eq(1),
@@ -142,7 +304,7 @@ class MDIOCtrl(Module, AutoCSR):
                         )
                      ),
         )
-                       
+
         mdio_fsm.act("WData",
                      in_preamble.eq(0),
                      mdio_oe.eq(1),
@@ -153,11 +315,11 @@ class MDIOCtrl(Module, AutoCSR):
                            mdio_o.eq(1), # help pull-ups
                            # mdio_oe.eq(0), # stop driving
                            NextValue(output_data, 0), # make sure it's zero
-                           NextState("Idle"), ## fixme: delay to idle by one MDC clok cycle?
+                           NextState("Done"), ## fixme: delay to idle by one MDC clok cycle?
                         )
                      ),
         )
-                       
+
         mdio_fsm.act("RData",
                      in_preamble.eq(0),
                      mdio_oe.eq(1),
@@ -171,40 +333,56 @@ class MDIOCtrl(Module, AutoCSR):
                         )
                      ),
         )
-                       
+
         mdio_fsm.act("TA",
                      mdio_oe.eq(0),
                      If(clk_div == div_clk_state_change,
-                           # mdio_oe.eq(0), # stop driving
-                        NextValue(rdata[15], mdio_i), # DEBUG, will capture on 17 and 16, will be flushed by shifting
-                        shift_rd.eq(1), # DEBUG, shift in 2 cycles to make room
                         NextValue(int_cnt, int_cnt - 1),
-                        If(int_cnt == 16,
+                        If(int_cnt == 16, # the PHY drives D15 for the next rising edge, sample it now
+                           NextValue(rdata, Cat(mdio_i, rdata[0:15])),
                            NextValue(output_data, 0), # make sure it's zero
                            NextState("Capture"),
                         )
                      ),
         )
-                       
+
         mdio_fsm.act("Capture",
                      mdio_oe.eq(0),
                      If(clk_div == div_clk_state_change,
-                        NextValue(rdata[15], mdio_i),
+                        NextValue(rdata, Cat(mdio_i, rdata[0:15])), # MSb first, D14..D0
                         NextValue(int_cnt, int_cnt - 1),
-                        If(int_cnt == 0,
+                        If(int_cnt == 1,
                            mdio_oe.eq(0),
                            mdio_o.eq(1), # help pull-ups
-                           NextState("Idle"),
-                        ).Else(
-                            shift_rd.eq(1), # shift in 2 cycles to make room
+                           NextState("Done"),
                         )
                      ),
         )
-        
-        #led0 = platform.request("user_led", 0)
-        #led1 = platform.request("user_led", 1)
-        #
-        #self.comb += [
-        #    led0.eq(~mdio_fsm.ongoing("Idle")),
-        #    #led1.eq(clk_div != 0),
-        #]
+
+        # results, events and autopoll bookkeeping, rdata is complete
+        mdio_fsm.act("Done",
+                     If(from_poll,
+                        If(Mux(poll_idx, poll_seen[1], poll_seen[0]) & (poll_last[poll_idx] != rdata),
+                           ev_change.eq(1),
+                        ),
+                        NextValue(poll_last[poll_idx], rdata),
+                        NextValue(poll_seen, poll_seen | Mux(poll_idx, 0b10, 0b01)),
+                        If(~poll_idx & autopoll_ctrl.fields.reg1_enable,
+                           NextValue(poll_idx, 1), # second register right away
+                        ).Else(
+                            NextValue(poll_idx, 0),
+                            NextValue(poll_due, 0),
+                        ),
+                     ).Else(
+                         If(~write & ~noresult,
+                            res_fifo.we.eq(1),
+                            res_din.val.eq(rdata),
+                            res_din.reg_addr.eq(cur_reg),
+                            res_din.phy_addr.eq(cur_phy),
+                         ),
+                         If(~noresult & (armed == 0),
+                            ev_done.eq(1),
+                         ),
+                     ),
+                     NextState("Idle"),
+        )
@@ -135,6 +135,7 @@ class NuBus(Module):
         self.specials += Instance("nubus_cpldinfpga",
                                   i_nubus_oe = nubus_oe, # improveme: handled in soc
                                   i_tmoen = tmoen,
+                                  i_tm2oen = 1, # XiBus doesn't do NuBus90
                                   i_nubus_master_dir = nubus_master_dir,
                                   i_rqst_oe_n = rqst_oe_n,
                             
@@ -0,0 +1,90 @@
+from migen import *
+
+import litex
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.csr import *
+
+# Completion write-back: instead of having the Mac poll a status register across the NuBus,
+# engines report completion by a single word written into Mac RAM (through the DMA region, so wb_dma)
+# Each source has its own address CSR, a SoC address in the DMA region (i.e. a host address), 0 disables it
+# The word is written big-endian (as the 68k reads it):
+# bits 16-31: sequence number, the number of completions so far (modulo)
+# bits 0-15: status of the last completion, from the engine
+# Completions arriving before the previous one was written are merged, the sequence number tells how many there were
+# Sources are served lowest first
+class CompletionWriter(Module, AutoCSR):
+    def __init__(self):
+        self.bus_mst = bus_mst = wishbone.Interface()
+        self.sources = []
+
+        self.errors = CSRStatus(32, description = "Completion writes that ended with a bus error (writes to the host are posted, their NuBus errors are counted in wishbone_slave_sys_posted_errors)")
+
+    # 'event' pulses (sys) when the engine completes something, 'status' is sampled then
+    def add_source(self, name, event, status):
+        adr = CSRStorage(32, name = f"{name}_adr", description = f"Host address of the completion word for {name} (0 to disable)")
+        seq = CSRStatus(16, name = f"{name}_seq", description = f"Completions for {name} (the sequence number of the last word)")
+        setattr(self, f"{name}_adr", adr)
+        setattr(self, f"{name}_seq", seq)
+        self.sources.append((name, event, status, adr, seq))
+
+    def do_finalize(self):
+        bus_mst = self.bus_mst
+        n = len(self.sources)
+        if (n == 0):
+            return
+
+        pending = Signal(n)
+        take = Signal(n)
+        count = [ Signal(16, name = f"cpl_count_{name}") for (name, event, status, adr, seq) in self.sources ]
+        last = [ Signal(16, name = f"cpl_status_{name}") for (name, event, status, adr, seq) in self.sources ]
+        for i, (name, event, status, adr, seq) in enumerate(self.sources):
+            self.comb += seq.status.eq(count[i])
+            self.sync += [
+                If(event,
+                   count[i].eq(count[i] + 1),
+                   last[i].eq(status),
+                ),
+                If(event & (adr.storage != 0), # a new one wins over the one being taken
+                   pending[i].eq(1),
+                ).Elif(take[i],
+                       pending[i].eq(0),
+                ),
+            ]
+
+        first = Signal(max = max(2, n))
+        chain = None
+        for i in reversed(range(n)):
+            chain = If(pending[i], first.eq(i)) if chain is None else If(pending[i], first.eq(i)).Else(chain)
+        self.comb += chain
+
+        cur_adr = Signal(32)
+        cur_word = Signal(32)
+        errors = Signal(32)
+        self.comb += self.errors.status.eq(errors)
+
+        self.submodules.cpl_fsm = cpl_fsm = FSM(reset_state = "Reset")
+        cpl_fsm.act("Reset",
+                    NextState("Idle"),)
+        cpl_fsm.act("Idle",
+                    If(pending != 0,
+                       take.eq(1 << first),
+                       NextValue(cur_adr, Array([ adr.storage for (name, event, status, adr, seq) in self.sources ])[first]),
+                       NextValue(cur_word, Cat(Array(last)[first], Array(count)[first])),
+                       NextState("Write"),
+                    )
+        )
+        cpl_fsm.act("Write",
+                    bus_mst.cyc.eq(1),
+                    bus_mst.stb.eq(1),
+                    bus_mst.we.eq(1),
+                    bus_mst.adr.eq(cur_adr[2:32]),
+                    bus_mst.dat_w.eq(Cat(cur_word[24:32], cur_word[16:24], cur_word[8:16], cur_word[0:8])), # big-endian for the Mac
+                    bus_mst.sel.eq(0xf),
+                    bus_mst.cti.eq(0b000),
+                    If(bus_mst.ack | bus_mst.err,
+                       If(bus_mst.err,
+                          NextValue(errors, errors + 1),
+                       ),
+                       NextState("Idle"),
+                    )
+        )
@@ -3,6 +3,7 @@ module nubus_cpldinfpga
    // Control
    input  nubus_oe, // disable all 5v drivers
    input  tmoen, // tm output enable
+   input  tm2oen, // tm2 output enable (NuBus90)
    input  nubus_master_dir, // direction of signals, i.e. are we in master mode
 
    // Spares
@@ -42,9 +43,9 @@ module nubus_cpldinfpga
    output rqst_o_n // rqst to NuBus
    );
 	
-   // placeholders
-   assign tm2_o_n = 0;
-   assign tm2_oe_n = 1;
+   // NuBus90 2x request/acknowledge
+   assign tm2_o_n    = nubus_oe ?   1 : (( ~tm2oen) ? tm2_n_3v3 : 1); // master/slave out
+   assign tm2_oe_n   = nubus_oe ?   1 : (( ~tm2oen) ? 0 : 1); // master/slave out
    
    // ~nubus_master_dir-controlled signals
    assign start_o_n   = nubus_oe ?   1 : ( nubus_master_dir ? start_n_3v3 : 1); // master out
@@ -0,0 +1,352 @@
+from functools import reduce
+from operator import or_
+
+from migen import *
+from migen.genlib.fifo import *
+from migen.genlib.cdc import PulseSynchronizer
+
+import litex
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.csr import *
+
+# Descriptor-ring front-end for the NuBus DMA FIFOs (RAM disk), next to ExchangeWithMem (see DMAFIFOShare)
+# The driver fills descriptors in the ring (in BRAM, through bus_slv), then writes the new producer index to the doorbell
+# Each descriptor is 4 words (little-endian, like the CSRs, so bswap'ed by the Mac):
+# 0: SDRAM byte address (aligned to the burst)
+# 1: DMA (host) byte address (aligned to the burst)
+# 2: length in bytes (multiple of the burst)
+# 3: flags, bit 0: direction (0: SDRAM to host, 1: host to SDRAM), bit 1: 2D
+# A 2D descriptor (e.g. a rectangle of an offscreen pixmap for a blit) takes the next slot as well:
+# 4: number of rows
+# 5: SDRAM stride (bytes)
+# 6: host stride (bytes)
+# 7: unused
+# row r is 'length' bytes at the host address + r * host stride, and goes to the SDRAM address + r * SDRAM stride;
+# the rows don't need to be aligned, each is copied as the whole blocks covering it, so the SDRAM address must have
+# the same offset in the block as the host address, and the strides the same offset too (e.g. equal strides)
+# (blocks are written whole, so rows going to the host must be aligned on blocks, start and length)
+# Descriptors are processed in order, and each (a 2D one counts once, with the index of its first slot) produces a completion word in the completion ring
+# (after the descriptor ring in bus_slv): descriptor index in bits 0-15, status in bits 16-31 (bit 16: NuBus error)
+# The interrupt is raised when enough completions are pending, or when the oldest has waited long enough,
+# and is cleared by updating cpl_consumer
+# The ring has one user at a time (the RAM disk driver, or the INIT's host blits), who alone writes ctrl, producer and cpl_consumer:
+# writing a non-zero id to 'owner' claims the ring only if it's free (read it back to know if it worked), writing 0 releases it
+class DMARing(Module, AutoCSR):
+    def __init__(self, soc, burst_size, tosbus_fifo, fromsbus_fifo, fromsbus_req_fifo, dram_native_r, dram_native_w, ring_size=64):
+        self.bus_slv = bus_slv = wishbone.Interface()
+        self.irq = Signal() # active high
+        self.cpl_event = Signal() # a completion was produced (for a CompletionWriter)
+        self.cpl_status = Signal(16) # ... bit 0: NuBus error
+        self.tosbus_err = Signal() # nubus, from NuBus: the block leaving tosbus_fifo wasn't written to the host
+
+        data_width = burst_size * 4
+        data_width_bits = burst_size * 32
+        blk_shift = log2_int(data_width)
+        ring_bits = log2_int(ring_size)
+        assert(dram_native_r.data_width == data_width_bits)
+        assert(dram_native_w.data_width == data_width_bits)
+
+        self.ctrl = CSRStorage(fields = [CSRField("enable", size = 1, description = "Process descriptors"),
+                                         CSRField("irq_enable", size = 1, description = "Enable the completion interrupt"),])
+        self.producer = CSRStorage(16, description = "Descriptor ring producer index (doorbell)")
+        self.consumer = CSRStatus(16, description = "Descriptor ring consumer index")
+        self.cpl_producer = CSRStatus(16, description = "Completion ring producer index")
+        self.cpl_consumer = CSRStorage(16, description = "Completion ring consumer index (acknowledges completions)")
+        self.irq_count = CSRStorage(16, reset = 1, description = "Interrupt once that many completions are pending")
+        self.irq_timeout = CSRStorage(32, reset = 0, description = "Interrupt once a completion has been pending that many cycles (0 to disable)")
+        self.owner = CSR(8) # id of the user of the ring, 0 when free
+
+        owner = Signal(8)
+        self.comb += self.owner.w.eq(owner)
+        self.sync += If(self.owner.re & ((owner == 0) | (self.owner.r == 0)),
+                        owner.eq(self.owner.r),
+        )
+
+        consumer = Signal(16)
+        cpl_producer = Signal(16)
+        self.comb += [
+            self.consumer.status.eq(consumer),
+            self.cpl_producer.status.eq(cpl_producer),
+        ]
+
+        # rings, written/read by the host through bus_slv
+        desc_mem = Memory(32, ring_size * 4)
+        cpl_mem = Memory(32, ring_size)
+        desc_port = desc_mem.get_port()
+        cpl_port = cpl_mem.get_port(write_capable = True)
+        self.specials += desc_mem, cpl_mem, desc_port, cpl_port
+        desc_bus = wishbone.Interface()
+        cpl_bus = wishbone.Interface()
+        self.submodules.desc_sram = wishbone.SRAM(desc_mem, bus = desc_bus)
+        self.submodules.cpl_sram = wishbone.SRAM(cpl_mem, bus = cpl_bus, read_only = True)
+        self.submodules.decoder = wishbone.Decoder(bus_slv, [(lambda a: a[ring_bits+2] == 0, desc_bus),
+                                                             (lambda a: a[ring_bits+2] == 1, cpl_bus)], register = True)
+        self.size = ring_size * 4 * 4 * 2 # bytes of bus_slv, both rings
+
+        tosbus_fifo_din = Record(soc.tosbus_layout)
+        self.comb += tosbus_fifo.din.eq(tosbus_fifo_din.raw_bits())
+        fromsbus_req_fifo_din = Record(soc.fromsbus_req_layout)
+        self.comb += fromsbus_req_fifo.din.eq(fromsbus_req_fifo_din.raw_bits())
+        fromsbus_fifo_dout = Record(soc.fromsbus_layout)
+        self.comb += fromsbus_fifo_dout.raw_bits().eq(fromsbus_fifo.dout)
+
+        # NuBus side events: a block was written to the host, a block write to the host failed, a block read from the host failed
+        self.submodules.tosbus_done_sync = PulseSynchronizer(idomain = "nubus", odomain = "sys")
+        self.submodules.tosbus_err_sync = PulseSynchronizer(idomain = "nubus", odomain = "sys")
+        self.submodules.fromsbus_err_sync = PulseSynchronizer(idomain = "nubus", odomain = "sys")
+        self.comb += [
+            self.tosbus_done_sync.i.eq(tosbus_fifo.re & ~self.tosbus_err),
+            self.tosbus_err_sync.i.eq(tosbus_fifo.re & self.tosbus_err),
+            self.fromsbus_err_sync.i.eq(fromsbus_req_fifo.re & ~fromsbus_fifo.we),
+        ]
+
+        # current descriptor
+        d_sdram = Signal(32)
+        d_dma = Signal(32)
+        d_len = Signal(32)
+        d_flags = Signal(32)
+        d_rows = Signal(16)
+        d_sdram_stride = Signal(32)
+        d_dma_stride = Signal(32)
+        fetch_ctr = Signal(3)
+        row_ctr = Signal(16)
+        sdram_row = Signal(32)
+        dma_row = Signal(32)
+        issued = Signal(32 - blk_shift) # blocks of the descriptor, all rows
+        sdram_blk = Signal(len(dram_native_r.cmd.addr))
+        dma_blk = Signal(32 - blk_shift)
+        blk_total = Signal(32 - blk_shift)
+        issue_ctr = Signal(32 - blk_shift)
+        done_ctr = Signal(32 - blk_shift)
+        error = Signal()
+        fromsbus_done = Signal()
+
+        self.submodules.ring_fsm = ring_fsm = FSM(reset_state = "Reset")
+        ring_fsm.act("Reset",
+                     NextValue(consumer, 0),
+                     NextValue(cpl_producer, 0),
+                     NextState("Idle")
+        )
+        ring_fsm.act("Idle",
+                     If(self.ctrl.fields.enable & (consumer != self.producer.storage),
+                        NextValue(fetch_ctr, 0),
+                        NextState("FetchAdr"),
+                     ).Elif(~self.ctrl.fields.enable, # restart from scratch when re-enabled
+                            NextValue(consumer, self.producer.storage),
+                     )
+        )
+        fetch_slot = Signal(ring_bits)
+        self.comb += fetch_slot.eq(consumer + fetch_ctr[2])
+        ring_fsm.act("FetchAdr",
+                     desc_port.adr.eq(Cat(fetch_ctr[0:2], fetch_slot)),
+                     NextState("FetchData"),
+        )
+        ring_fsm.act("FetchData",
+                     desc_port.adr.eq(Cat(fetch_ctr[0:2], fetch_slot)),
+                     Case(fetch_ctr, {
+                         0: NextValue(d_sdram, desc_port.dat_r),
+                         1: NextValue(d_dma, desc_port.dat_r),
+                         2: NextValue(d_len, desc_port.dat_r),
+                         3: NextValue(d_flags, desc_port.dat_r),
+                         4: NextValue(d_rows, desc_port.dat_r),
+                         5: NextValue(d_sdram_stride, desc_port.dat_r),
+                         6: NextValue(d_dma_stride, desc_port.dat_r),
+                         "default": [],
+                     }),
+                     NextValue(fetch_ctr, fetch_ctr + 1),
+                     If(((fetch_ctr == 3) & ~desc_port.dat_r[1]) | (fetch_ctr == 7),
+                        NextState("Start"),
+                     ).Else(
+                         NextState("FetchAdr"),
+                     )
+        )
+        ring_fsm.act("Start",
+                     NextValue(sdram_row, d_sdram),
+                     NextValue(dma_row, d_dma),
+                     NextValue(row_ctr, 0),
+                     If(~d_flags[1],
+                        NextValue(d_rows, 1),
+                     ),
+                     NextValue(issued, 0),
+                     NextState("Row"),
+        )
+        # the blocks covering the row (for 1D, everything is aligned and there is a single row)
+        ring_fsm.act("Row",
+                     NextValue(sdram_blk, sdram_row[blk_shift:32]),
+                     NextValue(dma_blk, dma_row[blk_shift:32]),
+                     NextValue(blk_total, ((dma_row + d_len + (data_width - 1)) >> blk_shift) - dma_row[blk_shift:32]),
+                     NextValue(issue_ctr, 0),
+                     If(d_flags[0],
+                        NextState("FromHostReq"),
+                     ).Else(
+                         NextState("ToHostCmd"),
+                     )
+        )
+        ring_fsm.act("NextRow",
+                     NextValue(issued, issued + blk_total),
+                     NextValue(row_ctr, row_ctr + 1),
+                     NextValue(sdram_row, sdram_row + d_sdram_stride),
+                     NextValue(dma_row, dma_row + d_dma_stride),
+                     If(row_ctr + 1 >= d_rows,
+                        NextState("WaitDone"),
+                     ).Else(
+                         NextState("Row"),
+                     )
+        )
+        # SDRAM to host: one block at a time from the SDRAM, as fast as the NuBus takes them
+        ring_fsm.act("ToHostCmd",
+                     If(issue_ctr == blk_total,
+                        NextState("NextRow"),
+                     ).Elif(tosbus_fifo.writable,
+                            dram_native_r.cmd.valid.eq(1),
+                            dram_native_r.cmd.we.eq(0),
+                            dram_native_r.cmd.addr.eq(sdram_blk),
+                            If(dram_native_r.cmd.ready,
+                               NextState("ToHostData"),
+                            )
+                     )
+        )
+        ring_fsm.act("ToHostData",
+                     dram_native_r.rdata.ready.eq(1),
+                     If(dram_native_r.rdata.valid,
+                        tosbus_fifo.we.eq(1),
+                        tosbus_fifo_din.address.eq(Cat(Signal(blk_shift, reset = 0), dma_blk)),
+                        tosbus_fifo_din.data.eq(dram_native_r.rdata.data),
+                        NextValue(sdram_blk, sdram_blk + 1),
+                        NextValue(dma_blk, dma_blk + 1),
+                        NextValue(issue_ctr, issue_ctr + 1),
+                        NextState("ToHostCmd"),
+                     )
+        )
+        # host to SDRAM: queue all the requests, the writer below puts the data in the SDRAM
+        ring_fsm.act("FromHostReq",
+                     If(issue_ctr == blk_total,
+                        NextState("NextRow"),
+                     ).Elif(fromsbus_req_fifo.writable,
+                            fromsbus_req_fifo.we.eq(1),
+                            fromsbus_req_fifo_din.blkaddress.eq(sdram_blk),
+                            fromsbus_req_fifo_din.dmaaddress.eq(Cat(Signal(blk_shift, reset = 0), dma_blk)),
+                            NextValue(sdram_blk, sdram_blk + 1),
+                            NextValue(dma_blk, dma_blk + 1),
+                            NextValue(issue_ctr, issue_ctr + 1),
+                     )
+        )
+        ring_fsm.act("WaitDone",
+                     If(done_ctr == issued,
+                        NextState("Complete"),
+                     )
+        )
+        ring_fsm.act("Complete",
+                     cpl_port.adr.eq(cpl_producer[0:ring_bits]),
+                     cpl_port.dat_w.eq(Cat(consumer, error)),
+                     cpl_port.we.eq(1),
+                     self.cpl_event.eq(1),
+                     self.cpl_status.eq(error),
+                     NextValue(consumer, consumer + Mux(d_flags[1], 2, 1)),
+                     NextValue(cpl_producer, cpl_producer + 1),
+                     NextState("Idle"),
+        )
+
+        self.sync += [
+            If(ring_fsm.ongoing("Start"),
+               done_ctr.eq(0),
+               error.eq(0),
+            ).Else(
+                done_ctr.eq(done_ctr + self.tosbus_done_sync.o + self.tosbus_err_sync.o + self.fromsbus_err_sync.o + fromsbus_done),
+                If(self.tosbus_err_sync.o | self.fromsbus_err_sync.o,
+                   error.eq(1),
+                ),
+            )
+        ]
+
+        # data read from the host to the SDRAM
+        self.submodules.writer_fsm = writer_fsm = FSM(reset_state = "Reset")
+        writer_fsm.act("Reset",
+                       NextState("Idle")
+        )
+        writer_fsm.act("Idle",
+                       If(fromsbus_fifo.readable,
+                          dram_native_w.cmd.valid.eq(1),
+                          dram_native_w.cmd.we.eq(1),
+                          dram_native_w.cmd.addr.eq(fromsbus_fifo_dout.blkaddress),
+                          If(dram_native_w.cmd.ready,
+                             NextState("Data"),
+                          )
+                       )
+        )
+        writer_fsm.act("Data",
+                       dram_native_w.wdata.valid.eq(1),
+                       dram_native_w.wdata.data.eq(fromsbus_fifo_dout.data),
+                       dram_native_w.wdata.we.eq(2**(data_width_bits//8)-1),
+                       If(dram_native_w.wdata.ready,
+                          fromsbus_fifo.re.eq(1),
+                          fromsbus_done.eq(1),
+                          NextState("Idle"),
+                       )
+        )
+
+        # interrupt coalescing
+        cpl_pending = Signal(16)
+        irq_timer = Signal(32)
+        self.comb += cpl_pending.eq(cpl_producer - self.cpl_consumer.storage)
+        self.sync += [
+            If((cpl_pending == 0) | self.cpl_consumer.re,
+               irq_timer.eq(0),
+            ).Elif(irq_timer != 0xFFFFFFFF,
+                   irq_timer.eq(irq_timer + 1),
+            )
+        ]
+        self.comb += self.irq.eq(self.ctrl.fields.irq_enable & (cpl_pending != 0) &
+                                 ((cpl_pending >= self.irq_count.storage) |
+                                  ((self.irq_timeout.storage != 0) & (irq_timer >= self.irq_timeout.storage))))
+
+# One side of a DMA FIFO as seen by a front-end of DMAFIFOShare, same names as the FIFOs
+# din/we/writable: sys, for tosbus and fromsbus_req; re is the NuBus popping one of our entries (nubus)
+# dout/re/readable: sys, for fromsbus; we is the NuBus pushing one of our responses (nubus)
+class DMAFIFOPort:
+    def __init__(self, width):
+        self.din = Signal(width)
+        self.we = Signal()
+        self.writable = Signal()
+        self.dout = Signal(width)
+        self.re = Signal()
+        self.readable = Signal()
+
+# Two DMA front-ends (ExchangeWithMem and DMARing) on the one set of NuBus DMA FIFOs
+# The layouts end with a 'tag' bit: set here from the port on the way in, copied by the NuBus from
+# the request to its response, and used to give each response back to the front-end that asked for it
+# The ports take turns on the tosbus and fromsbus_req write sides, one sys cycle each (so neither can starve
+# the other, and writable doesn't depend on the other port's we); the responses come out in order,
+# only the owner of the head of fromsbus sees it readable
+class DMAFIFOShare(Module):
+    def __init__(self, tosbus_fifo, fromsbus_fifo, fromsbus_req_fifo):
+        self.tosbus = [DMAFIFOPort(len(tosbus_fifo.din)) for i in range(2)]
+        self.fromsbus = [DMAFIFOPort(len(fromsbus_fifo.dout)) for i in range(2)]
+        self.fromsbus_req = [DMAFIFOPort(len(fromsbus_req_fifo.din)) for i in range(2)]
+
+        turn = Signal()
+        self.sync += turn.eq(~turn)
+
+        for fifo, ports in [(tosbus_fifo, self.tosbus), (fromsbus_req_fifo, self.fromsbus_req)]:
+            w = len(fifo.din)
+            for i, port in enumerate(ports):
+                self.comb += [
+                    port.writable.eq(fifo.writable & (turn == i)),
+                    If(turn == i,
+                       fifo.we.eq(port.we),
+                       fifo.din.eq(Cat(port.din[0:w-1], i)),
+                    ),
+                    port.dout.eq(fifo.dout),
+                    port.readable.eq(fifo.readable & (fifo.dout[w-1] == i)),
+                    port.re.eq(fifo.re & (fifo.dout[w-1] == i)),
+                ]
+
+        w = len(fromsbus_fifo.dout)
+        for i, port in enumerate(self.fromsbus):
+            self.comb += [
+                port.dout.eq(fromsbus_fifo.dout),
+                port.readable.eq(fromsbus_fifo.readable & (fromsbus_fifo.dout[w-1] == i)),
+                port.din.eq(fromsbus_fifo.din),
+                port.we.eq(fromsbus_fifo.we & (fromsbus_fifo.din[w-1] == i)),
+            ]
+        self.comb += fromsbus_fifo.re.eq(reduce(or_, [ port.re & port.readable for port in self.fromsbus ]))
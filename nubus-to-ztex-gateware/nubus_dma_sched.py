@@ -0,0 +1,134 @@
+from migen import *
+from migen.genlib.cdc import MultiReg, BusSynchronizer, PulseSynchronizer
+
+import litex
+from litex.soc.interconnect.csr import *
+
+from csr_snapshot import SnapshotControl
+
+# Scheduler for the sources of NuBus master transactions in dma_fsm
+# 0: wb_dma (single words, and the blocks gathered from it)
+# 1: tosbus_fifo (blocks to the NuBus)
+# 2: fromsbus_req_fifo (blocks from the NuBus)
+# Weighted round-robin: the current source keeps the bus for up to 'weight' transactions while it has some,
+# then the next requesting source (in order) gets its turn
+# A source that has been waiting for 'starve_limit' NuBus cycles goes first whatever the weights (0 disables that)
+# The arbitration itself is in the NuBus domain: 'req' and 'commit' come from dma_fsm, 'pick' goes back to it
+# Configuration and counters are CSRs in the sys domain; the counters are read from a snapshot: writing 'snapshot'
+# latches the six of them in the same NuBus cycle, then they cross to sys in a single transfer along with
+# 'snapshot_seq', so once 'snapshot_seq' has changed they are all from that cycle
+class NuBusDMAScheduler(Module, AutoCSR):
+    def __init__(self, cd_nubus="nubus"):
+        sources = ["wb", "tosbus", "fromsbus"]
+        n = len(sources)
+
+        # NuBus domain
+        self.req = req = Signal(n) # source has something to do
+        self.pick = pick = Signal(n) # one-hot, the source dma_fsm should serve next
+        self.commit = commit = Signal() # dma_fsm starts the transaction for 'pick'
+        self.idle = idle = Signal() # dma_fsm is between transactions
+
+        self.ctrl = CSRStorage(fields = [CSRField(f"enable_{s}", size = 1, reset = 1, description = f"Serve the {s} source") for s in sources])
+        self.weights = CSRStorage(fields = [CSRField(f"weight_{s}", size = 8, reset = 1, description = f"Back-to-back transactions for the {s} source (0 is 1)") for s in sources])
+        self.starve_limit = CSRStorage(16, reset = 256, description = "NuBus cycles a source can wait before it goes first (0 to disable)")
+        self.snapshot = SnapshotControl(description = "Write to latch the counters (wait for snapshot_seq to change before reading them)")
+        self.snapshot_seq = CSRStatus(8, description = "Snapshots taken so far (modulo)")
+        for s in sources:
+            setattr(self, f"grants_{s}", CSRStatus(32, name = f"grants_{s}", description = f"Transactions started for the {s} source, at the last snapshot"))
+        for s in sources:
+            setattr(self, f"wait_{s}", CSRStatus(64, name = f"wait_{s}", description = f"NuBus cycles the {s} source waited, at the last snapshot"))
+
+        enable = Signal(n)
+        weight = [Signal(8) for i in range(n)]
+        starve_limit = Signal(16)
+        self.specials += MultiReg(self.ctrl.storage, enable, odomain = cd_nubus)
+        self.specials += [ MultiReg(self.weights.storage[i*8:(i+1)*8], weight[i], odomain = cd_nubus) for i in range(n) ]
+        self.specials += MultiReg(self.starve_limit.storage, starve_limit, odomain = cd_nubus)
+
+        eligible = Signal(n)
+        starving = Signal(n)
+        cur = Signal(max = n) # source of the current round
+        credit = Signal(8) # transactions left in the round
+        wait = [Signal(16) for i in range(n)] # current wait, for the starvation bound
+        self.comb += [
+            eligible.eq(req & enable),
+            starving.eq(Cat(*[eligible[i] & (starve_limit != 0) & (wait[i] >= starve_limit) for i in range(n)])),
+        ]
+
+        # starving source first (lowest index), then the current one if it has credit left, then the next ones in order
+        round_pick = [ Signal(n, name = f"round_pick_{c}") for c in range(n) ]
+        for c in range(n):
+            order = [ (c + k) % n for k in range(1, n + 1) ] # the current one last
+            chain = None
+            for i in reversed(order):
+                chain = If(eligible[i], round_pick[c].eq(1 << i)) if chain is None else If(eligible[i], round_pick[c].eq(1 << i)).Else(chain)
+            self.comb += chain
+        starve_pick = Signal(n)
+        chain = None
+        for i in reversed(range(n)):
+            chain = If(starving[i], starve_pick.eq(1 << i)) if chain is None else If(starving[i], starve_pick.eq(1 << i)).Else(chain)
+        self.comb += chain
+        self.comb += [
+            If(starving != 0,
+               pick.eq(starve_pick),
+            ).Elif(Array(eligible)[cur] & (credit != 0),
+                   Case(cur, { i: pick.eq(1 << i) for i in range(n) }),
+            ).Else(
+                pick.eq(Array(round_pick)[cur]),
+            )
+        ]
+
+        nubus_sync = getattr(self.sync, cd_nubus)
+        nubus_sync += [
+            If(commit,
+               Case(pick, { (1 << i): [
+                   If((cur == i) & (credit != 0),
+                      credit.eq(credit - 1),
+                   ).Else(
+                       cur.eq(i),
+                       credit.eq(Mux(weight[i] == 0, 0, weight[i] - 1)),
+                   ) ] for i in range(n) }),
+            )
+        ]
+
+        # counters; a source isn't waiting while its own transaction is running
+        serving = Signal(n)
+        nubus_sync += If(commit, serving.eq(pick))
+        grants = [Signal(32) for i in range(n)]
+        waits = [Signal(64) for i in range(n)]
+        for i in range(n):
+            granted = Signal()
+            self.comb += granted.eq(commit & pick[i])
+            nubus_sync += [
+                If(granted,
+                   grants[i].eq(grants[i] + 1),
+                   wait[i].eq(0),
+                ).Elif(eligible[i] & (idle | ~serving[i]),
+                       waits[i].eq(waits[i] + 1),
+                       If(wait[i] != 0xFFFF,
+                          wait[i].eq(wait[i] + 1),
+                       ),
+                ).Elif(~eligible[i],
+                       wait[i].eq(0),
+                )
+            ]
+
+        # snapshot: latched in the NuBus domain, then one crossing for all of it
+        snap_seq = Signal(8)
+        snap_grants = [Signal(32) for i in range(n)]
+        snap_waits = [Signal(64) for i in range(n)]
+        self.submodules.snapshot_sync = PulseSynchronizer(idomain = "sys", odomain = cd_nubus)
+        self.comb += self.snapshot_sync.i.eq(self.snapshot.latch)
+        nubus_sync += If(self.snapshot_sync.o,
+                         snap_seq.eq(snap_seq + 1),
+                         *[ snap_grants[i].eq(grants[i]) for i in range(n) ],
+                         *[ snap_waits[i].eq(waits[i]) for i in range(n) ],
+        )
+        snap = Cat(snap_seq, *snap_grants, *snap_waits)
+        self.submodules.sync_snapshot = BusSynchronizer(width = len(snap), idomain = cd_nubus, odomain = "sys")
+        self.comb += [
+            self.sync_snapshot.i.eq(snap),
+            Cat(self.snapshot_seq.status,
+                *[ getattr(self, f"grants_{s}").status for s in sources ],
+                *[ getattr(self, f"wait_{s}").status for s in sources ]).eq(self.sync_snapshot.o),
+        ]
@@ -1,3 +1,6 @@
+from functools import reduce
+from operator import or_
+
 from migen import *
 from migen.genlib.fifo import *
 from migen.genlib.cdc import *
@@ -5,17 +8,37 @@ from migen.fhdl.specials import Tristate
 
 import litex
 from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.csr import *
+
+from nubus_status_mirror import NuBusStatusMirror
 
-class NuBus(Module):
+class NuBus(Module, AutoCSR):
     def __init__(self, soc, version,
                  burst_size, tosbus_fifo, fromsbus_fifo, fromsbus_req_fifo,
                  wb_read, wb_write, wb_dma,
                  usesampling=False,
+                 nubus90=False,
+                 wcomb=None,
+                 tryagain_budget=0,
+                 dma_bursts=False,
+                 dma_sched=None,
+                 check_unmapped=False,
                  cd_nubus="nubus", cd_nubus90="nubus90"):
         
         platform = soc.platform
+        self.soc = soc
+        self.cd_nubus = cd_nubus
         self.add_sources(platform, version)
 
+        if (nubus90 and (version != "V1.2")):
+            raise ValueError(f"NuBus90 requires the TM2 drivers of V1.2, unsupported on {version}")
+        if (usesampling and (tryagain_budget > 0)):
+            raise ValueError("Try-again responses are only supported without usesampling")
+        if (usesampling and check_unmapped):
+            raise ValueError("Unmapped address checking is only supported without usesampling")
+        if (usesampling and nubus90):
+            raise ValueError("NuBus90 is only supported without usesampling")
+
         #led0 = platform.request("user_led", 0)
         #led1 = platform.request("user_led", 1)
 
@@ -76,6 +99,11 @@ class NuBus(Module):
         rqst_i_n = Signal()
         rqst_o_n = Signal(reset = 1)
 
+        # NuBus90
+        tm2_oe = Signal()
+        tm2_i_n = Signal()
+        tm2_o_n = Signal(reset = 1)
+
         # sampled signals, exposing the value of the register acquired on the falling edge
         # they can change every cycle *on falling edge*
         # slave
@@ -89,17 +117,33 @@ class NuBus(Module):
         # master
         sampled_rqst = Signal()
 
+        # NuBus90
+        sampled_tm2 = Signal()
+        # same, but sampled on the falling edge of clk2x, for the 2x data phase
+        sampled90_tm0 = Signal()
+        sampled90_tm1 = Signal()
+        sampled90_ack = Signal()
+        sampled90_tm2 = Signal()
+        sampled90_ad = Signal(32)
+
+        # address of the transaction decoded by the slave: the sampled one, or one that started while the
+        # slave FSM was still busy after its previous ACK (NuBus90 block writes, see PushBlock), replayed from Idle
+        start_replay = Signal()
+        start_lat_ad = Signal(32)
+        slot_ad = Signal(32)
+        self.comb += slot_ad.eq(Mux(start_replay, start_lat_ad, sampled_ad))
+
         # address rewriting
         # can change every cycle *on falling edge*
         processed_ad = Signal(32)
         processed_super_ad = Signal(32)
         self.comb += [
-            processed_ad[0:23].eq(sampled_ad[0:23]),
-            If(~sampled_ad[23], # first 8 MiB of slot space: remap to last 8 Mib of SDRAM
+            processed_ad[0:23].eq(slot_ad[0:23]),
+            If(~slot_ad[23], # first 8 MiB of slot space: remap to last 8 Mib of SDRAM
                processed_ad[23:32].eq(Cat(Signal(1, reset=1), Signal(8, reset = 0x8f))), # 0x8f8...
             ).Else( # second 8 MiB: direct access
-                processed_ad[23:32].eq(Cat(sampled_ad[23], Signal(8, reset = 0xf0)))), # 24 bits, a.k.a 22 bits of words
-            processed_super_ad[0:28].eq(sampled_ad[0:28]),
+                processed_ad[23:32].eq(Cat(slot_ad[23], Signal(8, reset = 0xf0)))), # 24 bits, a.k.a 22 bits of words
+            processed_super_ad[0:28].eq(slot_ad[0:28]),
             processed_super_ad[28:32].eq(Signal(4, reset = 0x8)),
             sampled_ad_byterev[ 0: 8].eq(sampled_ad[24:32]),
             sampled_ad_byterev[ 8:16].eq(sampled_ad[16:24]),
@@ -118,16 +162,16 @@ class NuBus(Module):
         decoded_mysuperslot = Signal()
         self.comb += [
             decoded_myslot.eq(
-                (sampled_ad[28:32] == 0xF) &
-                (sampled_ad[27] == ~id_i_n[3]) &
-                (sampled_ad[26] == ~id_i_n[2]) &
-                (sampled_ad[25] == ~id_i_n[1]) &
-                (sampled_ad[24] == ~id_i_n[0])),
+                (slot_ad[28:32] == 0xF) &
+                (slot_ad[27] == ~id_i_n[3]) &
+                (slot_ad[26] == ~id_i_n[2]) &
+                (slot_ad[25] == ~id_i_n[1]) &
+                (slot_ad[24] == ~id_i_n[0])),
             decoded_mysuperslot.eq(
-                (sampled_ad[31] == ~id_i_n[3]) &
-                (sampled_ad[30] == ~id_i_n[2]) &
-                (sampled_ad[29] == ~id_i_n[1]) &
-                (sampled_ad[28] == ~id_i_n[0])),
+                (slot_ad[31] == ~id_i_n[3]) &
+                (slot_ad[30] == ~id_i_n[2]) &
+                (slot_ad[29] == ~id_i_n[1]) &
+                (slot_ad[28] == ~id_i_n[0])),
             #led0.eq(decoded_block),
         ]
 
@@ -139,6 +183,9 @@ class NuBus(Module):
         current_sel = Signal(4)
         #current_block = Signal()
         current_data = Signal(32)
+        current_swap = Signal() # access through a big-endian aperture
+        blk_push = Signal() # the write FIFO takes a word of a NuBus90 block write instead (see PushBlock)
+        blk_push_data = Signal(32)
 
         # write FIFO to speed up bus turnaround on NuBus side
         write_fifo_layout = [
@@ -146,10 +193,11 @@ class NuBus(Module):
             ("data", 32),
             ("sel", 4),
         ]
+        write_fifo_depth = 16
         if (usesampling):
-            self.submodules.write_fifo = write_fifo = SyncFIFOBuffered(width=layout_len(write_fifo_layout), depth=16)
+            self.submodules.write_fifo = write_fifo = SyncFIFOBuffered(width=layout_len(write_fifo_layout), depth=write_fifo_depth)
         else:
-            self.submodules.write_fifo = write_fifo = ClockDomainsRenamer({"read": "sys", "write": "nubus"})(AsyncFIFOBuffered(width=layout_len(write_fifo_layout), depth=16))
+            self.submodules.write_fifo = write_fifo = ClockDomainsRenamer({"read": "sys", "write": "nubus"})(AsyncFIFOBuffered(width=layout_len(write_fifo_layout), depth=write_fifo_depth))
         write_fifo_dout = Record(write_fifo_layout)
         self.comb += write_fifo_dout.raw_bits().eq(write_fifo.dout)
         write_fifo_din = Record(write_fifo_layout)
@@ -164,6 +212,7 @@ class NuBus(Module):
                                   i_nub_startn = start_i_n,
                                   i_nub_rqstn = rqst_i_n,
                                   i_nub_ackn = ack_i_n,
+                                  i_nub_tm2n = tm2_i_n,
                                   i_nub_adn = ad_i_n,
                                   
                                   o_tm0 = sampled_tm0,
@@ -171,16 +220,89 @@ class NuBus(Module):
                                   o_start = sampled_start,
                                   o_rqst = sampled_rqst,
                                   o_ack = sampled_ack,
+                                  o_tm2 = sampled_tm2,
                                   o_ad = sampled_ad,
                                   
                                   o_sel = decoded_sel,
                                   o_block = decoded_block,
                                   o_busy = decoded_busy,
         )
+        if (nubus90):
+            # same sampling, at twice the rate, only used during the 2x data phase of block transfers
+            self.specials += Instance("nubus_sampling",
+                                      i_nub_clkn = ClockSignal(cd_nubus90),
+                                      i_nub_resetn = ~ResetSignal(cd_nubus90),
+                                      i_nub_tm0n = tm0_i_n,
+                                      i_nub_tm1n = tm1_i_n,
+                                      i_nub_startn = start_i_n,
+                                      i_nub_rqstn = rqst_i_n,
+                                      i_nub_ackn = ack_i_n,
+                                      i_nub_tm2n = tm2_i_n,
+                                      i_nub_adn = ad_i_n,
+
+                                      o_tm0 = sampled90_tm0,
+                                      o_tm1 = sampled90_tm1,
+                                      o_ack = sampled90_ack,
+                                      o_tm2 = sampled90_tm2,
+                                      o_ad = sampled90_ad,
+            )
         
         self.read_ctr = read_ctr = Signal(32)
         self.writ_ctr = writ_ctr = Signal(32)
 
+        # events for the performance monitor (NuBusStat), NuBus domain
+        # slave side: apart from the ACK status, only from the non-sampling slave FSM
+        self.stat_read_start = Signal() # slave read accepted
+        self.stat_slave_ack = Signal() # slave ACK cycle
+        self.stat_slave_tryagain = Signal() # ... with try-again status
+        self.stat_slave_error = Signal() # ... with error status
+        self.stat_write_bytes = Signal(3) # slave write queued, that many bytes
+        self.stat_wfifo_level = Signal(8) # entries in the write FIFO (as seen from the NuBus side)
+        self.stat_wfifo_stall = Signal() # slave write waiting for room in the write FIFO
+        # master (DMA) side
+        self.stat_dma_arb = Signal() # waiting to get the bus
+        self.stat_dma_busy = Signal() # transaction in progress
+        self.stat_dma_burst = Signal() # ... it's a block transfer
+        self.stat_dma_we = Signal() # ... it's a write
+        self.stat_dma_bytes = Signal(8) # ... of that many bytes
+        self.stat_dma_ack = Signal() # ACK from the slave
+        self.stat_dma_tryagain = Signal() # ... with try-again status
+        self.stat_dma_error = Signal() # ... with error status
+
+        # with tosbus_fifo.re: the block wasn't written to the host (ended early, error or try-again status)
+        self.tosbus_err = Signal()
+
+        # accesses to addresses without a SoC region behind them get an error status at once,
+        # instead of waiting on the Wishbone (see do_finalize, the regions aren't all there yet)
+        self.check_unmapped = check_unmapped
+        self.slave_adr_mapped = Signal(reset = 1)
+        if (check_unmapped):
+            self.unmapped_ctr = unmapped_ctr = Signal(32)
+            self.unmapped = CSRStatus(32, description = "NuBus slave accesses to unmapped addresses (answered with an error status)")
+            self.submodules.sync_unmapped_ctr = BusSynchronizer(width = 32, idomain = cd_nubus, odomain = "sys")
+            self.comb += [
+                self.sync_unmapped_ctr.i.eq(unmapped_ctr),
+                self.unmapped.status.eq(self.sync_unmapped_ctr.o),
+            ]
+
+        # reads of regions that may have side effects (CSRs: reading some of them pops or clears something)
+        # never get a try-again, so their data can't end up in the completion buffer and be lost (see do_finalize)
+        self.nobuffer_regions = ["csr"]
+        self.slave_adr_nobuffer = Signal()
+
+        # big-endian apertures: windows of the slot space aliasing a SoC region with the byte lanes swapped,
+        # so that 32-bit registers read and write as-is from the 68k (see add_be_aperture, resolved in do_finalize)
+        self.usesampling = usesampling
+        self.be_apertures = []
+        self.slave_swap = Signal()
+        self.processed_ad = processed_ad
+        self.decoded_myslot = decoded_myslot
+        def slave_rdata(d):
+            return Mux(current_swap, Cat(d[24:32], d[16:24], d[8:16], d[0:8]), d)
+
+        # status CSRs mirrored in the NuBus domain (see add_status_mirror)
+        self.status_mirror = None
+
         if (usesampling):
             # ############# usesampling FSM
             self.submodules.slave_fsm = slave_fsm = FSM(reset_state="Reset")
@@ -302,47 +424,394 @@ class NuBus(Module):
             # ############# end of usesampling FSM
         else:
             # ############# non-usesampling FSM
+            # Reads are done by a 'fetch' that can outlive the NuBus transaction.
+            # With a try-again budget, if the data isn't there after tryagain_budget NuBus cycles,
+            # we answer 'try again later' (ACK with TM1*/TM0* unasserted) and let the fetch finish in a completion buffer,
+            # where the retried access finds it. Writes to the same address invalidate it.
+            # NuBus doesn't tell us who the master is (the ARB lines are released at START, a parked master doesn't
+            # arbitrate), so the buffer is tagged with the access itself, address and byte lanes, and expires after
+            # cbuf_timeout NuBus cycles if the retry doesn't come. Reads of nobuffer_regions wait for their data instead.
+            # Same thing for writes when the write FIFO stays full.
+            nubus_sync = getattr(self.sync, cd_nubus)
+            fetch_start = Signal()
+            fetch_active = Signal()
+            fetch_adr = Signal(32)
+            fetch_claimed = Signal() # the slave FSM is waiting for the fetch, the data goes straight to the NuBus
+            slave_adr = Signal(32)
+            self.comb += [
+                If(decoded_myslot,
+                   slave_adr.eq(processed_ad),
+                ).Else( # decoded_mysuperslot,
+                    slave_adr.eq(processed_super_ad),
+                ),
+                wb_read.cyc.eq(fetch_active),
+                wb_read.stb.eq(fetch_active),
+                wb_read.we.eq(0),
+                wb_read.sel.eq(0xf),
+                wb_read.adr.eq(fetch_adr[2:32]),
+            ]
+
+            # what Idle decodes: the sampled START, or the one latched while the FSM was busy (see start_replay)
+            start_pend = Signal()
+            start_lat_sel = Signal(4)
+            start_lat_tm = Signal(3) # tm0, tm1, tm2
+            s_start = Signal()
+            s_ack = Signal()
+            s_tm0 = Signal()
+            s_tm1 = Signal()
+            s_tm2 = Signal()
+            s_sel = Signal(4)
+            s_mine = Signal()
+            self.comb += [
+                s_start.eq(sampled_start | start_replay),
+                s_ack.eq(sampled_ack & ~start_replay),
+                s_tm0.eq(Mux(start_replay, start_lat_tm[0], sampled_tm0)),
+                s_tm1.eq(Mux(start_replay, start_lat_tm[1], sampled_tm1)),
+                s_tm2.eq(Mux(start_replay, start_lat_tm[2], sampled_tm2)),
+                s_sel.eq(Mux(start_replay, start_lat_sel, decoded_sel)),
+                s_mine.eq((decoded_myslot | decoded_mysuperslot) & s_start & ~s_ack),
+            ]
+
+            # reads of a block are fetched word by word from current_adr
+            fetch_req_adr = Signal(32)
+            blk_fetching = Signal()
+            self.comb += fetch_req_adr.eq(Mux(blk_fetching, current_adr, slave_adr))
+
+            # Store-to-load forwarding: reads go through wb_read, writes through the write FIFO and wb_write,
+            # so a read can overtake a write still in the FIFO.
+            # wfwd_* shadows the pending FIFO entries (one per address, a new write absorbs the older one),
+            # entries are retired as the sys side pops the FIFO (gray-coded count).
+            # A read fully covered by pending bytes is answered from the shadow, otherwise the pending
+            # bytes are merged in the fetched word.
+            wfwd_bits = log2_int(write_fifo_depth)
+            wfwd_valid = Signal(write_fifo_depth)
+            wfwd_adr = Array(Signal(30) for i in range(write_fifo_depth))
+            wfwd_data = Array(Signal(32) for i in range(write_fifo_depth))
+            wfwd_sel = Array(Signal(4) for i in range(write_fifo_depth))
+            wfwd_ins = Signal(wfwd_bits + 1)
+            wfwd_ret = Signal(wfwd_bits + 1)
+            wfwd_level = Signal(wfwd_bits + 1) # entries in the shadow (modulo, the pointers wrap)
+            wfwd_full = Signal() # the buffered FIFO holds one more than its depth, don't outrun the shadow
+            self.submodules.wfwd_retire_ctr = GrayCounter(wfwd_bits + 1) # sys
+            self.submodules.wfwd_retire_dec = ClockDomainsRenamer(cd_nubus)(GrayDecoder(wfwd_bits + 1))
+            self.specials += MultiReg(self.wfwd_retire_ctr.q, self.wfwd_retire_dec.i, odomain = cd_nubus)
+            self.comb += [
+                self.wfwd_retire_ctr.ce.eq(write_fifo.re & write_fifo.readable), # sink_ready of the combiner can be up with nothing to read
+                wfwd_level.eq(wfwd_ins - wfwd_ret),
+                wfwd_full.eq(wfwd_level == write_fifo_depth),
+            ]
+            # merge of the matching entries, for the write being queued and for the read being started
+            def wfwd_lookup(adr, sel, data):
+                match = Signal(write_fifo_depth)
+                stmts = [ match[i].eq(wfwd_valid[i] & (wfwd_adr[i] == adr)) for i in range(write_fifo_depth) ]
+                stmts += [ sel.eq(reduce(or_, [ Mux(match[i], wfwd_sel[i], 0) for i in range(write_fifo_depth) ])) ]
+                stmts += [ data.eq(reduce(or_, [ Mux(match[i], wfwd_data[i] & Cat(*[Replicate(wfwd_sel[i][b], 8) for b in range(4)]), 0)
+                                                  for i in range(write_fifo_depth) ])) ]
+                return (match, stmts)
+            wfwd_w_sel = Signal(4)
+            wfwd_w_data = Signal(32)
+            wfwd_r_sel = Signal(4)
+            wfwd_r_data = Signal(32)
+            (wfwd_w_match, stmts) = wfwd_lookup(current_adr[2:32], wfwd_w_sel, wfwd_w_data)
+            self.comb += stmts
+            (wfwd_r_match, stmts) = wfwd_lookup(fetch_req_adr[2:32], wfwd_r_sel, wfwd_r_data)
+            self.comb += stmts
+            self.submodules.status_mirror = status_mirror = NuBusStatusMirror(soc = soc, cd_nubus = cd_nubus)
+            self.comb += [
+                status_mirror.adr.eq(slave_adr),
+                status_mirror.wr_queued.eq(wfwd_ins),
+                status_mirror.wr_retired.eq(self.wfwd_retire_ctr.q_binary),
+            ]
+            wfwd_hit = Signal() # the read can be answered from the shadow
+            self.comb += wfwd_hit.eq(wfwd_r_sel == 0xf)
+            wfwd_retire = Signal()
+            self.comb += wfwd_retire.eq(wfwd_ret != self.wfwd_retire_dec.o)
+            # the retired slot can't be the inserted one: it would need wfwd_full
+            nubus_sync += [
+                If(wfwd_retire,
+                   wfwd_ret.eq(wfwd_ret + 1),
+                ),
+                If(write_fifo.we,
+                   wfwd_valid.eq((wfwd_valid & ~wfwd_w_match & ~Mux(wfwd_retire, 1 << wfwd_ret[0:wfwd_bits], 0)) | (1 << wfwd_ins[0:wfwd_bits])),
+                   wfwd_adr[wfwd_ins[0:wfwd_bits]].eq(current_adr[2:32]),
+                   wfwd_sel[wfwd_ins[0:wfwd_bits]].eq(current_sel | wfwd_w_sel),
+                   wfwd_data[wfwd_ins[0:wfwd_bits]].eq(Cat(*[Mux(current_sel[b], write_fifo_din.data[b*8:(b+1)*8], wfwd_w_data[b*8:(b+1)*8]) for b in range(4)])),
+                   wfwd_ins.eq(wfwd_ins + 1),
+                ).Elif(wfwd_retire,
+                       wfwd_valid.eq(wfwd_valid & ~(1 << wfwd_ret[0:wfwd_bits])),
+                ),
+            ]
+
+            # bytes pending in the write FIFO when the fetch started take precedence over the fetched ones
+            fetch_fwd_sel = Signal(4)
+            fetch_fwd_data = Signal(32)
+            fetch_data = Signal(32)
+            self.comb += fetch_data.eq(Cat(*[Mux(fetch_fwd_sel[b], fetch_fwd_data[b*8:(b+1)*8], wb_read.dat_r[b*8:(b+1)*8]) for b in range(4)]))
+            nubus_sync += [
+                If(fetch_start,
+                   fetch_active.eq(1),
+                   fetch_adr.eq(fetch_req_adr),
+                   fetch_fwd_sel.eq(wfwd_r_sel),
+                   fetch_fwd_data.eq(wfwd_r_data),
+                ).Elif(wb_read.ack,
+                       fetch_active.eq(0),
+                )
+            ]
+
+            if (tryagain_budget > 0):
+                budget_ctr = Signal(max = tryagain_budget + 1)
+                budget_over = Signal()
+                fetch_stale = Signal() # written while being fetched, don't keep the data
+                cbuf_valid = Signal()
+                cbuf_adr = Signal(32)
+                cbuf_data = Signal(32)
+                cbuf_sel = Signal(4)
+                cbuf_take = Signal()
+                cbuf_hit = Signal()
+                cbuf_timeout = 32
+                cbuf_timer = Signal(max = cbuf_timeout + 1)
+                fetch_sel = Signal(4) # byte lanes of the access that started the fetch
+                current_nobuffer = Signal() # the read can't be answered with a try-again
+                write_snoop = Signal()
+                self.comb += [
+                    budget_over.eq(budget_ctr == tryagain_budget),
+                    write_snoop.eq(write_fifo.we),
+                ]
+                nubus_sync += [
+                    If(fetch_start,
+                       fetch_stale.eq(0),
+                       fetch_sel.eq(s_sel),
+                    ).Elif(write_snoop & (current_adr[2:32] == fetch_adr[2:32]),
+                           fetch_stale.eq(1),
+                    ),
+                    If(cbuf_take | (cbuf_timer == 0),
+                       cbuf_valid.eq(0),
+                    ).Else(
+                        cbuf_timer.eq(cbuf_timer - 1),
+                    ),
+                    If(fetch_active & wb_read.ack & ~fetch_claimed & ~fetch_stale &
+                       ~(write_snoop & (current_adr[2:32] == fetch_adr[2:32])), # nobody waiting for it, keep it for the retry
+                       cbuf_valid.eq(1),
+                       cbuf_adr.eq(fetch_adr),
+                       cbuf_sel.eq(fetch_sel),
+                       cbuf_data.eq(fetch_data),
+                       cbuf_timer.eq(cbuf_timeout),
+                    ),
+                    If(write_snoop & (current_adr[2:32] == cbuf_adr[2:32]),
+                       cbuf_valid.eq(0),
+                    ),
+                ]
+                self.comb += cbuf_hit.eq(cbuf_valid & (cbuf_adr[2:32] == slave_adr[2:32]) & (cbuf_sel == s_sel))
+                handle_read_start = [
+                    NextValue(budget_ctr, 0),
+                    NextValue(current_nobuffer, self.slave_adr_nobuffer),
+                    If(wfwd_hit, # pending write
+                       NextValue(current_data, wfwd_r_data),
+                       NextState("ReadFromBuffer"),
+                    ).Elif(cbuf_hit, # the retry of an access we answered with try-again
+                       cbuf_take.eq(1),
+                       NextValue(current_data, cbuf_data),
+                       NextState("ReadFromBuffer"),
+                    ).Elif(fetch_active & (fetch_adr[2:32] == slave_adr[2:32]) & ~fetch_stale, # the retry came before the data
+                           NextState("WaitWBRead"),
+                    ).Elif(fetch_active, # busy fetching for somebody else
+                           NextState("TryAgain"),
+                    ).Else(
+                        fetch_start.eq(1),
+                        NextState("WaitWBRead"),
+                    )
+                ]
+                handle_read_late = [
+                    If(~fetch_active & cbuf_valid & (cbuf_adr[2:32] == current_adr[2:32]), # fetch completed while we were in Idle
+                       cbuf_take.eq(1),
+                       ad_oe.eq(1),
+                       ad_o_n.eq(~slave_rdata(cbuf_data)),
+                       tm0_o_n.eq(0),
+                       tm1_o_n.eq(0),
+                       ack_o_n.eq(0),
+                       NextState("Idle"),
+                    ).Elif(budget_over,
+                           If(~current_nobuffer,
+                              ack_o_n.eq(0), # try again later, the fetch carries on
+                              NextState("Idle"),
+                           )
+                    ).Else(
+                        NextValue(budget_ctr, budget_ctr + 1),
+                    )
+                ]
+                handle_write_late = [
+                    If(budget_over,
+                       ack_o_n.eq(0), # try again later
+                       NextState("Idle"),
+                    ).Else(
+                        NextValue(budget_ctr, budget_ctr + 1),
+                    )
+                ]
+            else:
+                handle_read_start = [
+                    If(wfwd_hit, # pending write
+                       NextValue(current_data, wfwd_r_data),
+                       NextState("ReadFromBuffer"),
+                    ).Else(
+                        fetch_start.eq(1),
+                        NextState("WaitWBRead"),
+                    )
+                ]
+                handle_read_late = []
+                handle_write_late = []
+            handle_read_start = [
+                If(status_mirror.hit, # mirrored status, nothing pending that could change it
+                   *([cbuf_take.eq(cbuf_hit)] if (tryagain_budget > 0) else []),
+                   NextValue(current_data, status_mirror.dat),
+                   NextState("ReadFromBuffer"),
+                ).Else(
+                    *handle_read_start,
+                )
+            ]
+
             self.submodules.slave_fsm = slave_fsm = ClockDomainsRenamer(cd_nubus)(FSM(reset_state="Reset"))
+            self.comb += [
+                self.stat_write_bytes.eq(Mux(write_fifo.we, current_sel[0] + current_sel[1] + current_sel[2] + current_sel[3], 0)),
+                self.stat_wfifo_level.eq(wfwd_level),
+                self.stat_wfifo_stall.eq(slave_fsm.ongoing("NubusWriteDataToFIFO") & ~write_fifo.we),
+            ]
             slave_fsm.act("Reset",
                           NextState("Idle")
             )
+            self.slave_adr = slave_adr # checked in do_finalize
+            self.comb += self.stat_read_start.eq(slave_fsm.ongoing("Idle") & s_mine & ~s_tm1 & self.slave_adr_mapped)
+            slave_idle = If(s_mine & ~self.slave_adr_mapped,
+                            *([NextValue(unmapped_ctr, unmapped_ctr + 1)] if check_unmapped else []),
+                            NextState("Unmapped"),
+            )
+            if (nubus90):
+                # NuBus90: block transfers of up to blk_max words. Reads are fetched first, then go out
+                # at 1x, or at 2x (slave90_fsm) if the master asked with TM2 and the 2x engine is free.
+                # Writes go to the write FIFO as they come at 1x, or at 2x if there's room for the whole block.
+                # Other sizes get an error status.
+                blk_max = 16
+                blk90_l = [Signal(32) for i in range(blk_max)] # nubus90 copy of the block
+                blk90 = Array(blk90_l)
+                s_block = Signal()
+                s_blk_n = Signal(4) # words - 1
+                s_blk_ok = Signal()
+                blk_adr = Signal(32) # aligned start of the block
+                blk_n = Signal(4)
+                blk_k = Signal(4) # current word
+                blk_last = Signal()
+                blk_we = Signal()
+                blk_2x = Signal()
+                blk_data = Array(Signal(32) for i in range(blk_max)) # fetched words
+                blk_store = Signal()
+                blk_fetch_own = Signal() # the fetch in flight is for the block
+                s90_req = Signal() # nubus: slave90_fsm owns the block, blk_data/blk_n/blk_we don't move
+                s90_rdy = Signal() # nubus90: slave90_fsm has the block, waiting for our first 1x response
+                s90_done = Signal() # nubus90: the 2x data phase is over
+                s90_req_s = Signal()
+                s90_rdy_s = Signal()
+                s90_done_s = Signal()
+                s90_free = Signal()
+                s90_room = Signal() # the write FIFO can take the whole block
+                self.specials += [
+                    MultiReg(s90_req, s90_req_s, odomain = cd_nubus90),
+                    MultiReg(s90_rdy, s90_rdy_s, odomain = cd_nubus),
+                    MultiReg(s90_done, s90_done_s, odomain = cd_nubus),
+                ]
+                self.comb += [
+                    s_block.eq(~s_tm0 & slot_ad[1] & ~slot_ad[0]),
+                    If(~slot_ad[2],
+                       s_blk_n.eq(1),
+                       s_blk_ok.eq(1),
+                    ).Elif(~slot_ad[3],
+                           s_blk_n.eq(3),
+                           s_blk_ok.eq(1),
+                    ).Elif(~slot_ad[4],
+                           s_blk_n.eq(7),
+                           s_blk_ok.eq(1),
+                    ).Elif(~slot_ad[5],
+                           s_blk_n.eq(15),
+                           s_blk_ok.eq(1),
+                    ),
+                    blk_adr.eq(Cat(Replicate(0, 2), slave_adr[2:6] & ~s_blk_n, slave_adr[6:32])),
+                    blk_last.eq(blk_k == blk_n),
+                    blk_fetching.eq(slave_fsm.ongoing("BlockFetch")),
+                    fetch_claimed.eq(slave_fsm.ongoing("WaitWBRead") | (slave_fsm.ongoing("BlockFetch") & blk_fetch_own)),
+                    s90_free.eq(~s90_req & ~s90_rdy_s),
+                    s90_room.eq((wfwd_level + s_blk_n + 1) <= write_fifo_depth),
+                    self.stat_wfifo_stall.eq((slave_fsm.ongoing("NubusWriteDataToFIFO") | slave_fsm.ongoing("BlockWrite")) & ~write_fifo.we),
+                    blk_push_data.eq(Mux(current_swap, Cat(blk90[blk_k][24:32], blk90[blk_k][16:24], blk90[blk_k][8:16], blk90[blk_k][0:8]), blk90[blk_k])),
+                ]
+                nubus_sync += If(blk_store,
+                                 blk_data[blk_k].eq(fetch_data),
+                )
+                # START for us while the FSM is still busy after an ACK (slave90_fsm ACKs on its own), replayed from Idle
+                self.comb += start_replay.eq(slave_fsm.ongoing("Idle") & start_pend)
+                nubus_sync += If(slave_fsm.ongoing("Idle"),
+                                 start_pend.eq(0),
+                ).Elif(s_mine & ~start_pend,
+                       start_pend.eq(1),
+                       start_lat_ad.eq(sampled_ad),
+                       start_lat_sel.eq(decoded_sel),
+                       start_lat_tm.eq(Cat(sampled_tm0, sampled_tm1, sampled_tm2)),
+                )
+                slave_idle = slave_idle.Elif(s_mine & s_block & ~s_blk_ok,
+                                             NextState("Unmapped"),
+                ).Elif(s_mine & s_block & s_tm1, # block write
+                       NextValue(current_adr, blk_adr),
+                       NextValue(current_sel, 0xf),
+                       NextValue(current_swap, self.slave_swap),
+                       NextValue(writ_ctr, writ_ctr + 1),
+                       NextValue(blk_n, s_blk_n),
+                       NextValue(blk_k, 0),
+                       NextValue(blk_we, 1),
+                       *([NextValue(budget_ctr, 0)] if (tryagain_budget > 0) else []),
+                       If(s_tm2 & s90_free & s90_room,
+                          NextValue(s90_req, 1),
+                          NextState("Block90Arm"),
+                       ).Else(
+                           NextState("BlockWrite"),
+                       )
+                ).Elif(s_mine & s_block, # block read
+                       NextValue(current_adr, blk_adr),
+                       NextValue(current_swap, self.slave_swap),
+                       NextValue(read_ctr, read_ctr + 1),
+                       NextValue(blk_n, s_blk_n),
+                       NextValue(blk_k, 0),
+                       NextValue(blk_we, 0),
+                       NextValue(blk_2x, s_tm2 & s90_free),
+                       NextState("BlockFetch"),
+                )
+            else:
+                self.comb += fetch_claimed.eq(slave_fsm.ongoing("WaitWBRead"))
             slave_fsm.act("Idle",
-                          If((decoded_myslot | decoded_mysuperslot) & sampled_start & ~sampled_ack & ~sampled_tm1,# & ~decoded_block, # regular read (we always send back 32 bits, so don't worry about byte/word)
-                             If(decoded_myslot,
-                                NextValue(current_adr, processed_ad),
-                             ).Else( # decoded_mysuperslot,
-                                 NextValue(current_adr, processed_super_ad),
-                             ),
+                          slave_idle.Elif(s_mine & ~s_tm1,# & ~decoded_block, # regular read (we always send back 32 bits, so don't worry about byte/word)
+                             NextValue(current_adr, slave_adr),
+                             NextValue(current_swap, self.slave_swap),
                              NextValue(read_ctr, read_ctr + 1),
-                             NextState("WaitWBRead"),
-                          ).Elif((decoded_myslot | decoded_mysuperslot) & sampled_start & ~sampled_ack & sampled_tm1,# & ~decoded_block, # regular write
-                                 If(decoded_myslot,
-                                    NextValue(current_adr, processed_ad),
-                                 ).Else( # decoded_mysuperslot,
-                                     NextValue(current_adr, processed_super_ad),
-                                 ),
-                                 NextValue(current_sel, decoded_sel),
+                             *handle_read_start,
+                          ).Elif(s_mine & s_tm1,# & ~decoded_block, # regular write
+                                 NextValue(current_adr, slave_adr),
+                                 NextValue(current_sel, Mux(self.slave_swap, Cat(s_sel[3], s_sel[2], s_sel[1], s_sel[0]), s_sel)),
+                                 NextValue(current_swap, self.slave_swap),
                                  NextValue(writ_ctr, writ_ctr + 1),
+                                 *([NextValue(budget_ctr, 0)] if (tryagain_budget > 0) else []),
                                  NextState("NubusWriteDataToFIFO"),
                           )
             )
             slave_fsm.act("WaitWBRead",
-                          wb_read.cyc.eq(1),
-                          wb_read.stb.eq(1),
-                          wb_read.we.eq(0),
-                          wb_read.sel.eq(0xf),
-                          wb_read.adr.eq(current_adr[2:32]),
                           tmo_oe.eq(1),
                           tm0_o_n.eq(1),
                           tm1_o_n.eq(1),
                           ack_o_n.eq(1),
-                          If(wb_read.ack,
+                          If(fetch_active & wb_read.ack,
                              ad_oe.eq(1),
-                             ad_o_n.eq(~wb_read.dat_r),
+                             ad_o_n.eq(~slave_rdata(fetch_data)),
                              tm0_o_n.eq(0),
                              tm1_o_n.eq(0),
                              ack_o_n.eq(0),
                              NextState("Idle"),
+                          ).Else(
+                              *handle_read_late,
                           )
             )
             slave_fsm.act("NubusWriteDataToFIFO",
@@ -350,42 +819,280 @@ class NuBus(Module):
                           tm0_o_n.eq(1),
                           tm1_o_n.eq(1),
                           ack_o_n.eq(1),
-                          If(write_fifo.writable,
+                          If(write_fifo.writable & ~wfwd_full,
                              write_fifo.we.eq(1),
                              tm0_o_n.eq(0),
                              tm1_o_n.eq(0),
                              ack_o_n.eq(0),
                              NextState("Idle"),
+                          ).Else(
+                              *handle_write_late,
                           )
             )
+            slave_fsm.act("Unmapped", # error status
+                          tmo_oe.eq(1),
+                          tm0_o_n.eq(1),
+                          tm1_o_n.eq(0),
+                          ack_o_n.eq(0),
+                          NextState("Idle"),
+            )
+            slave_fsm.act("ReadFromBuffer",
+                          tmo_oe.eq(1),
+                          ad_oe.eq(1),
+                          ad_o_n.eq(~slave_rdata(current_data)),
+                          tm0_o_n.eq(0),
+                          tm1_o_n.eq(0),
+                          ack_o_n.eq(0),
+                          NextState("Idle"),
+            )
+            if (tryagain_budget > 0):
+                slave_fsm.act("TryAgain",
+                              tmo_oe.eq(1),
+                              tm0_o_n.eq(1),
+                              tm1_o_n.eq(1),
+                              ack_o_n.eq(0),
+                              NextState("Idle"),
+                )
+            if (nubus90):
+                slave_fsm.act("BlockFetch", # one word at a time, wait for a fetch in flight for a single read
+                              If(~fetch_active,
+                                 fetch_start.eq(1),
+                                 NextValue(blk_fetch_own, 1),
+                              ).Elif(wb_read.ack & blk_fetch_own,
+                                     blk_store.eq(1),
+                                     NextValue(blk_fetch_own, 0),
+                                     NextValue(current_adr, current_adr + 4),
+                                     NextValue(blk_k, blk_k + 1),
+                                     If(blk_last,
+                                        NextValue(blk_k, 0),
+                                        If(blk_2x,
+                                           NextValue(s90_req, 1),
+                                           NextState("Block90Arm"),
+                                        ).Else(
+                                            NextState("BlockReadData"),
+                                        )
+                                     )
+                              )
+                )
+                slave_fsm.act("BlockReadData", # 1x, TM0 for every word, ACK with the last one
+                              tmo_oe.eq(1),
+                              ad_oe.eq(1),
+                              ad_o_n.eq(~slave_rdata(blk_data[blk_k])),
+                              tm0_o_n.eq(0),
+                              tm1_o_n.eq(~blk_last),
+                              ack_o_n.eq(~blk_last),
+                              NextValue(blk_k, blk_k + 1),
+                              If(blk_last,
+                                 NextState("Idle"),
+                              )
+                )
+                slave_fsm.act("BlockWrite", # 1x, the master holds the word until it sees TM0
+                              tmo_oe.eq(1),
+                              tm0_o_n.eq(1),
+                              tm1_o_n.eq(1),
+                              ack_o_n.eq(1),
+                              If(write_fifo.writable & ~wfwd_full,
+                                 write_fifo.we.eq(1),
+                                 tm0_o_n.eq(0),
+                                 tm1_o_n.eq(~blk_last),
+                                 ack_o_n.eq(~blk_last),
+                                 NextValue(current_adr, current_adr + 4),
+                                 NextValue(blk_k, blk_k + 1),
+                                 If(blk_last,
+                                    NextState("Idle"),
+                                 )
+                              ).Else(
+                                  *handle_write_late,
+                              )
+                )
+                slave_fsm.act("Block90Arm", # slave90_fsm takes the block
+                              If(s90_rdy_s,
+                                 If(blk_we,
+                                    NextState("Block90WrFirst"),
+                                 ).Else(
+                                     NextState("Block90RdFirst"),
+                                 )
+                              )
+                )
+                slave_fsm.act("Block90RdFirst", # first word at 1x with TM2, the rest comes from slave90_fsm
+                              tmo_oe.eq(1),
+                              ad_oe.eq(1),
+                              ad_o_n.eq(~slave_rdata(blk_data[0])),
+                              tm0_o_n.eq(0),
+                              tm1_o_n.eq(1),
+                              ack_o_n.eq(1),
+                              tm2_oe.eq(1),
+                              tm2_o_n.eq(0),
+                              NextState("Block90Wait"),
+                )
+                slave_fsm.act("Block90WrFirst", # first word at 1x with TM2, slave90_fsm takes the rest (s90_room)
+                              tmo_oe.eq(1),
+                              tm0_o_n.eq(0),
+                              tm1_o_n.eq(1),
+                              ack_o_n.eq(1),
+                              tm2_oe.eq(1),
+                              tm2_o_n.eq(0),
+                              write_fifo.we.eq(1),
+                              NextValue(current_adr, current_adr + 4),
+                              NextValue(blk_k, 1),
+                              NextState("Block90Wait"),
+                )
+                slave_fsm.act("Block90Wait", # slave90_fsm drives the bus, up to the ACK
+                              If(s90_done_s,
+                                 If(blk_we,
+                                    NextState("PushBlock"),
+                                 ).Else(
+                                     NextValue(s90_req, 0),
+                                     NextState("Idle"),
+                                 )
+                              )
+                )
+                slave_fsm.act("PushBlock", # words 1 to blk_n of a 2x write, from slave90_fsm to the write FIFO
+                              blk_push.eq(1),
+                              If(write_fifo.writable & ~wfwd_full,
+                                 write_fifo.we.eq(1),
+                                 NextValue(current_adr, current_adr + 4),
+                                 NextValue(blk_k, blk_k + 1),
+                                 If(blk_last,
+                                    NextValue(s90_req, 0),
+                                    NextState("Idle"),
+                                 )
+                              )
+                )
+
+                # slave90_fsm: the 2x part of a block transfer, words 1 to blk_n.
+                # It copies the block when s90_req shows up, waits for our own first 1x response (with TM2),
+                # then sends or takes a word every clk2x cycle. Blocks have an even number of words, so the last
+                # one starts on a NuBus clock edge; its ACK is held for the whole NuBus cycle for the 1x observers.
+                k90 = Signal(4)
+                last90 = Signal()
+                s90_load = Signal()
+                s90_store = Signal()
+                self.comb += last90.eq(k90 == blk_n)
+                getattr(self.sync, cd_nubus90).__iadd__(
+                    If(s90_load,
+                       *[blk90_l[i].eq(slave_rdata(blk_data[i])) for i in range(blk_max)],
+                    ).Elif(s90_store,
+                           blk90[k90].eq(sampled90_ad),
+                    )
+                )
+                self.submodules.slave90_fsm = slave90_fsm = ClockDomainsRenamer(cd_nubus90)(FSM(reset_state="Reset"))
+                slave90_fsm.act("Reset",
+                                NextState("Idle")
+                )
+                slave90_fsm.act("Idle",
+                                If(s90_req_s,
+                                   s90_load.eq(~blk_we),
+                                   NextValue(s90_rdy, 1),
+                                   NextState("Ready"),
+                                )
+                )
+                slave90_fsm.act("Ready",
+                                If(sampled90_tm0 & sampled90_tm2 & ~sampled90_ack, # our first response
+                                   NextValue(k90, 1),
+                                   NextState("SkipFirst"),
+                                )
+                )
+                slave90_fsm.act("SkipFirst", # second 2x sample of the 1x response
+                                NextState("Data"),
+                )
+                slave90_fsm.act("Data", # word k90 on the bus, sampled at the end of the 2x cycle
+                                tmo_oe.eq(1),
+                                If(~blk_we,
+                                   ad_oe.eq(1),
+                                   ad_o_n.eq(~blk90[k90]),
+                                ),
+                                tm0_o_n.eq(0),
+                                tm1_o_n.eq(~last90),
+                                ack_o_n.eq(~last90),
+                                s90_store.eq(blk_we),
+                                NextValue(k90, k90 + 1),
+                                If(last90,
+                                   NextState("AckHold"),
+                                )
+                )
+                slave90_fsm.act("AckHold",
+                                tmo_oe.eq(1),
+                                If(~blk_we,
+                                   ad_oe.eq(1),
+                                   ad_o_n.eq(~blk90[blk_n]),
+                                ),
+                                tm0_o_n.eq(0),
+                                tm1_o_n.eq(0),
+                                ack_o_n.eq(0),
+                                NextValue(s90_done, 1),
+                                NextState("Done"),
+                )
+                slave90_fsm.act("Done",
+                                If(~s90_req_s,
+                                   NextValue(s90_rdy, 0),
+                                   NextValue(s90_done, 0),
+                                   NextState("Idle"),
+                                )
+                )
             # ############# end of non-usesampling FSM
 
         # connect the write FIFO inputs
         self.comb += [ write_fifo_din.adr.eq(current_adr), # recorded
-                       write_fifo_din.data.eq(~ad_i_n if usesampling else sampled_ad), 
+                       write_fifo_din.data.eq(~ad_i_n if usesampling else Mux(blk_push, blk_push_data, Mux(current_swap, sampled_ad_byterev, sampled_ad))),
                        write_fifo_din.sel.eq(current_sel), # recorded
         ]
-        # deal with emptying the Write FIFO to the write WB
-        self.comb += [ wb_write.cyc.eq(write_fifo.readable),
-                       wb_write.stb.eq(write_fifo.readable),
-                       wb_write.we.eq(1),
-                       wb_write.adr.eq(write_fifo_dout.adr[2:32]),
-                       wb_write.dat_w.eq(write_fifo_dout.data),
-                       wb_write.sel.eq(write_fifo_dout.sel),
-                       write_fifo.re.eq(wb_write.ack),
-        ]
+        if (wcomb is None):
+            # deal with emptying the Write FIFO to the write WB
+            self.comb += [ wb_write.cyc.eq(write_fifo.readable),
+                           wb_write.stb.eq(write_fifo.readable),
+                           wb_write.we.eq(1),
+                           wb_write.adr.eq(write_fifo_dout.adr[2:32]),
+                           wb_write.dat_w.eq(write_fifo_dout.data),
+                           wb_write.sel.eq(write_fifo_dout.sel),
+                           write_fifo.re.eq(wb_write.ack),
+            ]
+        else:
+            # the write-combiner empties the Write FIFO, and handles wb_write itself
+            self.comb += [ wcomb.sink_valid.eq(write_fifo.readable),
+                           wcomb.sink_adr.eq(write_fifo_dout.adr),
+                           wcomb.sink_data.eq(write_fifo_dout.data),
+                           wcomb.sink_sel.eq(write_fifo_dout.sel),
+                           write_fifo.re.eq(wcomb.sink_ready),
+            ]
 
-        owning_bus = Signal(reset = 0) # fixme ; theoretically one can bypass arbitration when owning the bus
+        owning_bus = Signal(reset = 0) # bus parking: the last owner can start again without arbitration if nobody else requested
 
         start_arbitration = Signal()
         grant = Signal()
         master_oe = Signal()
 
+        # overlapped arbitration: during the data phase of a transaction, if more DMA is queued,
+        # assert RQST (and arbitrate) so the next transaction can start right after this one's ACK
+        rqst_hold = Signal()
+        arb_ctr = Signal(2) # arbitration takes 2 clocks before grant is meaningful
+        arb_ok = Signal()
+        own_rqst_d = Signal() # we were driving RQST in the previous cycle, so sampled_rqst may be our own
+        b2b_max = 8 # fairness cap: after that many back-to-back overlapped transactions, skip one so others can get in
+        b2b_ctr = Signal(max = b2b_max + 1)
+        dma_more = Signal() # there's more DMA queued after the current transaction
+
         nubus_sync = getattr(self.sync, cd_nubus)
         nubus_sync += [
-            If(sampled_rqst & ~start_arbitration,
+            own_rqst_d.eq(rqst_oe & ~rqst_o_n),
+            If(sampled_rqst & ~start_arbitration & ~own_rqst_d, # someone else wants the bus
                owning_bus.eq(0),
-            )
+            ),
+            If(rqst_hold,
+               If(~arb_ok,
+                  arb_ctr.eq(arb_ctr + 1),
+               ),
+            ).Else(
+                arb_ctr.eq(0),
+            ),
+        ]
+        self.comb += [
+            arb_ok.eq(arb_ctr == 2),
+            If(rqst_hold,
+               start_arbitration.eq(1),
+               rqst_oe.eq(1),
+               rqst_o_n.eq(0),
+            ),
         ]
         
         self.submodules.dma_fsm = dma_fsm = ClockDomainsRenamer(cd_nubus)(FSM(reset_state="Reset"))
@@ -399,6 +1106,23 @@ class NuBus(Module):
         fifo_addr = Signal(blk_addr_width)
         fifo_blk_addr = Signal(blk_addr_width)
         fifo_buffer = Signal(data_width_bits)
+        wbg_data = Signal(data_width_bits) # write-gathering buffer for wb_dma
+
+        # NuBus90 2x data phase, see burst90_fsm
+        # arm90 goes to nubus90 through a MultiReg, the end of the data phase comes back as a toggle (done90_t);
+        # abort90 and fifo_buffer90 are only read by the 1x FSM after the toggle, when they don't move anymore
+        arm90 = Signal() # nubus: we ask for a 2x block transfer in the address cycle
+        no90 = Signal() # nubus: the last 2x attempt was aborted by the slave, retry the same transfer at 1x
+        done90 = Signal() # nubus: the 2x data phase is over (done90_s != done90_seen)
+        done90_t = Signal() # nubus90: toggled at the end of the 2x data phase
+        done90_s = Signal() # done90_t in nubus
+        done90_seen = Signal()
+        m90_active = Signal() # nubus90: burst90_fsm is in the data phase, the 1x FSM drives the bus only while it is
+        abort90 = Signal() # nubus90: the 2x data phase was ended early by the slave
+        ctr90 = Signal(log2_int(burst_size)) # burst counter at 2x
+        fifo_buffer90 = Signal(data_width_bits)
+        wdata90 = Signal(data_width_bits) # burst_wdata, registered in nubus90
+        burst90_dout = Signal(32)
         
         tosbus_fifo_dout = Record(soc.tosbus_layout)
         self.comb += tosbus_fifo_dout.raw_bits().eq(tosbus_fifo.dout)
@@ -411,6 +1135,217 @@ class NuBus(Module):
         
         fromsbus_fifo_din = Record(soc.fromsbus_layout)
         self.comb += fromsbus_fifo.din.eq(fromsbus_fifo_din.raw_bits())
+        if ("tag" in [f[0] for f in soc.fromsbus_req_layout]): # the response goes back to whoever asked (DMAFIFOShare), it's pushed as the request is removed
+            self.comb += fromsbus_fifo_din.tag.eq(fromsbus_req_fifo_dout.tag)
+
+        # single-word NuBus cycles come from wb_dma, or from the write-gathering buffer when it can't go as a block
+        single_req = Signal()
+        single_adr = Signal(30)
+        single_dat_w = Signal(32)
+        single_sel = Signal(4)
+        single_we = Signal()
+        single_ack = Signal()
+        burst_src_wb = Signal() # the current block transfer is for wb_dma, not for the FIFOs
+        burst_wdata = Signal(data_width_bits)
+        wb_more = Signal() # wb_dma has something for the NuBus
+        blk_wr_done = Signal() # block write from the gathering buffer done
+        blk_wr_fail = Signal() # ... or refused by the slave, replay as single cycles
+        blk_rd_done = Signal() # block read for wb_dma done
+        blk_rd_fail = Signal() # ... or refused by the slave, do a single cycle
+        blk_rd_data = Signal(data_width_bits)
+        wbg_blk = Signal(blk_addr_width) # block of the gathering buffer
+        wbg_block = Signal() # the gathering buffer goes as a block write
+        wb_blk = Signal(blk_addr_width) # block of the wb_dma access
+        rd_block = Signal() # the wb_dma read goes as a block read
+        self.comb += burst_wdata.eq(Mux(burst_src_wb, wbg_data, tosbus_fifo_dout.data))
+
+        if (dma_bursts):
+            # Wishbone bursts and sequential accesses on wb_dma become NuBus block transfers
+            # Writes: full-word writes to the same block are gathered (and acked, they are posted anyway);
+            # a full block is written in one block transfer, a partial one (or one the slave can't take as a block)
+            # is replayed as single cycles. The buffer is flushed before anything else from wb_dma, and after a few idle cycles.
+            # Reads: an incrementing Wishbone burst (CTI 0b010, linear) reads the whole block, the rest of the burst is served from it.
+            # The block only serves the next word of that burst (a new burst, even in the same block, reads it again),
+            # and is dropped at the end of the burst, on any other access, or after a few idle cycles (a burst ended without CTI 0b111).
+            word_bits = log2_int(burst_size)
+            wbg_timeout = 4
+            wbg_mask = Signal(burst_size)
+            wbg_timer = Signal(max = wbg_timeout + 1)
+            wbg_flush = Signal() # no more gathering, empty the buffer
+            wbg_noblock = Signal() # the slave refused the block write
+            wbg_valid = Signal()
+            wbg_full = Signal()
+            wbg_take = Signal()
+            wbg_flush_start = Signal()
+            wbg_replay = Signal()
+            replay_idx = Signal(word_bits)
+            rbuf_valid = Signal()
+            rbuf_blk = Signal(blk_addr_width)
+            rbuf_data = Signal(data_width_bits)
+            rbuf_match = Signal()
+            rbuf_hit = Signal()
+            rbuf_next = Signal(word_bits) # the word the burst reads next
+            rbuf_timeout = 16
+            rbuf_timer = Signal(max = rbuf_timeout + 1)
+            rd_noblock = Signal()
+            wb_single = Signal()
+            wb_word = Signal(word_bits)
+            wb_access = Signal()
+            take_window = Signal() # wb_dma isn't being served by a single cycle
+            self.comb += [
+                wb_blk.eq(wb_dma.adr[word_bits:30]),
+                wb_word.eq(wb_dma.adr[0:word_bits]),
+                wb_access.eq(wb_dma.cyc & wb_dma.stb),
+                take_window.eq(dma_fsm.ongoing("Idle") | (burst & ~burst_src_wb)),
+                wbg_valid.eq(wbg_mask != 0),
+                wbg_full.eq(wbg_mask == (2**burst_size - 1)),
+                wbg_flush_start.eq(wbg_valid & ~wbg_flush & (wbg_full | (wbg_timer == 0) |
+                                                             (wb_access & ~(wb_dma.we & (wb_dma.sel == 0xf) & (wb_blk == wbg_blk))))),
+                wbg_take.eq(take_window & wb_access & wb_dma.we & (wb_dma.sel == 0xf) &
+                            (~wbg_valid | (wb_blk == wbg_blk)) & ~wbg_flush & ~wbg_flush_start),
+                wbg_replay.eq(wbg_flush & (~wbg_full | wbg_noblock)),
+                wbg_block.eq(wbg_flush & wbg_full & ~wbg_noblock),
+                rbuf_match.eq(wb_access & ~wb_dma.we & (wb_dma.cti != 0b000) & rbuf_valid & (wb_blk == rbuf_blk) & (wb_word == rbuf_next)),
+                rbuf_hit.eq(take_window & rbuf_match),
+                rd_block.eq(wb_access & ~wb_dma.we & (wb_dma.cti == 0b010) & (wb_dma.bte == 0b00) & ~rbuf_hit & ~rd_noblock & ~wbg_valid),
+                wb_single.eq(wb_access & ~wbg_take & ~rbuf_hit & ~rd_block & ~wbg_valid),
+                single_req.eq(wbg_replay | wb_single),
+                wb_more.eq(single_req | wbg_block | rd_block),
+                Case(wbg_mask, { m: replay_idx.eq(min(k for k in range(burst_size) if (m >> k) & 1)) for m in range(1, 2**burst_size) }),
+                If(wbg_replay,
+                   single_adr.eq(Cat(replay_idx, wbg_blk)),
+                   Case(replay_idx, { k: single_dat_w.eq(wbg_data[k*32:(k+1)*32]) for k in range(burst_size) }),
+                   single_sel.eq(0xf),
+                   single_we.eq(1),
+                ).Else(
+                    single_adr.eq(wb_dma.adr),
+                    single_dat_w.eq(wb_dma.dat_w),
+                    single_sel.eq(wb_dma.sel),
+                    single_we.eq(wb_dma.we),
+                ),
+                Case(wb_word, { k: If(rbuf_hit, wb_dma.dat_r.eq(rbuf_data[k*32:(k+1)*32])) for k in range(burst_size) }),
+                wb_dma.ack.eq((single_ack & ~wbg_replay) | wbg_take | rbuf_hit),
+            ]
+            nubus_sync += [
+                If(wbg_take,
+                   wbg_blk.eq(wb_blk),
+                   Case(wb_word, { k: [ wbg_data[k*32:(k+1)*32].eq(wb_dma.dat_w), wbg_mask[k].eq(1) ] for k in range(burst_size) }),
+                   wbg_timer.eq(wbg_timeout),
+                ).Elif(wbg_valid & (wbg_timer != 0),
+                       wbg_timer.eq(wbg_timer - 1),
+                ),
+                If(wbg_flush_start,
+                   wbg_flush.eq(1),
+                ),
+                If(blk_wr_done,
+                   wbg_mask.eq(0),
+                ).Elif(blk_wr_fail,
+                       wbg_noblock.eq(1),
+                ).Elif(single_ack & wbg_replay,
+                       Case(replay_idx, { k: wbg_mask[k].eq(0) for k in range(burst_size) }),
+                ),
+                If(~wbg_valid,
+                   wbg_flush.eq(0),
+                   wbg_noblock.eq(0),
+                ),
+                If(blk_rd_done,
+                   rbuf_valid.eq(1),
+                   rbuf_blk.eq(fifo_addr),
+                   rbuf_data.eq(blk_rd_data),
+                   rbuf_next.eq(wb_word), # the access that started the block read is served from it
+                   rbuf_timer.eq(rbuf_timeout),
+                ).Elif(rbuf_hit & (wb_dma.cti == 0b111), # end of burst
+                       rbuf_valid.eq(0),
+                ).Elif(rbuf_hit,
+                       rbuf_next.eq(rbuf_next + 1),
+                       rbuf_timer.eq(rbuf_timeout),
+                ).Elif(wb_access & ~rbuf_match,
+                       rbuf_valid.eq(0),
+                ).Elif(~wb_access,
+                       If(rbuf_timer == 0,
+                          rbuf_valid.eq(0),
+                       ).Else(
+                           rbuf_timer.eq(rbuf_timer - 1),
+                       )
+                ),
+                If(blk_rd_fail,
+                   rd_noblock.eq(1),
+                ).Elif(wb_dma.ack & ~wb_dma.we,
+                       rd_noblock.eq(0),
+                ),
+            ]
+        else:
+            self.comb += [
+                single_req.eq(wb_dma.cyc & wb_dma.stb),
+                single_adr.eq(wb_dma.adr),
+                single_dat_w.eq(wb_dma.dat_w),
+                single_sel.eq(wb_dma.sel),
+                single_we.eq(wb_dma.we),
+                wb_dma.ack.eq(single_ack),
+                wb_more.eq(wb_dma.cyc & wb_dma.stb),
+            ]
+
+        # which source dma_fsm serves next: fixed priority (wb_dma, to NuBus, from NuBus) or the scheduler's pick
+        src_req = Signal(3)
+        src_sel = Signal(3)
+        self.comb += src_req.eq(Cat(single_req | wbg_block | rd_block,
+                                    tosbus_fifo.readable,
+                                    fromsbus_req_fifo.readable & fromsbus_fifo.writable))
+        if (dma_sched is None):
+            self.comb += src_sel.eq(Cat(src_req[0], ~src_req[0] & src_req[1], ~src_req[0] & ~src_req[1] & src_req[2]))
+        else:
+            self.comb += [
+                dma_sched.req.eq(src_req),
+                src_sel.eq(dma_sched.pick),
+                dma_sched.idle.eq(dma_fsm.ongoing("Idle")),
+                # the transaction is started now, directly or through arbitration
+                dma_sched.commit.eq(dma_fsm.ongoing("Idle") & ((src_req & src_sel) != 0) &
+                                    (~sampled_rqst | rqst_hold) & (~rqst_hold | arb_ok)),
+            ]
+
+        # the buffered FIFOs keep the current entry in their output register, the inner FIFO has the next one
+        self.comb += [
+            If(~burst,
+               dma_more.eq(tosbus_fifo.readable | (fromsbus_req_fifo.readable & fromsbus_fifo.writable)),
+            ).Elif(burst_we,
+                   dma_more.eq(tosbus_fifo.fifo.readable | (fromsbus_req_fifo.readable & fromsbus_fifo.writable) | wb_more),
+            ).Else(
+                dma_more.eq(tosbus_fifo.readable | fromsbus_req_fifo.fifo.readable | wb_more),
+            )
+        ]
+        handle_overlapped_arbitration = [
+            If(~rqst_hold & dma_more & ~sampled_rqst & (b2b_ctr != b2b_max),
+               NextValue(rqst_hold, 1),
+            )
+        ]
+        # ask for a 2x data phase from the block address cycle (set when entering it, so that
+        # burst90_fsm sees it through its MultiReg before the first response)
+        if (nubus90):
+            handle_arm90 = [ NextValue(arm90, ~no90) ]
+        else:
+            handle_arm90 = []
+        # start the next transaction: directly if we own the bus, after arbitration otherwise
+        def handle_start(adr_state):
+            arm = handle_arm90 if (adr_state == "Burst4AdrCycle") else []
+            return [
+                If(rqst_hold, # we arbitrated during the previous transaction
+                   If(arb_ok & grant & ~decoded_busy,
+                      NextValue(owning_bus, 1),
+                      NextValue(rqst_hold, 0),
+                      *arm,
+                      NextState(adr_state),
+                   ).Elif(arb_ok, # lost, keep requesting
+                          NextValue(owning_bus, 0),
+                          NextValue(rqst_hold, 0),
+                          NextState("Arbitration"),
+                   )
+                ).Elif(owning_bus, # we own the bus, skip arbitration
+                       *arm,
+                       NextState(adr_state),
+                ).Else(        # go for arbitration
+                    NextState("Arbitration"),
+                )
+            ]
 
         #self.comb += led0.eq(~dma_fsm.ongoing("Idle"))
         #self.comb += led1.eq(burst)
@@ -419,32 +1354,37 @@ class NuBus(Module):
                     NextState("Idle")
         )
         dma_fsm.act("Idle",
-                    If(wb_dma.cyc & wb_dma.stb & ~sampled_rqst, # we need the bus and it's not being requested
+                    If(src_sel[0] & single_req & (~sampled_rqst | rqst_hold), # we need the bus and it's not being requested (or we requested it)
                        NextValue(burst, 0),
-                       If(owning_bus, # we own the bus, skip arbitration
-                          NextState("AdrCycle"),
-                       ).Else(        # go for arbitration
-                           NextState("Arbitration"),
-                       ),
-                    ).Elif(tosbus_fifo.readable & ~sampled_rqst,
+                       *handle_start("AdrCycle"),
+                    ).Elif(src_sel[0] & wbg_block & (~sampled_rqst | rqst_hold),
                            NextValue(burst, 1),
                            NextValue(burst_we, 1),
+                           NextValue(burst_src_wb, 1),
+                           NextValue(fifo_addr, wbg_blk),
+                           *handle_start("Burst4AdrCycle"),
+                    ).Elif(src_sel[0] & rd_block & (~sampled_rqst | rqst_hold),
+                           NextValue(burst, 1),
+                           NextValue(burst_we, 0),
+                           NextValue(burst_src_wb, 1),
+                           NextValue(fifo_addr, wb_blk),
+                           *handle_start("Burst4AdrCycle"),
+                    ).Elif(src_sel[1] & (~sampled_rqst | rqst_hold),
+                           NextValue(burst, 1),
+                           NextValue(burst_we, 1),
+                           NextValue(burst_src_wb, 0),
                            NextValue(fifo_addr, tosbus_fifo_dout.address[(32-blk_addr_width):32]),
-                           If(owning_bus, # we own the bus, skip arbitration
-                              NextState("Burst4AdrCycle"),
-                           ).Else(        # go for arbitration
-                               NextState("Arbitration"),
-                           )
-                    ).Elif(fromsbus_req_fifo.readable & fromsbus_fifo.writable & ~sampled_rqst,
+                           *handle_start("Burst4AdrCycle"),
+                    ).Elif(src_sel[2] & (~sampled_rqst | rqst_hold),
                            NextValue(burst, 1),
                            NextValue(burst_we, 0),
+                           NextValue(burst_src_wb, 0),
                            NextValue(fifo_addr, fromsbus_req_fifo_dout.dmaaddress[(32-blk_addr_width):32]),
                            NextValue(fifo_blk_addr, fromsbus_req_fifo_dout.blkaddress),
-                           If(owning_bus, # we own the bus, skip arbitration
-                              NextState("Burst4AdrCycle"),
-                           ).Else(        # go for arbitration
-                               NextState("Arbitration"),
-                           )
+                           *handle_start("Burst4AdrCycle"),
+                    ).Elif(rqst_hold & arb_ok, # nothing came after all, release RQST
+                           NextValue(owning_bus, grant),
+                           NextValue(rqst_hold, 0),
                     )
         )
         dma_fsm.act("Arbitration",
@@ -460,6 +1400,7 @@ class NuBus(Module):
                     If(grant & ~decoded_busy, # I'm now 'owner'
                        NextValue(owning_bus, 1),
                        If(burst,
+                          *handle_arm90,
                           NextState("Burst4AdrCycle"),
                        ).Else(
                            NextState("AdrCycle"),
@@ -472,31 +1413,39 @@ class NuBus(Module):
                     tmo_oe.eq(1), # for tm0, tm1, ack
                     ad_oe.eq(1), # for write address
                     start_o_n.eq(0),
-                    tm0_o_n.eq(~((wb_dma.sel == 0x1) | (wb_dma.sel == 0x2) | (wb_dma.sel == 0x4) | (wb_dma.sel == 0x8))), # byte only
-                    tm1_o_n.eq(~wb_dma.we),
-                    ad_o_n[0].eq(~((wb_dma.sel == 0x2) | (wb_dma.sel == 0x3) | (wb_dma.sel == 0x8) | (wb_dma.sel == 0xc))), # odd bytes, both half-words
-                    ad_o_n[1].eq(~((wb_dma.sel == 0x4) | (wb_dma.sel == 0x8) | (wb_dma.sel == 0xc))), # upper bytes and half-word
-                    ad_o_n[2:32].eq(~wb_dma.adr),
+                    tm0_o_n.eq(~((single_sel == 0x1) | (single_sel == 0x2) | (single_sel == 0x4) | (single_sel == 0x8))), # byte only
+                    tm1_o_n.eq(~single_we),
+                    ad_o_n[0].eq(~((single_sel == 0x2) | (single_sel == 0x3) | (single_sel == 0x8) | (single_sel == 0xc))), # odd bytes, both half-words
+                    ad_o_n[1].eq(~((single_sel == 0x4) | (single_sel == 0x8) | (single_sel == 0xc))), # upper bytes and half-word
+                    ad_o_n[2:32].eq(~single_adr),
                     ack_o_n.eq(1),
-                    If(wb_dma.we,
+                    If(single_we,
                        NextState("DatCycle"),
                     ).Else(
                         NextState("ReadWaitForAck"),
                     )
         )
         dma_fsm.act("DatCycle",
+                    *handle_overlapped_arbitration,
                     master_oe.eq(1), # for start
                     ad_oe.eq(1), # for write data
                     start_o_n.eq(1), # start finished, but still need to be driven
-                    ad_o_n.eq(~wb_dma.dat_w),
+                    ad_o_n.eq(~single_dat_w),
                     If(sampled_ack,
-                       wb_dma.ack.eq(1),
+                       single_ack.eq(1),
                        # fixme: check status ??? (tm0 and tm1 should be active for no-error)
                        NextState("FinishCycle"),
                     )
         )
         dma_fsm.act("FinishCycle",
                     NextValue(burst, 0),
+                    NextValue(burst_src_wb, 0),
+                    NextValue(arm90, 0),
+                    If(rqst_hold,
+                       NextValue(b2b_ctr, b2b_ctr + 1),
+                    ).Else(
+                        NextValue(b2b_ctr, 0),
+                    ),
                     master_oe.eq(1), # for start
                     start_o_n.eq(1), # start finished, but still need to be driven
                     tmo_oe.eq(1), # for tm0, tm1, ack, need to be driven to inactive
@@ -506,11 +1455,12 @@ class NuBus(Module):
                     NextState("Idle"),
         )
         dma_fsm.act("ReadWaitForAck",
+                    *handle_overlapped_arbitration,
                     master_oe.eq(1), # for start
                     start_o_n.eq(1), # start finished, but still need to be driven
                     wb_dma.dat_r.eq(sampled_ad),
                     If(sampled_ack,
-                       wb_dma.ack.eq(1),
+                       single_ack.eq(1),
                        # fixme: check status ??? (tm0 and tm1 should be active for no-error)
                        NextState("FinishCycle"),
                     )
@@ -536,6 +1486,15 @@ class NuBus(Module):
         else:
             raise ValueError(f"Unsupported burst_size {burst_size}")
 
+        if (nubus90):
+            # ask for a 2x data phase; if the slave doesn't acknowledge with TM2 we stay at 1x
+            handle_tm2_for_burst = [
+                    tm2_oe.eq(arm90),
+                    tm2_o_n.eq(0),
+            ]
+        else:
+            handle_tm2_for_burst = []
+
         dma_fsm.act("Burst4AdrCycle",
                     start_arbitration.eq(0),
                     master_oe.eq(1), # for start
@@ -545,6 +1504,7 @@ class NuBus(Module):
                     tm0_o_n.eq(1), # burst
                     tm1_o_n.eq(~burst_we),
                     *handle_ad_for_burst,
+                    *handle_tm2_for_burst,
                     ack_o_n.eq(1),
                     NextValue(ctr, 0),
                     If(burst_we,
@@ -590,13 +1550,20 @@ class NuBus(Module):
             raise ValueError(f"Unsupported burst_size {burst_size}")
         
         dma_fsm.act("Burst4ReadWaitForTM0",
+                    *handle_overlapped_arbitration,
                     master_oe.eq(1), # for start
                     start_o_n.eq(1), # start finished, but still need to be driven
                     If(sampled_ack, # oups
-                       fromsbus_req_fifo.re.eq(1), # remove request to avoid infinite repeat
+                       If(burst_src_wb,
+                          blk_rd_fail.eq(1),
+                       ).Else(
+                           fromsbus_req_fifo.re.eq(1), # remove request to avoid infinite repeat
+                       ),
                        #NextValue(led0, 1),
                        #NextValue(led1, 1),
                        NextState("FinishCycle"),
+                    ).Elif(sampled_tm0 & sampled_tm2 & arm90 & (ctr == 0), # NuBus90 slave, the rest of the data phase is at 2x
+                           NextState("Burst90ReadWait"),
                     ).Elif(sampled_tm0,
                            *handle_buffer_read_for_burst,
                            NextValue(ctr, ctr + 1),
@@ -608,14 +1575,21 @@ class NuBus(Module):
                     )
         )
         dma_fsm.act("Burst4ReadWaitForAck",
+                    *handle_overlapped_arbitration,
                     master_oe.eq(1), # for start
                     start_o_n.eq(1), # start finished, but still need to be driven
+                    *handle_final_buffer_read_for_burst,
+                    blk_rd_data.eq(fromsbus_fifo_din.data),
                     If(sampled_ack,
-                       fromsbus_req_fifo.re.eq(1), # remove request
-                       fromsbus_fifo.we.eq(1),
+                       If(burst_src_wb,
+                          blk_rd_done.eq(sampled_tm0 & sampled_tm1), # tm0 and tm1 active for no-error
+                          blk_rd_fail.eq(~(sampled_tm0 & sampled_tm1)),
+                       ).Else(
+                           fromsbus_req_fifo.re.eq(1), # remove request
+                           fromsbus_fifo.we.eq(1),
+                       ),
                        fromsbus_fifo_din.blkaddress.eq(fifo_blk_addr),
-                       *handle_final_buffer_read_for_burst,
-                       # fixme: check status ??? (tm0 and tm1 should be active for no-error)
+                       # fixme: check status ??? for the FIFO path (tm0 and tm1 should be active for no-error)
                        #NextValue(led0, (~sampled_tm0 | ~sampled_tm1)),
                        NextState("FinishCycle"),
                     )
@@ -625,10 +1599,10 @@ class NuBus(Module):
         if (burst_size == 4):
             handle_buffer_write_for_burst = [
                     Case(ctr, {
-                        0x0: ad_o_n.eq(~tosbus_fifo_dout.data[ 0: 32]),
-                        0x1: ad_o_n.eq(~tosbus_fifo_dout.data[32: 64]),
-                        0x2: ad_o_n.eq(~tosbus_fifo_dout.data[64: 96]),
-                        ##0x3: ad_o_n.eq(~tosbus_fifo_dout.data[96:128]),
+                        0x0: ad_o_n.eq(~burst_wdata[ 0: 32]),
+                        0x1: ad_o_n.eq(~burst_wdata[32: 64]),
+                        0x2: ad_o_n.eq(~burst_wdata[64: 96]),
+                        ##0x3: ad_o_n.eq(~burst_wdata[96:128]),
                         #0x0: ad_o_n.eq(~tosbus_fifo_dout_data_byterev[ 0: 32]),
                         #0x1: ad_o_n.eq(~tosbus_fifo_dout_data_byterev[32: 64]),
                         #0x2: ad_o_n.eq(~tosbus_fifo_dout_data_byterev[64: 96]),
@@ -636,28 +1610,29 @@ class NuBus(Module):
                     }),
             ]
             handle_last_buffer_write_for_burst = [
-                ad_o_n.eq(~tosbus_fifo_dout.data[96:128]), # last word
+                ad_o_n.eq(~burst_wdata[96:128]), # last word
             ]
         elif (burst_size == 8):
             handle_buffer_write_for_burst = [
                     Case(ctr, {
-                        0x0: ad_o_n.eq(~tosbus_fifo_dout.data[  0: 32]),
-                        0x1: ad_o_n.eq(~tosbus_fifo_dout.data[ 32: 64]),
-                        0x2: ad_o_n.eq(~tosbus_fifo_dout.data[ 64: 96]),
-                        0x3: ad_o_n.eq(~tosbus_fifo_dout.data[ 96:128]),
-                        0x4: ad_o_n.eq(~tosbus_fifo_dout.data[128:160]),
-                        0x5: ad_o_n.eq(~tosbus_fifo_dout.data[160:192]),
-                        0x6: ad_o_n.eq(~tosbus_fifo_dout.data[192:224]),
-                        #0x7: ad_o_n.eq(~tosbus_fifo_dout.data[224:256]),
+                        0x0: ad_o_n.eq(~burst_wdata[  0: 32]),
+                        0x1: ad_o_n.eq(~burst_wdata[ 32: 64]),
+                        0x2: ad_o_n.eq(~burst_wdata[ 64: 96]),
+                        0x3: ad_o_n.eq(~burst_wdata[ 96:128]),
+                        0x4: ad_o_n.eq(~burst_wdata[128:160]),
+                        0x5: ad_o_n.eq(~burst_wdata[160:192]),
+                        0x6: ad_o_n.eq(~burst_wdata[192:224]),
+                        #0x7: ad_o_n.eq(~burst_wdata[224:256]),
                     }),
             ]
             handle_last_buffer_write_for_burst = [
-                ad_o_n.eq(~tosbus_fifo_dout.data[224:256]), # last word
+                ad_o_n.eq(~burst_wdata[224:256]), # last word
             ]
         else:
             raise ValueError(f"Unsupported burst_size {burst_size}")
         
         dma_fsm.act("Burst4DatCycleTM0",
+                    *handle_overlapped_arbitration,
                     master_oe.eq(1), # for start
                     ad_oe.eq(1), # for write data
                     start_o_n.eq(1), # start finished, but still need to be driven
@@ -665,8 +1640,15 @@ class NuBus(Module):
                     If(sampled_ack, # oups
                        #NextValue(led0, 1),
                        #NextValue(led1, 1),
-                       tosbus_fifo.re.eq(1), # remove FIFO entry to avoid infinite repeat
+                       If(burst_src_wb,
+                          blk_wr_fail.eq(1),
+                       ).Else(
+                           tosbus_fifo.re.eq(1), # remove FIFO entry to avoid infinite repeat
+                           self.tosbus_err.eq(1),
+                       ),
                        NextState("FinishCycle"),
+                    ).Elif(sampled_tm0 & sampled_tm2 & arm90 & (ctr == 0), # NuBus90 slave, the rest of the data phase is at 2x
+                           NextState("Burst90DatWait"),
                     ).Elif(sampled_tm0,
                         NextValue(ctr, ctr + 1),
                        If(ctr == (burst_size - 2), # burst next-to-last
@@ -677,18 +1659,161 @@ class NuBus(Module):
                     )
         )
         dma_fsm.act("Burst4DatCycleAck",
+                    *handle_overlapped_arbitration,
                     master_oe.eq(1), # for start
                     ad_oe.eq(1), # for write data
                     start_o_n.eq(1), # start finished, but still need to be driven
                     *handle_last_buffer_write_for_burst,
                     If(sampled_ack,
-                       tosbus_fifo.re.eq(1), # remove FIFO entry at last
-                       # fixme: check status ??? (tm0 and tm1 should be active for no-error)
+                       If(burst_src_wb,
+                          blk_wr_done.eq(sampled_tm0 & sampled_tm1), # tm0 and tm1 active for no-error
+                          blk_wr_fail.eq(~(sampled_tm0 & sampled_tm1)),
+                       ).Else(
+                           tosbus_fifo.re.eq(1), # remove FIFO entry at last
+                           self.tosbus_err.eq(~(sampled_tm0 & sampled_tm1)), # tm0 and tm1 active for no-error
+                       ),
                        #NextValue(led0, (~sampled_tm0 | ~sampled_tm1)),
                        NextState("FinishCycle"),
                     )
         )
 
+        # NuBus90: the first word went at 1x, burst90_fsm does the rest of the data phase
+        # we stop driving as soon as burst90_fsm saw the ACK (the bus may belong to somebody else
+        # by the time done90 gets here), and a FIFO transfer aborted by the slave is retried at 1x
+        dma_fsm.act("Burst90ReadWait",
+                    *handle_overlapped_arbitration,
+                    master_oe.eq(m90_active), # for start
+                    start_o_n.eq(1), # start finished, but still need to be driven
+                    blk_rd_data.eq(fifo_buffer90),
+                    If(done90,
+                       NextValue(done90_seen, done90_s),
+                       If(burst_src_wb,
+                          blk_rd_done.eq(~abort90),
+                          blk_rd_fail.eq(abort90),
+                       ).Elif(abort90,
+                              NextValue(no90, 1), # keep the request, again at 1x
+                       ).Else(
+                           fromsbus_req_fifo.re.eq(1), # remove request
+                           fromsbus_fifo.we.eq(1),
+                           fromsbus_fifo_din.blkaddress.eq(fifo_blk_addr),
+                           fromsbus_fifo_din.data.eq(fifo_buffer90),
+                       ),
+                       NextState("Finish90"),
+                    )
+        )
+        dma_fsm.act("Burst90DatWait",
+                    *handle_overlapped_arbitration,
+                    master_oe.eq(m90_active), # for start
+                    ad_oe.eq(m90_active), # for write data
+                    start_o_n.eq(1), # start finished, but still need to be driven
+                    ad_o_n.eq(~burst90_dout), # moves at 2x
+                    If(done90,
+                       NextValue(done90_seen, done90_s),
+                       If(burst_src_wb,
+                          blk_wr_done.eq(~abort90),
+                          blk_wr_fail.eq(abort90),
+                       ).Elif(abort90,
+                              NextValue(no90, 1), # keep the entry, again at 1x
+                       ).Else(
+                           tosbus_fifo.re.eq(1), # remove FIFO entry
+                       ),
+                       NextState("Finish90"),
+                    )
+        )
+        dma_fsm.act("Finish90", # FinishCycle without driving anything, the ACK is long gone
+                    NextValue(burst, 0),
+                    NextValue(burst_src_wb, 0),
+                    NextValue(arm90, 0),
+                    If(rqst_hold,
+                       NextValue(b2b_ctr, b2b_ctr + 1),
+                    ).Else(
+                        NextValue(b2b_ctr, 0),
+                    ),
+                    NextState("Idle"),
+        )
+
+        if (nubus90):
+            # The 2x FSM is armed for the address cycle and watches the 2x samples.
+            # The first response comes at 1x (so we see it twice) with TM2 if the slave does NuBus90,
+            # after that the slave answers every clk2x cycle.
+            # If there's no TM2 in the first response, the 1x FSM keeps going on its own.
+            arm90_s = Signal()
+            self.specials += MultiReg(arm90, arm90_s, odomain = cd_nubus90)
+            self.specials += MultiReg(done90_t, done90_s, odomain = cd_nubus)
+            nubus_sync += If(tosbus_fifo.re | fromsbus_req_fifo.re, # the 1x retry is done, whatever its status
+                             no90.eq(0),
+            )
+            self.comb += [
+                done90.eq(done90_s != done90_seen),
+                Case(ctr90, { k: burst90_dout.eq(wdata90[k*32:(k+1)*32]) for k in range(burst_size) }),
+            ]
+            handle_buffer_read_for_burst90 = [
+                Case(ctr90, { k: NextValue(fifo_buffer90[k*32:(k+1)*32], sampled90_ad) for k in range(burst_size) }),
+            ]
+
+            self.submodules.burst90_fsm = burst90_fsm = ClockDomainsRenamer(cd_nubus90)(FSM(reset_state="Reset"))
+            self.comb += m90_active.eq(burst90_fsm.ongoing("SkipFirst") | burst90_fsm.ongoing("Data"))
+            burst90_fsm.act("Reset",
+                            NextState("Idle")
+            )
+            burst90_fsm.act("Idle",
+                            If(arm90_s & sampled90_tm0 & sampled90_tm2 & ~sampled90_ack, # first 1x response, from a NuBus90 slave
+                               NextValue(fifo_buffer90[0:32], sampled90_ad),
+                               NextValue(wdata90, burst_wdata), # stable since the address cycle
+                               NextValue(ctr90, 1),
+                               NextState("SkipFirst"),
+                            )
+            )
+            burst90_fsm.act("SkipFirst", # second 2x sample of the 1x response
+                            If(~arm90_s, # 1x FSM gave up
+                               NextState("Idle"),
+                            ).Else(
+                                NextState("Data"),
+                            )
+            )
+            burst90_fsm.act("Data",
+                            If(~arm90_s, # 1x FSM gave up
+                               NextState("Idle"),
+                            ).Elif(sampled90_ack,
+                                   *handle_buffer_read_for_burst90,
+                                   NextValue(abort90, (ctr90 != (burst_size - 1)) | ~(sampled90_tm0 & sampled90_tm1)), # oups, or not a 'complete' status
+                                   NextValue(done90_t, ~done90_t),
+                                   NextState("Idle"),
+                            ).Elif(sampled90_tm0,
+                                   *handle_buffer_read_for_burst90,
+                                   NextValue(ctr90, ctr90 + 1),
+                            )
+            )
+
+        # performance monitor events, slave ACK status and master side
+        dma_data_phase = Signal()
+        self.comb += [
+            self.stat_slave_ack.eq(tmo_oe & ~ack_o_n & ~master_oe),
+            self.stat_slave_tryagain.eq(self.stat_slave_ack & tm0_o_n & tm1_o_n),
+            self.stat_slave_error.eq(self.stat_slave_ack & tm0_o_n & ~tm1_o_n),
+            dma_data_phase.eq(reduce(or_, [ dma_fsm.ongoing(st) for st in ["DatCycle", "ReadWaitForAck",
+                                                                          "Burst4ReadWaitForTM0", "Burst4ReadWaitForAck",
+                                                                          "Burst4DatCycleTM0", "Burst4DatCycleAck",
+                                                                          "Burst90ReadWait", "Burst90DatWait"] ])),
+            self.stat_dma_arb.eq(dma_fsm.ongoing("Arbitration") | dma_fsm.ongoing("WaitForGrant") |
+                                 (dma_fsm.ongoing("Idle") & rqst_hold & (src_req != 0))),
+            self.stat_dma_busy.eq(dma_fsm.ongoing("AdrCycle") | dma_fsm.ongoing("Burst4AdrCycle") | dma_data_phase),
+            self.stat_dma_ack.eq(dma_data_phase & sampled_ack),
+            self.stat_dma_tryagain.eq(self.stat_dma_ack & ~sampled_tm0 & ~sampled_tm1),
+            self.stat_dma_error.eq(self.stat_dma_ack & ~sampled_tm0 & sampled_tm1),
+        ]
+        nubus_sync += [
+            If(dma_fsm.ongoing("AdrCycle"),
+               self.stat_dma_burst.eq(0),
+               self.stat_dma_we.eq(single_we),
+               self.stat_dma_bytes.eq(single_sel[0] + single_sel[1] + single_sel[2] + single_sel[3]),
+            ).Elif(dma_fsm.ongoing("Burst4AdrCycle"),
+                   self.stat_dma_burst.eq(1),
+                   self.stat_dma_we.eq(burst_we),
+                   self.stat_dma_bytes.eq(data_width),
+            )
+        ]
+
         # stuff at this end so we don't use the signals inadvertantly
 
         # real NuBus signals
@@ -768,9 +1893,12 @@ class NuBus(Module):
             nf_fpga_to_cpld_signal = platform.request("fpga_to_cpld_signal") # V1.0: to cpld, 'rqstoen'
             
 
-        # NuBus90 signals, , for completeness
-        nub_clk2xn = ClockSignal(cd_nubus90)
+        # NuBus90 signals
         nub_tm2n = platform.request("tm2_3v3_n") # V1.0: from CPLD ; V1.2: from shifters
+        # input only (V1.0 can't drive it)
+        self.comb += [
+            tm2_i_n.eq(nub_tm2n),
+        ]
 
         if (version == "V1.0"):
             self.comb += [
@@ -784,6 +1912,7 @@ class NuBus(Module):
             self.specials += Instance("nubus_cpldinfpga",
                                       i_nubus_oe = soc.hold_reset, # improveme, handled in SoC
                                       i_tmoen = ~tmo_oe,
+                                      i_tm2oen = ~tm2_oe,
                                       i_nubus_master_dir = master_oe,
                                       i_rqst_oe_n = ~rqst_oe,
                                       
@@ -801,7 +1930,7 @@ class NuBus(Module):
                                       o_tm1_o_n = platform.request("tm1_o_n"),
                                       o_tmx_oe_n = platform.request("tmx_oe_n"),
                                       
-                                      i_tm2_n_3v3 = nub_tm2n, # tm2 currently never driven
+                                      i_tm2_n_3v3 = tm2_o_n, # tm2 driving controlled by tm2oen, only when asking for NuBus90 2x
                                       o_tm2_o_n = platform.request("tm2_o_n"),
                                       o_tm2_oe_n = platform.request("tm2_oe_n"),
                                       
@@ -817,6 +1946,39 @@ class NuBus(Module):
                                       o_rqst_o_n = platform.request("rqst_o_n")
             )
         
+    # 'origin' is the SoC address of the window, in the direct part of the slot space (0xF0800000-0xF0FFFFFF)
+    # region 'name' appears there with the byte lanes swapped
+    def add_be_aperture(self, name, origin):
+        if (self.usesampling):
+            raise ValueError("Big-endian apertures are only supported without usesampling")
+        self.be_apertures.append((name, origin))
+
+    # 'name' is a CSR as named in the generated headers, e.g. dma_sched_grants_wb
+    def add_status_mirror(self, name):
+        if (self.usesampling):
+            raise ValueError("Status mirrors are only supported without usesampling")
+        self.status_mirror.add(name)
+
+    def add_status_mirror_signal(self, adr, value):
+        if (self.usesampling):
+            raise ValueError("Status mirrors are only supported without usesampling")
+        self.status_mirror.add_signal(adr, value)
+
+    def do_finalize(self):
+        for (name, origin) in self.be_apertures:
+            r = self.soc.bus.regions[name]
+            if ((origin < 0xF0800000) or ((origin + r.size) > 0xF1000000)):
+                raise ValueError(f"Big-endian aperture for {name} at 0x{origin:08x} is outside the slot space")
+            self.comb += If(self.decoded_myslot & (self.processed_ad >= origin) & (self.processed_ad < (origin + r.size)),
+                            self.slave_adr.eq(self.processed_ad - origin + r.origin),
+                            self.slave_swap.eq(1),
+            )
+        if (self.check_unmapped):
+            regions = self.soc.bus.regions.values()
+            self.comb += self.slave_adr_mapped.eq(reduce(or_, [ ((self.slave_adr >= r.origin) & (self.slave_adr < (r.origin + r.size))) for r in regions ], 0))
+        regions = [ self.soc.bus.regions[name] for name in self.nobuffer_regions if name in self.soc.bus.regions ]
+        self.comb += self.slave_adr_nobuffer.eq(reduce(or_, [ ((self.slave_adr >= r.origin) & (self.slave_adr < (r.origin + r.size))) for r in regions ], 0))
+
     def add_sources(self, platform, version):
         # sampling of data on falling edge of clock, done in verilog
         platform.add_source("nubus_sampling.v", "verilog")
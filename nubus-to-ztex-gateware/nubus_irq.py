@@ -0,0 +1,88 @@
+from migen import *
+
+import litex
+from litex.soc.interconnect.csr import *
+
+# Interrupt controller in front of NMRQ
+# 'sources' is a list of (name, level) or (name, level, event), active high, sys domain; bit i of the registers is source i
+# 'event' pulses once per event of the source (e.g. each completion), for coalescing
+# pending: read: sources that have raised their line (edge) and not been cleared, in a single access
+#          write: 1s clear (a source whose line is still up stays pending)
+# status: current lines
+# enable: per-source mask for NMRQ (pending is updated whatever the mask)
+# coalesce_<name>: a pending source only interrupts once 'count' events have been seen since it was last cleared,
+# or 'timeout' microseconds after the first of them (0: no timeout, 'count' 0 or 1: at once)
+# Without 'event', the events are the rising edges of the line; as the sources hold their line until serviced,
+# no second edge comes while pending, so 'count' above 1 only waits for the timeout (and without one is ignored,
+# the source interrupts at once rather than never)
+# irq is active high
+class NuBusIRQController(Module, AutoCSR):
+    def __init__(self, sources, sys_clk_freq):
+        n = len(sources)
+        self.irq = Signal()
+
+        self.pending = CSR(n)
+        self.status = CSRStatus(n, description = "Current interrupt lines")
+        self.enable = CSRStorage(n, reset = (1 << n) - 1, description = "Sources allowed to interrupt")
+        for src in sources:
+            name = src[0]
+            if (len(src) > 2):
+                count_desc = f"Events of {name} before interrupting"
+            else:
+                count_desc = f"Events of {name} before interrupting (its line stays up until serviced: above 1, waits for the timeout; ignored without one)"
+            setattr(self, f"coalesce_{name}", CSRStorage(fields = [CSRField("count", size = 8, reset = 1, description = count_desc),
+                                                                   CSRField("timeout", size = 16, description = f"Microseconds after the first event of {name} before interrupting (0: none)"),],
+                                                         name = f"coalesce_{name}"))
+
+        # microsecond tick
+        us_div = max(1, int(sys_clk_freq // 1000000))
+        us_ctr = Signal(max = us_div + 1)
+        us_tick = Signal()
+        self.comb += us_tick.eq(us_ctr == 0)
+        self.sync += If(us_tick, us_ctr.eq(us_div - 1)).Else(us_ctr.eq(us_ctr - 1))
+
+        level = Signal(n)
+        level_d = Signal(n)
+        edge = Signal(n)
+        pending = Signal(n)
+        clear = Signal(n)
+        ready = Signal(n)
+        self.comb += [
+            level.eq(Cat(*[ src[1] for src in sources ])),
+            edge.eq(level & ~level_d),
+            clear.eq(Mux(self.pending.re, self.pending.r, 0) & ~level),
+            self.pending.w.eq(pending),
+            self.status.status.eq(level),
+        ]
+        self.sync += [
+            level_d.eq(level),
+            pending.eq((pending & ~clear) | edge),
+        ]
+
+        for i, src in enumerate(sources):
+            name = src[0]
+            coalesce = getattr(self, f"coalesce_{name}")
+            events = Signal(8, name = f"irq_events_{name}")
+            timer = Signal(16, name = f"irq_timer_{name}")
+            event = src[2] if (len(src) > 2) else edge[i]
+            self.sync += [
+                If(clear[i], # the line is down, so no edge; an event pulse there isn't pending yet either
+                   events.eq(0),
+                   timer.eq(0),
+                ).Else(
+                    If(event & (events != 0xFF),
+                       events.eq(events + 1),
+                    ),
+                    If(pending[i] & us_tick & (timer != 0xFFFF),
+                       timer.eq(timer + 1),
+                    ),
+                ),
+            ]
+            if (len(src) > 2):
+                self.comb += ready[i].eq(pending[i] & ((coalesce.fields.count <= 1) | (events >= coalesce.fields.count) |
+                                                       ((coalesce.fields.timeout != 0) & (timer >= coalesce.fields.timeout))))
+            else:
+                self.comb += ready[i].eq(pending[i] & ((coalesce.fields.count <= 1) | (coalesce.fields.timeout == 0) |
+                                                       (timer >= coalesce.fields.timeout)))
+
+        self.comb += self.irq.eq((ready & self.enable.storage) != 0)
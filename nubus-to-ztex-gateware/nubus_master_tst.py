@@ -3,116 +3,238 @@ from migen.genlib.fifo import *
 
 import litex
 from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.csr import *
 
-class PingMaster(Module):
-    def __init__(self, nubus, platform):
-        self.bus_slv = bus_slv = wishbone.Interface()
+# NuBus traffic generator, to measure the bus from the card without host software
+# bus_mst goes to the SoC bus, so 'base' is a SoC address in the DMA region (i.e. a host address)
+# A run is 'count' transactions, 'stride' bytes apart, all reads or all writes, of one size:
+# byte, half-word, word, or block ('burst_size' words in an incrementing Wishbone burst,
+# turned into a NuBus block transfer by the DMA slave when it does bursts)
+# Written data come from the pattern generator (per word); with 'verify', read data are compared
+# with the same sequence, so a write run followed by a read run with the same settings checks the round trip
+# Latency is in sys cycles from the request to the (last) ack of a transaction
+# Writes to the host are posted (see WishboneAsyncCrossingMaster): a write is acked once the crossing has taken it,
+# so the latency of a write is the time to hand it over, not the NuBus write itself. A write run therefore ends with
+# a read of the last word written, which comes back only after all the writes have been done on the NuBus; 'cycles'
+# includes it, so the bytes of the run over 'cycles' is the write bandwidth (the read is not in the latencies)
+class PingMaster(Module, AutoCSR):
+    def __init__(self, burst_size=4):
         self.bus_mst = bus_mst = wishbone.Interface()
+        self.done_event = Signal() # the run is over (for a CompletionWriter)
+        self.done_status = Signal(16) # ... bit 0: bus errors, bit 1: mismatches
 
-        #led0 = platform.request("user_led", 0)
-        #led1 = platform.request("user_led", 1)
+        self.ctrl = CSRStorage(fields = [CSRField("start", size = 1, pulse = True, description = "Start a run"),
+                                         CSRField("write", size = 1, description = "Write (1) or read (0)"),
+                                         CSRField("size", size = 2, reset = 2, description = "Size of the transactions",
+                                                  values = [("0b00", "byte"), ("0b01", "half-word"), ("0b10", "word"), ("0b11", "block")]),
+                                         CSRField("pattern", size = 2, description = "Data pattern",
+                                                  values = [("0b00", "seed"), ("0b01", "seed, incremented by word"), ("0b10", "word address"), ("0b11", "LFSR from seed")]),
+                                         CSRField("verify", size = 1, description = "Compare read data with the pattern"),])
+        self.base = CSRStorage(32, description = "Byte address of the first transaction")
+        self.count = CSRStorage(32, reset = 1, description = "Number of transactions")
+        self.stride = CSRStorage(32, reset = 4, description = "Bytes between the start of consecutive transactions")
+        self.seed = CSRStorage(32, description = "Pattern seed")
+        self.status = CSRStatus(fields = [CSRField("busy", size = 1, description = "Run in progress"),
+                                          CSRField("done", size = 1, description = "Run finished (cleared by the next start)"),])
+        self.cycles = CSRStatus(32, description = "Cycles for the whole run (writes: up to the end of the final read-back)")
+        self.lat_min = CSRStatus(32, description = "Shortest transaction (writes: until the crossing took it)")
+        self.lat_max = CSRStatus(32, description = "Longest transaction")
+        self.lat_avg = CSRStatus(32, description = "Average transaction (rounded down)")
+        self.lat_total = CSRStatus(32, description = "Sum of the transactions")
+        self.bus_errors = CSRStatus(32, description = "Transactions that ended with a bus error (writes to the host are posted, their NuBus errors are counted in wishbone_slave_sys_posted_errors)")
+        self.mismatches = CSRStatus(32, description = "Words that didn't match the pattern")
+        self.mismatch_adr = CSRStatus(32, description = "Byte address of the first mismatch")
+        self.mismatch_dat = CSRStatus(32, description = "Data read at the first mismatch")
 
-        valu_reg = Signal(32)
-        waddr_reg = Signal(32)
-        raddr_reg = Signal(32)
-        writ_del = Signal(6)
-        read_del = Signal(6)
-        do_write = Signal()
-        do_read = Signal()
-        #waddr_reg_rev = Signal(32)
-        #self.comb += [ waddr_reg_rev[ 0: 8].eq(waddr_reg[24:32]),
-        #               waddr_reg_rev[ 8:16].eq(waddr_reg[16:24]),
-        #               waddr_reg_rev[16:24].eq(waddr_reg[ 8:16]),
-        #               waddr_reg_rev[24:32].eq(waddr_reg[ 0: 8]), ]
+        write = Signal()
+        size = Signal(2)
+        pattern = Signal(2)
+        verify = Signal()
+        total = Signal(32)
+        remaining = Signal(32)
+        cur_adr = Signal(32) # byte address of the transaction
+        fence_adr = Signal(30) # last word written
+        word_idx = Signal(max = burst_size) # in the block
+        pat = Signal(32)
+        lat = Signal(32)
+        cycles = Signal(32)
+        lat_min = Signal(32)
+        lat_max = Signal(32)
+        lat_total = Signal(32)
+        lat_avg = Signal(32)
+        bus_errors = Signal(32)
+        mismatches = Signal(32)
+        mismatch_adr = Signal(32)
+        mismatch_dat = Signal(32)
+        done = Signal()
+        self.comb += [
+            self.cycles.status.eq(cycles),
+            self.lat_min.status.eq(lat_min),
+            self.lat_max.status.eq(lat_max),
+            self.lat_avg.status.eq(lat_avg),
+            self.lat_total.status.eq(lat_total),
+            self.bus_errors.status.eq(bus_errors),
+            self.mismatches.status.eq(mismatches),
+            self.mismatch_adr.status.eq(mismatch_adr),
+            self.mismatch_dat.status.eq(mismatch_dat),
+            self.status.fields.done.eq(done),
+        ]
 
-        self.sync += [ If(writ_del != 0,
-                          writ_del.eq(writ_del - 1),),
-                       If(writ_del == 1,
-                          do_write.eq(1),
-                       ),
-                       If(read_del != 0,
-                          read_del.eq(read_del - 1),),
-                       If(read_del == 1,
-                          do_read.eq(1),
-                       )
+        # current word
+        word_adr = Signal(30)
+        sel = Signal(4)
+        block = Signal()
+        last_word = Signal()
+        self.comb += [
+            block.eq(size == 0b11),
+            word_adr.eq(cur_adr[2:32] + word_idx),
+            last_word.eq(~block | (word_idx == (burst_size - 1))),
+            Case(size, {
+                0b00: Case(cur_adr[0:2], { i: sel.eq(1 << i) for i in range(4) }),
+                0b01: sel.eq(Mux(cur_adr[1], 0b1100, 0b0011)),
+                "default": sel.eq(0b1111),
+            }),
         ]
-        
-        self.submodules.wishbone_fsm = wishbone_fsm = FSM(reset_state = "Reset")
-        wishbone_fsm.act("Reset",
-                         NextValue(bus_slv.ack, 0),
-                         NextState("Idle"))
-        wishbone_fsm.act("Idle",
-                         If(bus_slv.cyc & bus_slv.stb & bus_slv.we & ~bus_slv.ack, #write
-                            # FIXME: should check for prefix?
-                            Case(bus_slv.adr[0:2], {
-                                0x0: [ NextValue(valu_reg, bus_slv.dat_w[0:32]), ],
-                                0x1: [ NextValue(waddr_reg, bus_slv.dat_w[0:32]),
-                                       NextValue(writ_del, 3), ],
-                                0x2: [ NextValue(raddr_reg, bus_slv.dat_w[0:32]),
-                                       NextValue(read_del, 3), ],
-                            }),
-                            NextValue(bus_slv.ack, 1),
-                         ).Elif(bus_slv.cyc & bus_slv.stb & ~bus_slv.we & ~bus_slv.ack, #read
-                                Case(bus_slv.adr[0:2], {
-                                    0x0: [ NextValue(bus_slv.dat_r, valu_reg), ],
-                                    0x1: [ NextValue(bus_slv.dat_r, waddr_reg), ],
-                                    0x2: [ NextValue(bus_slv.dat_r, raddr_reg), ],
-                                }),
-                                NextValue(bus_slv.ack, 1),
-                         ).Else(
-                             NextValue(bus_slv.ack, 0),
-                         )
-        )
-        
-        self.submodules.writer_fsm = writer_fsm = FSM(reset_state = "Reset")
-        writer_fsm.act("Reset",
-                       NextState("Idle"),)
-        writer_fsm.act("Idle",
-                       If(do_write,
-                          NextValue(do_write, 0),
-                          bus_mst.cyc.eq(1),
-                          bus_mst.stb.eq(1),
-                          bus_mst.we.eq(1),
-                          bus_mst.dat_w.eq(valu_reg),
-                          bus_mst.adr.eq(waddr_reg[2:32]),
-                          bus_mst.sel.eq(0xf),
-                          If(bus_mst.ack,
-                             NextState("Idle")
-                          ).Else(
-                              NextState("Write")
-                          )
-                       ).Elif(do_read,
-                              NextValue(do_read, 0),
-                              bus_mst.cyc.eq(1),
-                              bus_mst.stb.eq(1),
-                              bus_mst.we.eq(0),
-                              bus_mst.adr.eq(raddr_reg[2:32]),
-                              bus_mst.sel.eq(0xf),
-                              NextState("Read"),
+        pat_data = Signal(32)
+        pat_next = Signal(32)
+        self.comb += [
+            pat_data.eq(Mux(pattern == 0b10, Cat(C(0, 2), word_adr), pat)),
+            Case(pattern, {
+                0b01: pat_next.eq(pat + 1),
+                0b11: pat_next.eq(Cat(pat[1:32], 0) ^ Mux(pat[0], 0x80200003, 0)), # x^32 + x^22 + x^2 + x + 1
+                "default": pat_next.eq(pat),
+            }),
+        ]
+        mismatch = Signal()
+        lanes = Signal(32)
+        self.comb += [
+            lanes.eq(Cat(*[Replicate(sel[i], 8) for i in range(4)])),
+            mismatch.eq(((bus_mst.dat_r ^ pat_data) & lanes) != 0),
+        ]
+
+        # average, restoring division once the run is over
+        div_ctr = Signal(6)
+        div_rem = Signal(33)
+        div_quo = Signal(32)
+        div_rem_next = Signal(33)
+        self.comb += div_rem_next.eq(Cat(div_quo[31], div_rem[0:32]))
+
+        self.submodules.run_fsm = run_fsm = FSM(reset_state = "Reset")
+        self.comb += self.status.fields.busy.eq(~run_fsm.ongoing("Idle"))
+        run_fsm.act("Reset",
+                    NextState("Idle"),)
+        run_fsm.act("Idle",
+                    If(self.ctrl.fields.start,
+                       NextValue(write, self.ctrl.fields.write),
+                       NextValue(size, self.ctrl.fields.size),
+                       NextValue(pattern, self.ctrl.fields.pattern),
+                       NextValue(verify, self.ctrl.fields.verify & ~self.ctrl.fields.write),
+                       NextValue(cur_adr, self.base.storage),
+                       NextValue(total, self.count.storage),
+                       NextValue(remaining, self.count.storage),
+                       NextValue(word_idx, 0),
+                       NextValue(pat, self.seed.storage),
+                       NextValue(lat, 0),
+                       NextValue(cycles, 0),
+                       NextValue(lat_min, 0xFFFFFFFF),
+                       NextValue(lat_max, 0),
+                       NextValue(lat_total, 0),
+                       NextValue(lat_avg, 0),
+                       NextValue(bus_errors, 0),
+                       NextValue(mismatches, 0),
+                       NextValue(mismatch_adr, 0),
+                       NextValue(mismatch_dat, 0),
+                       NextValue(done, 0),
+                       If(self.count.storage != 0,
+                          NextState("Run"),
+                       ).Else(
+                           self.done_event.eq(1),
+                           NextValue(done, 1),
                        )
+                    )
         )
-        writer_fsm.act("Write",
-                       bus_mst.cyc.eq(1),
-                       bus_mst.stb.eq(1),
-                       bus_mst.we.eq(1),
-                       bus_mst.dat_w.eq(valu_reg),
-                       bus_mst.adr.eq(waddr_reg[2:32]),
-                       bus_mst.sel.eq(0xf),
-                       If(bus_mst.ack,
-                          NextState("Idle")
+        # back-to-back, the next request goes out in the cycle after the ack
+        run_fsm.act("Run",
+                    bus_mst.cyc.eq(1),
+                    bus_mst.stb.eq(1),
+                    bus_mst.we.eq(write),
+                    bus_mst.adr.eq(word_adr),
+                    bus_mst.dat_w.eq(pat_data),
+                    bus_mst.sel.eq(sel),
+                    bus_mst.cti.eq(Mux(block, Mux(last_word, 0b111, 0b010), 0b000)),
+                    bus_mst.bte.eq(0b00),
+                    NextValue(cycles, cycles + 1),
+                    NextValue(lat, lat + 1),
+                    If(bus_mst.ack | bus_mst.err,
+                       NextValue(pat, pat_next),
+                       NextValue(fence_adr, word_adr),
+                       If(bus_mst.err,
+                          NextValue(bus_errors, bus_errors + 1),
+                       ).Elif(verify & mismatch,
+                              NextValue(mismatches, mismatches + 1),
+                              If(mismatches == 0,
+                                 NextValue(mismatch_adr, Cat(C(0, 2), word_adr)),
+                                 NextValue(mismatch_dat, bus_mst.dat_r),
+                              ),
+                       ),
+                       If(last_word | bus_mst.err, # an error ends the block
+                          NextValue(word_idx, 0),
+                          NextValue(lat, 0),
+                          If((lat + 1) < lat_min, NextValue(lat_min, lat + 1)),
+                          If((lat + 1) > lat_max, NextValue(lat_max, lat + 1)),
+                          NextValue(lat_total, lat_total + lat + 1),
+                          NextValue(cur_adr, cur_adr + self.stride.storage),
+                          NextValue(remaining, remaining - 1),
+                          If(remaining == 1,
+                             NextValue(div_ctr, 0),
+                             NextValue(div_rem, 0),
+                             NextValue(div_quo, lat_total + lat + 1),
+                             If(write,
+                                NextState("Fence"),
+                             ).Else(
+                                 NextState("Average"),
+                             )
+                          ),
+                       ).Else(
+                           NextValue(word_idx, word_idx + 1),
                        ),
+                    )
         )
-        writer_fsm.act("Read",
-                       bus_mst.cyc.eq(1),
-                       bus_mst.stb.eq(1),
-                       bus_mst.we.eq(0),
-                       bus_mst.adr.eq(raddr_reg[2:32]),
-                       bus_mst.sel.eq(0xf),
-                       If(bus_mst.ack,
-                          NextValue(valu_reg, bus_mst.dat_r),
-                          NextState("Idle")
+        # read back the last word written: the crossing keeps the order, so once it's there the posted writes are done
+        run_fsm.act("Fence",
+                    bus_mst.cyc.eq(1),
+                    bus_mst.stb.eq(1),
+                    bus_mst.we.eq(0),
+                    bus_mst.adr.eq(fence_adr),
+                    bus_mst.sel.eq(0b1111),
+                    bus_mst.cti.eq(0b000),
+                    bus_mst.bte.eq(0b00),
+                    NextValue(cycles, cycles + 1),
+                    If(bus_mst.ack | bus_mst.err,
+                       If(bus_mst.err,
+                          NextValue(bus_errors, bus_errors + 1),
                        ),
+                       NextState("Average"),
+                    )
+        )
+        # lat_total / count, one quotient bit per cycle
+        run_fsm.act("Average",
+                    NextValue(div_ctr, div_ctr + 1),
+                    If(div_rem_next >= total,
+                       NextValue(div_rem, div_rem_next - total),
+                       NextValue(div_quo, Cat(1, div_quo[0:31])),
+                    ).Else(
+                        NextValue(div_rem, div_rem_next),
+                        NextValue(div_quo, Cat(0, div_quo[0:31])),
+                    ),
+                    If(div_ctr == 31,
+                       NextState("Done"),
+                    )
+        )
+        run_fsm.act("Done",
+                    self.done_event.eq(1),
+                    self.done_status.eq(Cat(bus_errors != 0, mismatches != 0)),
+                    NextValue(lat_avg, div_quo),
+                    NextValue(done, 1),
+                    NextState("Idle"),
         )
-        
-        #self.comb += [ led0.eq(bus_mst.cyc),
-        #               led1.eq(writ_del != 0), ]
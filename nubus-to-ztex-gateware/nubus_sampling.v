@@ -21,9 +21,9 @@ module nubus_sampling
     input 		  nub_rqstn, // Request
     input 		  nub_ackn, // Acknowledge
 
-	// connected via the CPLD but NuBus90 (unimplemented)
-	//input 		  nub_clk2xn, 
- 	//inout 		  nub_tm2n,
+	// connected via the shifters, NuBus90 only (V1.2)
+	// when sampling the 2x data phase, nub_clkn is the NuBus90 clk2x instead
+ 	input 		  nub_tm2n, // Transfer Mode (NuBus90)
 
 	/* connected via the 74LVT245 */
     input [31:0]  nub_adn, // Address/Data
@@ -45,6 +45,7 @@ module nubus_sampling
 	output 		  start,
 	output        rqst,
 	output 		  ack,
+	output 		  tm2,
 	output [31:0] ad,
 
 	output [3:0]  sel,
@@ -56,6 +57,7 @@ module nubus_sampling
    reg 			  reg_startn;
    reg 			  reg_rqstn;
    reg 			  reg_ackn;
+   reg 			  reg_tm2n;
    reg [31:0] 	  reg_adn;
    reg 			  reg_busy;
    
@@ -67,6 +69,7 @@ module nubus_sampling
 		 reg_startn <= 1;
 		 reg_rqstn <= 1;
 		 reg_ackn <= 1;
+		 reg_tm2n <= 1;
 		 reg_adn <= 0;
 		 reg_busy <= 0;
 	  end else begin
@@ -75,6 +78,7 @@ module nubus_sampling
 		 reg_startn <= nub_startn;
 		 reg_rqstn <= nub_rqstn;
 		 reg_ackn <= nub_ackn;
+		 reg_tm2n <= nub_tm2n;
 		 reg_adn <= nub_adn;
 		 reg_busy <= ~reg_busy & nub_ackn & ~nub_startn /* beginning of transaction */
 			   	   |  reg_busy & nub_ackn &  nub_resetn; /* hold during cycle */
@@ -86,6 +90,7 @@ module nubus_sampling
    assign start = ~reg_startn;
    assign rqst = ~reg_rqstn;
    assign ack = ~reg_ackn;
+   assign tm2 = ~reg_tm2n;
    assign ad = ~reg_adn;
    assign busy = reg_busy;
 
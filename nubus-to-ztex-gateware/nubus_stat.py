@@ -1,26 +1,205 @@
 from migen import *
 from migen.genlib.fifo import *
-from migen.genlib.cdc import BusSynchronizer
+from migen.genlib.cdc import BusSynchronizer, PulseSynchronizer, MultiReg
 
 import litex
 from litex.soc.interconnect import wishbone
 
+# NuBus performance monitor
+# Word addresses (32 bits, big-endian for the Mac like everything else here):
+# 0x00: slave read count (live)
+# 0x01: slave write count (live)
+# 0x02: write: bit 0: take a snapshot, bit 1: clear the counters after the snapshot
+#       read: snapshot sequence number, changes once the snapshot is done
+# 0x10-: snapshot, all taken in the same NuBus cycle (see below)
+# Everything is counted in the NuBus domain. A snapshot copies all the counters at once, then the copy
+# and its sequence number go to the sys domain together in one BusSynchronizer transfer, so once the
+# sequence number read at 0x02 has changed, the snapshot registers all hold that snapshot.
+# Read protocol: read 0x02, write 0x02 with bit 0 set, poll 0x02 until it differs, then read 0x10-
+# (the same for the Mac, see nubus_to_fpga_export.get_stat_header)
+stat_snapshot_regs = [
+    "timestamp_lo",       # 0x10 NuBus clocks since reset
+    "timestamp_hi",       # 0x11
+    "slave_reads",        # 0x12 slave reads
+    "slave_writes",       # 0x13 slave writes
+    "read_lat_total",     # 0x14 sum of the slave read latencies (NuBus clocks from START to ACK)
+    "read_lat_max",       # 0x15 worst slave read latency
+    "wfifo_highwater",    # 0x16 most entries in the write FIFO
+    "wfifo_stall",        # 0x17 NuBus clocks slave writes waited for room in the write FIFO
+    "slave_tryagain",     # 0x18 slave accesses answered with try-again
+    "slave_error",        # 0x19 slave accesses answered with an error
+    "dma_arb_wait",       # 0x1a NuBus clocks the DMA waited for the bus
+    "dma_blocks",         # 0x1b DMA block transfers
+    "dma_singles",        # 0x1c DMA single transfers
+    "dma_block_total",    # 0x1d sum of the DMA block transfer durations (NuBus clocks from START to ACK)
+    "dma_block_max",      # 0x1e longest DMA block transfer
+    "dma_tryagain",       # 0x1f DMA transfers ended with try-again
+    "dma_error",          # 0x20 DMA transfers ended with an error
+    "bytes_in",           # 0x21 bytes moved from the Mac to the card (slave writes and DMA reads)
+    "bytes_out",          # 0x22 bytes moved from the card to the Mac (slave reads and DMA writes)
+]
+stat_hist_base = 0x30 # 0x30-0x37: slave read latency histogram, bucket k counts latencies up to 2**(k+1) NuBus clocks (the last one everything above)
+stat_hist_buckets = 8
+
 class NuBusStat(Module):
-    def __init__(self, nubus, platform):
+    def __init__(self, nubus, platform, cd_nubus="nubus"):
         self.bus_slv = bus_slv = wishbone.Interface()
 
         read_ctr = Signal(32)
         writ_ctr = Signal(32)
 
-        self.submodules.sync_read_ctr = BusSynchronizer(width = 32, idomain="nubus", odomain="sys")
-        self.submodules.sync_writ_ctr = BusSynchronizer(width = 32, idomain="nubus", odomain="sys")
+        self.submodules.sync_read_ctr = BusSynchronizer(width = 32, idomain=cd_nubus, odomain="sys")
+        self.submodules.sync_writ_ctr = BusSynchronizer(width = 32, idomain=cd_nubus, odomain="sys")
         self.comb += [
             self.sync_read_ctr.i.eq(nubus.read_ctr),
             read_ctr.eq(self.sync_read_ctr.o),
             self.sync_writ_ctr.i.eq(nubus.writ_ctr),
             writ_ctr.eq(self.sync_writ_ctr.o),
         ]
-        
+
+        nubus_sync = getattr(self.sync, cd_nubus)
+
+        # counters, NuBus domain
+        ctr = { n: Signal(32, name = f"stat_{n}") for n in stat_snapshot_regs }
+        timestamp = Signal(64)
+        hist = [ Signal(32, name = f"stat_hist{k}") for k in range(stat_hist_buckets) ]
+        clear = Signal()
+
+        read_lat = Signal(32) # current slave read
+        read_busy = Signal()
+        dma_lat = Signal(32) # current DMA transaction
+        lat_bucket = Signal(max = stat_hist_buckets)
+        lat = Signal(32)
+        self.comb += lat.eq(read_lat + 1) # the ACK cycle counts too
+        self.comb += [ If(lat > 2**(stat_hist_buckets - 1), lat_bucket.eq(stat_hist_buckets - 1)) ] + \
+                     [ If((lat <= 2**(k+1)) & (lat > 2**k), lat_bucket.eq(k)) for k in range(1, stat_hist_buckets - 1) ]
+
+        read_done = Signal()
+        dma_done = Signal()
+        self.comb += [
+            read_done.eq(read_busy & nubus.stat_slave_ack),
+            dma_done.eq(nubus.stat_dma_ack),
+        ]
+
+        def add(n, v):
+            return ctr[n].eq(ctr[n] + v)
+        def hold_max(n, v):
+            return If(v > ctr[n], ctr[n].eq(v))
+
+        nubus_sync += [
+            timestamp.eq(timestamp + 1),
+            If(clear,
+               *[ ctr[n].eq(0) for n in stat_snapshot_regs if not n.startswith("timestamp") ],
+               *[ h.eq(0) for h in hist ],
+            ).Else(
+                # slave
+                If(nubus.stat_read_start, add("slave_reads", 1)),
+                If(nubus.stat_write_bytes != 0, add("slave_writes", 1)),
+                If(read_done,
+                   add("read_lat_total", lat),
+                   hold_max("read_lat_max", lat),
+                   Case(lat_bucket, { k: hist[k].eq(hist[k] + 1) for k in range(stat_hist_buckets) }),
+                ),
+                hold_max("wfifo_highwater", nubus.stat_wfifo_level),
+                If(nubus.stat_wfifo_stall, add("wfifo_stall", 1)),
+                If(nubus.stat_slave_tryagain, add("slave_tryagain", 1)),
+                If(nubus.stat_slave_error, add("slave_error", 1)),
+                # master
+                If(nubus.stat_dma_arb, add("dma_arb_wait", 1)),
+                If(dma_done,
+                   If(nubus.stat_dma_burst,
+                      add("dma_blocks", 1),
+                      add("dma_block_total", dma_lat + 1),
+                      hold_max("dma_block_max", dma_lat + 1),
+                   ).Else(
+                       add("dma_singles", 1),
+                   ),
+                   If(nubus.stat_dma_tryagain,
+                      add("dma_tryagain", 1),
+                   ).Elif(nubus.stat_dma_error,
+                          add("dma_error", 1),
+                   ),
+                ),
+            ),
+            If(nubus.stat_read_start,
+               read_busy.eq(1),
+               read_lat.eq(0),
+            ).Elif(read_done,
+                   read_busy.eq(0),
+            ).Elif(read_busy,
+                   read_lat.eq(read_lat + 1),
+            ),
+            If(nubus.stat_dma_busy,
+               dma_lat.eq(dma_lat + 1),
+            ).Else(
+                dma_lat.eq(0),
+            ),
+        ]
+        # bytes, a slave access and a DMA completion can happen in the same cycle
+        slave_out = Signal(8)
+        slave_in = Signal(8)
+        dma_out = Signal(8)
+        dma_in = Signal(8)
+        self.comb += [
+            slave_out.eq(Mux(read_done & ~nubus.stat_slave_tryagain & ~nubus.stat_slave_error, 4, 0)),
+            slave_in.eq(nubus.stat_write_bytes),
+            dma_out.eq(Mux(dma_done & ~nubus.stat_dma_tryagain & ~nubus.stat_dma_error & nubus.stat_dma_we, nubus.stat_dma_bytes, 0)),
+            dma_in.eq(Mux(dma_done & ~nubus.stat_dma_tryagain & ~nubus.stat_dma_error & ~nubus.stat_dma_we, nubus.stat_dma_bytes, 0)),
+        ]
+        nubus_sync += [
+            If(~clear,
+               ctr["bytes_in"].eq(ctr["bytes_in"] + slave_in + dma_in),
+               ctr["bytes_out"].eq(ctr["bytes_out"] + slave_out + dma_out),
+            )
+        ]
+
+        # snapshot: latched in the NuBus domain, then one crossing for all of it
+        snap_seq = Signal(8)
+        snap = { n: Signal(32, name = f"snap_{n}") for n in stat_snapshot_regs }
+        snap_hist = [ Signal(32, name = f"snap_hist{k}") for k in range(stat_hist_buckets) ]
+        snap_req = Signal()
+        snap_clear = Signal()
+        snap_clear_nubus = Signal()
+        self.submodules.snap_req_sync = PulseSynchronizer(idomain = "sys", odomain = cd_nubus)
+        self.specials += MultiReg(snap_clear, snap_clear_nubus, odomain = cd_nubus) # set before the request
+        self.comb += [
+            self.snap_req_sync.i.eq(snap_req),
+            clear.eq(self.snap_req_sync.o & snap_clear_nubus),
+            ctr["timestamp_lo"].eq(timestamp[0:32]),
+            ctr["timestamp_hi"].eq(timestamp[32:64]),
+        ]
+        nubus_sync += [
+            If(self.snap_req_sync.o,
+               snap_seq.eq(snap_seq + 1),
+               *[ snap[n].eq(ctr[n]) for n in stat_snapshot_regs ],
+               *[ snap_hist[k].eq(hist[k]) for k in range(stat_hist_buckets) ],
+            )
+        ]
+        snap_nubus = Cat(snap_seq, *[ snap[n] for n in stat_snapshot_regs ], *snap_hist)
+        self.submodules.sync_snap = BusSynchronizer(width = len(snap_nubus), idomain = cd_nubus, odomain = "sys")
+        snap_seq_sys = Signal(8)
+        snap_sys = { n: Signal(32, name = f"snap_sys_{n}") for n in stat_snapshot_regs }
+        snap_hist_sys = [ Signal(32, name = f"snap_sys_hist{k}") for k in range(stat_hist_buckets) ]
+        self.comb += [
+            self.sync_snap.i.eq(snap_nubus),
+            Cat(snap_seq_sys, *[ snap_sys[n] for n in stat_snapshot_regs ], *snap_hist_sys).eq(self.sync_snap.o),
+        ]
+
+        def be(v): # big-endian for the Mac
+            return Cat(v[24:32], v[16:24], v[ 8:16], v[ 0: 8])
+
+        read_cases = {
+            0x0: [ NextValue(bus_slv.dat_r, be(read_ctr)), ],
+            0x1: [ NextValue(bus_slv.dat_r, be(writ_ctr)), ],
+            0x2: [ NextValue(bus_slv.dat_r, be(snap_seq_sys)), ],
+        }
+        # the snapshot registers come with the sequence number, in the same transfer
+        for i, n in enumerate(stat_snapshot_regs):
+            read_cases[0x10 + i] = [ NextValue(bus_slv.dat_r, be(snap_sys[n])), ]
+        for k in range(stat_hist_buckets):
+            read_cases[stat_hist_base + k] = [ NextValue(bus_slv.dat_r, be(snap_hist_sys[k])), ]
+        read_cases["default"] = [ NextValue(bus_slv.dat_r, 0), ]
+
         self.submodules.wishbone_fsm = wishbone_fsm = FSM(reset_state = "Reset")
         wishbone_fsm.act("Reset",
                          NextValue(bus_slv.ack, 0),
@@ -28,18 +207,22 @@ class NuBusStat(Module):
         wishbone_fsm.act("Idle",
                          If(bus_slv.cyc & bus_slv.stb & bus_slv.we & ~bus_slv.ack, #write
                             # FIXME: should check for prefix?
-                            #Case(bus_slv.adr[0:10], {
-                            #    0x0: [ NextValue(read_ctr, bus_slv.dat_w[0:32]), ],
-                            #    0x1: [ NextValue(write_ctr, bus_slv.dat_w[0:32]), ],
-                            #}),
+                            If(bus_slv.adr[0:10] == 0x2,
+                               NextValue(snap_clear, bus_slv.dat_w[25]), # big-endian bit 1
+                               If(bus_slv.dat_w[24], # big-endian bit 0
+                                  NextState("Snapshot"),
+                               ),
+                            ),
                             NextValue(bus_slv.ack, 1),
                          ).Elif(bus_slv.cyc & bus_slv.stb & ~bus_slv.we & ~bus_slv.ack, #read
-                                Case(bus_slv.adr[0:10], {
-                                    0x0: [ NextValue(bus_slv.dat_r, Cat(read_ctr[24:32], read_ctr[16:24], read_ctr[ 8:16], read_ctr[ 0: 8])), ],
-                                    0x1: [ NextValue(bus_slv.dat_r, Cat(writ_ctr[24:32], writ_ctr[16:24], writ_ctr[ 8:16], writ_ctr[ 0: 8])), ],
-                                }),
+                                Case(bus_slv.adr[0:10], read_cases),
                                 NextValue(bus_slv.ack, 1),
                          ).Else(
                              NextValue(bus_slv.ack, 0),
                          )
         )
+        wishbone_fsm.act("Snapshot", # snap_clear has gone through its MultiReg by the time the request arrives
+                         NextValue(bus_slv.ack, 0),
+                         snap_req.eq(1),
+                         NextState("Idle"),
+        )
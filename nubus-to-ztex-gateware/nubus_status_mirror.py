@@ -0,0 +1,86 @@
+from migen import *
+from migen.genlib.cdc import BusSynchronizer
+
+from litex.soc.interconnect.csr import *
+
+# SoC byte address, CSR, number of words and bits per word of a CSR named as in the generated headers (<bank>_<csr>),
+# once the SoC has placed the CSR banks (i.e. in do_finalize)
+def find_csr(soc, name):
+    step = soc.csr.alignment//8
+    for rname, region in soc.csr.regions.items():
+        if isinstance(region.obj, Memory):
+            continue
+        adr = region.origin
+        for csr in region.obj:
+            nwords = (csr.size + region.busword - 1)//region.busword
+            if ((rname + "_" + csr.name) == name):
+                return (adr, csr, nwords, region.busword)
+            adr += nwords*step
+    raise ValueError(f"No CSR {name}")
+
+# Copy of a few status CSRs in the NuBus domain, so that the drivers polling them (e.g. waiting for the
+# accelerator) are answered by the slave FSM at once instead of going through the Wishbone CDC to sys and back
+# The CSRs are given by name, as in the generated headers (<bank>_<csr>), and resolved in do_finalize
+# once the SoC has placed the CSR banks; registers that aren't CSRs (e.g. behind their own Wishbone slave)
+# are given as a SoC byte address and the sys signal read there
+# All the values cross together with the count of retired slave writes sampled a few cycles
+# earlier; a read is only answered from the mirror when every write the NuBus side has queued
+# had retired by then, so a poll right after a command can't see the status from before the command
+class NuBusStatusMirror(Module):
+    def __init__(self, soc, cd_nubus="nubus", settle=2):
+        self.soc = soc
+        self.cd_nubus = cd_nubus
+        self.settle = settle
+        self.names = []
+        self.entries = [] # (byte address, sys value of the word)
+
+        # NuBus domain
+        self.adr = Signal(32) # SoC byte address of the slave read
+        self.hit = Signal() # answer from the mirror
+        self.dat = Signal(32) # in bus order, like wb_read.dat_r
+        self.wr_queued = Signal(8) # slave writes queued (modulo)
+        # sys domain
+        self.wr_retired = Signal(8) # slave writes done (modulo)
+
+    def add(self, name):
+        self.names.append(name)
+
+    def add_signal(self, adr, value):
+        word = Signal(32)
+        self.comb += word.eq(value)
+        self.entries.append((adr, word))
+
+    def do_finalize(self):
+        if ((len(self.names) == 0) and (len(self.entries) == 0)):
+            return
+        entries = self.entries
+        step = self.soc.csr.alignment//8
+        for name in self.names:
+            (adr, csr, nwords, busword) = find_csr(self.soc, name)
+            if hasattr(csr, "status"):
+                value = csr.status
+            elif hasattr(csr, "storage"):
+                value = csr.storage
+            else:
+                raise ValueError(f"CSR {name} can't be mirrored")
+            for k in range(nwords): # big ordering, most significant word first
+                lo = (nwords - 1 - k)*busword
+                word = Signal(32, name = f"mirror_{name}{k}")
+                self.comb += word.eq(value[lo:min(lo + busword, csr.size)])
+                entries.append((adr + k*step, word))
+
+        # sys: the values, and the retired writes they are known to include
+        retired = [ Signal(8) for i in range(self.settle) ]
+        self.sync += [ retired[0].eq(self.wr_retired) ] + [ retired[i].eq(retired[i-1]) for i in range(1, self.settle) ]
+        self.submodules.sync_values = BusSynchronizer(width = 32*len(entries) + 8, idomain = "sys", odomain = self.cd_nubus)
+        self.comb += self.sync_values.i.eq(Cat(*[ v for (a, v) in entries ], retired[-1]))
+
+        # NuBus
+        mirrored = self.sync_values.o
+        fresh = Signal()
+        self.comb += fresh.eq(mirrored[32*len(entries):] == self.wr_queued)
+        for i, (a, v) in enumerate(entries):
+            self.comb += If(self.adr[2:32] == (a >> 2),
+                            self.hit.eq(fresh),
+                            self.dat.eq(mirrored[i*32:(i+1)*32]),
+            )
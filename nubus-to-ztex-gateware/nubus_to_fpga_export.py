@@ -23,9 +23,11 @@ import time
 
 
 ### _get_rw_functions_c(          reg_name, reg_base,            nwords, busword, alignment, read_only, with_access_functions):
-def _get_rw_functions_c(name,     csr_name, reg_base, area_base, nwords, busword, alignment, read_only, with_access_functions):
+def _get_rw_functions_c(name,     csr_name, reg_base, area_base, nwords, busword, alignment, read_only, with_access_functions, bswap=True):
     reg_name = name + "_" + csr_name
     r = ""
+    # through the big-endian aperture, the registers need no swapping
+    sw = "__builtin_bswap32" if bswap else ""
 
     addr_str = "CSR_{}_ADDR".format(reg_name.upper())
     size_str = "CSR_{}_SIZE".format(reg_name.upper())
@@ -49,13 +51,13 @@ def _get_rw_functions_c(name,     csr_name, reg_base, area_base, nwords, busword
     if with_access_functions:
         r += "static inline {} {}_read(uint32_t a32) {{\n".format(ctype, reg_name, name)
         if nwords > 1:
-            r += "\t{} r = __builtin_bswap32(*((volatile {}*)(a32 + {})));\n".format(ctype, ctype, addr_str)
+            r += "\t{} r = {}(*((volatile {}*)(a32 + {})));\n".format(ctype, sw, ctype, addr_str)
             for sub in range(1, nwords):
                 r += "\tr <<= {};\n".format(busword)
-                r += "\tr |= __builtin_bswap32(*((volatile {}*)(a32 + {} + {})));\n".format(ctype, addr_str, (sub*stride))
+                r += "\tr |= {}(*((volatile {}*)(a32 + {} + {})));\n".format(sw, ctype, addr_str, (sub*stride))
             r += "\treturn r;\n}\n"
         else:
-            r += "\treturn __builtin_bswap32(*((volatile {}*)(a32 + {})));\n}}\n".format(ctype, addr_str)
+            r += "\treturn {}(*((volatile {}*)(a32 + {})));\n}}\n".format(sw, ctype, addr_str)
 
         if not read_only:
             r += "static inline void {}_write(uint32_t a32, {} v) {{\n".format(reg_name, ctype)
@@ -65,11 +67,100 @@ def _get_rw_functions_c(name,     csr_name, reg_base, area_base, nwords, busword
                     v_shift = "v >> {}".format(shift)
                 else:
                     v_shift = "v"
-                r += "\t*((volatile {}*)(a32 + {} + {})) = __builtin_bswap32({});\n".format(ctype, addr_str, (sub*stride), v_shift)
+                r += "\t*((volatile {}*)(a32 + {} + {})) = {}({});\n".format(ctype, addr_str, (sub*stride), sw, v_shift)
             r += "}\n"
     return r
 
-def get_csr_header_split(regions, constants, csr_base=None, with_access_functions=True):
+# shadow-register mode: a write to a storage CSR costs a NuBus round trip for the read of the read-modify-write,
+# so the driver can instead keep the last written values in a 'struct <name>_csr_shadow' (one per board),
+# initialized by <name>_csr_shadow_init() with the reset values
+# <field>_write_shadow() updates the shadow and does a single store
+# <field>_set() only updates the shadow, <reg>_commit() then writes several fields at once
+# pulse fields are written once by the commit, then cleared in the shadow
+def _shadowed(csr, nwords):
+    return (nwords == 1) and not getattr(csr, "read_only", False) and not getattr(csr, "snapshot_control", False)
+
+def _pulse_mask(csr):
+    mask = 0
+    if hasattr(csr, "fields"):
+        for field in csr.fields.fields:
+            if field.pulse:
+                mask |= ((1 << field.size) - 1) << field.offset
+    return mask
+
+def _get_shadow_struct_c(name, csrs):
+    r = "struct " + name + "_csr_shadow {\n"
+    for csr in csrs:
+        r += "\tuint32_t " + csr.name.lower() + ";\n"
+    r += "};\n"
+    r += "static inline void " + name + "_csr_shadow_init(struct " + name + "_csr_shadow *s) {\n"
+    for csr in csrs:
+        reset = csr.storage.reset.value if hasattr(csr, "storage") else 0
+        r += "\ts->" + csr.name.lower() + " = " + hex(reset & ~_pulse_mask(csr)) + ";\n"
+    r += "}\n"
+    return r
+
+def _get_shadow_functions_c(name, csr):
+    reg_name = name + "_" + csr.name.lower()
+    r = "#define CSR_" + reg_name.upper() + "_PULSE_MASK " + hex(_pulse_mask(csr)) + "\n"
+    r += "static inline void " + reg_name + "_write_shadow(uint32_t a32, struct " + name + "_csr_shadow *s, uint32_t v) {\n"
+    r += "\t" + reg_name + "_write(a32, v);\n"
+    r += "\ts->" + csr.name.lower() + " = v & ~CSR_" + reg_name.upper() + "_PULSE_MASK;\n"
+    r += "}\n"
+    r += "static inline void " + reg_name + "_commit(uint32_t a32, struct " + name + "_csr_shadow *s) {\n"
+    r += "\t" + reg_name + "_write_shadow(a32, s, s->" + csr.name.lower() + ");\n"
+    r += "}\n"
+    return r
+
+# snapshot controls (csr_snapshot): <name>_<control>() triggers the snapshot with a single store,
+# the owning module documents how to tell when its registers hold the new values
+def _get_snapshot_function_c(name, csr):
+    reg_name = name + "_" + csr.name.lower()
+    r = "static inline void " + reg_name + "(uint32_t a32) {\n"
+    r += "\t" + reg_name + "_write(a32, 1);\n"
+    r += "}\n"
+    return r
+
+# the SoC constants the Mac side uses (region offsets from the slot base, interrupt bits), as plain #defines;
+# only those of the options built in are there, so the C code can test them with #ifdef
+def get_constants_header(constants):
+    r = generated_banner("//")
+    r += "#ifndef __GENERATED_NUBUSFPGA_SOC_H\n#define __GENERATED_NUBUSFPGA_SOC_H\n"
+    for name, value in constants.items():
+        if not isinstance(value, int):
+            continue
+        if name.endswith("_OFFSET"):
+            r += "#define " + name + " " + hex(value) + "\n"
+        elif name.startswith("IRQ_CTRL_"):
+            r += "#define " + name + " " + str(value) + "\n"
+    r += "\n#endif\n"
+    return r
+
+# the NuBus performance monitor (nubus_stat): word indices from STAT_OFFSET, and how to read a snapshot
+def get_stat_header(snapshot_regs, hist_base, hist_buckets):
+    r = generated_banner("//")
+    r += "#ifndef __GENERATED_NUBUSFPGA_STAT_H\n#define __GENERATED_NUBUSFPGA_STAT_H\n"
+    r += "/* 32-bit words from STAT_OFFSET (nubusfpga_soc.h), big-endian.\n"
+    r += " * Live counters can be read at any time. To read the others as one consistent set:\n"
+    r += " * 1) seq = stat[NUBUSFPGA_STAT_SEQ]\n"
+    r += " * 2) stat[NUBUSFPGA_STAT_SEQ] = NUBUSFPGA_STAT_SNAPSHOT (| NUBUSFPGA_STAT_CLEAR to restart the counters)\n"
+    r += " * 3) poll until stat[NUBUSFPGA_STAT_SEQ] != seq (the new values come with the sequence number)\n"
+    r += " * 4) read the snapshot registers; they hold until the next snapshot is requested */\n"
+    r += "#define NUBUSFPGA_STAT_LIVE_READS 0x00\n"
+    r += "#define NUBUSFPGA_STAT_LIVE_WRITES 0x01\n"
+    r += "#define NUBUSFPGA_STAT_SEQ 0x02\n"
+    r += "#define NUBUSFPGA_STAT_SNAPSHOT 0x1\n"
+    r += "#define NUBUSFPGA_STAT_CLEAR 0x2\n"
+    for i, n in enumerate(snapshot_regs):
+        r += "#define NUBUSFPGA_STAT_" + n.upper() + " " + hex(0x10 + i) + "\n"
+    for k in range(hist_buckets):
+        r += "#define NUBUSFPGA_STAT_HIST" + str(k) + " " + hex(hist_base + k) + "\n"
+    r += "\n#endif\n"
+    return r
+
+# with be_aperture (SoC address of the big-endian aperture of the CSRs), CSR_BASE points to the aperture
+# and the accessors are plain volatile accesses
+def get_csr_header_split(regions, constants, csr_base=None, with_access_functions=True, with_shadow=False, be_aperture=None):
     alignment = constants.get("CONFIG_CSR_ALIGNMENT", 32)
     ar = dict()
     for name, region in regions.items():
@@ -81,15 +172,25 @@ def get_csr_header_split(regions, constants, csr_base=None, with_access_function
         origin = region.origin - csr_base
         r += "\n/* "+name+" */\n"
         r += "#ifndef CSR_BASE\n"
-        r += "#define CSR_BASE {}L\n".format(hex(csr_base & 0x00FFFFFF))
+        r += "#define CSR_BASE {}L\n".format(hex((csr_base if be_aperture is None else be_aperture) & 0x00FFFFFF))
         r += "#endif\n"
         r += "#ifndef CSR_"+name.upper()+"_BASE\n"
         r += "#define CSR_"+name.upper()+"_BASE (CSR_BASE + "+hex(origin)+"L)\n"
+        shadow = with_shadow and with_access_functions and not isinstance(region.obj, Memory)
+        if shadow:
+            shadow_csrs = [csr for csr in region.obj if _shadowed(csr, (csr.size + region.busword - 1)//region.busword)]
+            shadow = len(shadow_csrs) > 0
+        if shadow:
+            r += _get_shadow_struct_c(name, shadow_csrs)
         if not isinstance(region.obj, Memory):
             for csr in region.obj:
                 nr = (csr.size + region.busword - 1)//region.busword
-                r += _get_rw_functions_c(name = name, csr_name = csr.name, reg_base = origin, area_base = region.origin - csr_base, nwords = nr, busword = region.busword, alignment = alignment, read_only = getattr(csr, "read_only", False), with_access_functions = with_access_functions)
+                r += _get_rw_functions_c(name = name, csr_name = csr.name, reg_base = origin, area_base = region.origin - csr_base, nwords = nr, busword = region.busword, alignment = alignment, read_only = getattr(csr, "read_only", False), with_access_functions = with_access_functions, bswap = (be_aperture is None))
                 origin += alignment//8*nr
+                if shadow and _shadowed(csr, nr):
+                    r += _get_shadow_functions_c(name, csr)
+                if with_access_functions and getattr(csr, "snapshot_control", False):
+                    r += _get_snapshot_function_c(name, csr)
                 if hasattr(csr, "fields"):
                     for field in csr.fields.fields:
                         offset = str(field.offset)
@@ -115,6 +216,14 @@ def get_csr_header_split(regions, constants, csr_base=None, with_access_function
                                 r += "\tuint32_t newword = " + field_name + "_replace(a32, oldword, plain_value);\n"
                                 r += "\t" + reg_name + "_write(a32, newword);\n"
                                 r += "}\n"
+                                if shadow and _shadowed(csr, nr):
+                                    r += "static inline void " + field_name + "_set(struct " + name + "_csr_shadow *s, uint32_t plain_value) {\n"
+                                    r += "\ts->" + csr.name.lower() + " = " + field_name + "_replace(0, s->" + csr.name.lower() + ", plain_value);\n"
+                                    r += "}\n"
+                                    r += "static inline void " + field_name + "_write_shadow(uint32_t a32, struct " + name + "_csr_shadow *s, uint32_t plain_value) {\n"
+                                    r += "\t" + field_name + "_set(s, plain_value);\n"
+                                    r += "\t" + reg_name + "_commit(a32, s);\n"
+                                    r += "}\n"
 
         r += "#endif // CSR_"+name.upper()+"_BASE\n"
         r += "\n#endif\n"
@@ -18,6 +18,11 @@ import nubus_to_fpga_export
 
 import nubus_full_unified
 import nubus_stat
+import nubus_wcomb
+import nubus_dma_ring
+import nubus_dma_sched
+import nubus_irq
+from wb_async_cdc import WishboneAsyncCrossingMaster
 
 from litedram.frontend.dma import *
 
@@ -102,6 +107,11 @@ class _CRG(Module, AutoCSR): # AutoCSR for DRP
         self.cd_nubus90.clk = clk2x_nubus
         self.comb += self.cd_nubus90.rst.eq(~rst_nubus_n)
         platform.add_platform_command("create_clock -name nubus90_clk -period 50.0  -waveform {{0.0 25}} [get_ports clk2x_3v3_n]")
+        # the NuBus90 2x FSMs and the 1x FSMs hand over through MultiRegs (arm90/done90_t, s90_req/s90_rdy/s90_done);
+        # the data behind them (burst_wdata, fifo_buffer90, blk_data/blk90) is only read once the handshake says it's stable,
+        # this bounds those quasi-static paths so that they settle before the synchronized flag gets there
+        platform.add_platform_command("set_max_delay -datapath_only -from [get_clocks nubus_clk] -to [get_clocks nubus90_clk] 20.0")
+        platform.add_platform_command("set_max_delay -datapath_only -from [get_clocks nubus90_clk] -to [get_clocks nubus_clk] 20.0")
 
         num_adv = 0
         num_clk = 0
@@ -178,7 +188,7 @@ class _CRG(Module, AutoCSR): # AutoCSR for DRP
             
         
 class NuBusFPGA(MacPeriphSoC):
-    def __init__(self, variant, version, sys_clk_freq, goblin, hdmi, goblin_res, use_goblin_alt, sdcard, flash, config_flash, ethernet, **kwargs):
+    def __init__(self, variant, version, sys_clk_freq, goblin, hdmi, goblin_res, use_goblin_alt, sdcard, flash, config_flash, ethernet, nubus90=False, write_combining=False, dma_ring=False, tryagain_budget=0, dma_bursts=False, dma_sched=False, check_unmapped=False, pingmaster=False, be_apertures=[], status_mirror=[], cpl_writeback=False, irq_ctrl=False, goblin_cmdq=False, goblin_lines=False, goblin_flip=None, goblin_audio_ring=False, **kwargs):
         print(f"Building NuBusFPGA for board version {version}")
         
         self.platform = platform = ztex213_nubus.Platform(variant = variant, version = version)
@@ -281,13 +291,16 @@ class NuBusFPGA(MacPeriphSoC):
             self.comb += irq_line.eq(fb_irq) # active low, enable if one is low
         else:
             # details for usesampling in the NuBus python object
+            # (this path is used by both V1.0 and V1.2, nubus_full_unified covers both)
             usesampling = False
             wishbone_master_sys = wishbone.Interface(data_width=self.bus.data_width)
             if (not usesampling): # we need an extra CDC
-                self.submodules.wishbone_master_nubus = WishboneDomainCrossingMaster(platform=self.platform, slave=wishbone_master_sys, cd_master="nubus", cd_slave="sys") # for non-sampling only
+                self.submodules.wishbone_master_nubus = WishboneAsyncCrossingMaster(slave=wishbone_master_sys, cd_master="nubus", cd_slave="sys") # for non-sampling only
             nubus_writemaster_sys = wishbone.Interface(data_width=self.bus.data_width)
             wishbone_slave_nubus = wishbone.Interface(data_width=self.bus.data_width)
-            self.submodules.wishbone_slave_sys = WishboneDomainCrossingMaster(platform=self.platform, slave=wishbone_slave_nubus, cd_master="sys", cd_slave="nubus", force_delay=9) # force delay needed to avoid back-to-back transaction running into issue https://github.com/alexforencich/verilog-wishbone/issues/4
+            # FIFO-based, so back-to-back transactions are safe without the force_delay=9 WishboneDomainCrossingMaster needed (https://github.com/alexforencich/verilog-wishbone/issues/4)
+            # writes to the NuBus are posted, several can be queued
+            self.submodules.wishbone_slave_sys = WishboneAsyncCrossingMaster(slave=wishbone_slave_nubus, cd_master="sys", cd_slave="nubus", posted_writes=True)
             #led0 = platform.request("user_led", 0)
             #led1 = platform.request("user_led", 1)
             #self.comb += [ led0.eq(self.wishbone_slave_sys.stb),
@@ -311,12 +324,20 @@ class NuBusFPGA(MacPeriphSoC):
                 ("blkaddress", blk_addr_width),
                 ("dmaaddress", 32),
             ]
+            if (dma_ring): # ExchangeWithMem and the DMA ring share the FIFOs, the entries say whose they are (see DMAFIFOShare)
+                self.tosbus_layout += [("tag", 1)]
+                self.fromsbus_layout += [("tag", 1)]
+                self.fromsbus_req_layout += [("tag", 1)]
         
 
             irq_line = self.platform.request("nmrq_3v3_n") # active low
             fb_irq = Signal(reset = 1) # active low
             dma_irq = Signal(reset = 1) # active low
             audio_irq = Signal(reset = 1) # active low
+            eth_irq = Signal(reset = 1) # active low
+            dma_ring_irq = Signal() # active high
+            dma_event = Signal() # one pulse per DMA ring completion, for coalescing in irq_ctrl
+            audio_event = Signal() # one pulse per audio buffer/period played, for coalescing in irq_ctrl
             #led0 = platform.request("user_led", 0)
             #led1 = platform.request("user_led", 1)
             #self.comb += [
@@ -324,25 +345,55 @@ class NuBusFPGA(MacPeriphSoC):
             #    led1.eq(~dma_irq),
             #]
 
-            self.comb += irq_line.eq(fb_irq & dma_irq & audio_irq) # active low, enable if one is low
+            if (irq_ctrl):
+                # one pending register for the slot ISR, with masks and coalescing
+                irq_sources = [("fb", ~fb_irq), ("audio", ~audio_irq, audio_event), ("eth", ~eth_irq)]
+                irq_sources.insert(1, ("dma", ~dma_irq))
+                if (dma_ring):
+                    irq_sources.insert(2, ("dma_ring", dma_ring_irq, dma_event))
+                self.submodules.irq_ctrl = nubus_irq.NuBusIRQController(sources=irq_sources, sys_clk_freq=sys_clk_freq)
+                for i, src in enumerate(irq_sources):
+                    self.add_constant(f"IRQ_CTRL_{src[0].upper()}_BIT", i)
+                self.comb += irq_line.eq(~self.irq_ctrl.irq)
+            else:
+                self.comb += irq_line.eq(fb_irq & dma_irq & ~dma_ring_irq & audio_irq & eth_irq) # active low, enable if one is low
 
             
             self.submodules.tosbus_fifo = ClockDomainsRenamer({"read": "nubus", "write": "sys"})(AsyncFIFOBuffered(width=layout_len(self.tosbus_layout), depth=1024//data_width))
             self.submodules.fromsbus_fifo = ClockDomainsRenamer({"write": "nubus", "read": "sys"})(AsyncFIFOBuffered(width=layout_len(self.fromsbus_layout), depth=512//data_width))
             self.submodules.fromsbus_req_fifo = ClockDomainsRenamer({"read": "nubus", "write": "sys"})(AsyncFIFOBuffered(width=layout_len(self.fromsbus_req_layout), depth=512//data_width))
 
+            if (dma_ring):
+                # the descriptor rings come in addition to ExchangeWithMem, each with its own registers and irq
+                self.submodules.dma_share = nubus_dma_ring.DMAFIFOShare(tosbus_fifo=self.tosbus_fifo,
+                                                                        fromsbus_fifo=self.fromsbus_fifo,
+                                                                        fromsbus_req_fifo=self.fromsbus_req_fifo)
+                self.submodules.dma_ring = nubus_dma_ring.DMARing(soc=self,
+                                                                  burst_size=burst_size,
+                                                                  tosbus_fifo=self.dma_share.tosbus[1],
+                                                                  fromsbus_fifo=self.dma_share.fromsbus[1],
+                                                                  fromsbus_req_fifo=self.dma_share.fromsbus_req[1],
+                                                                  dram_native_r=self.sdram.crossbar.get_port(mode="read", data_width=data_width_bits),
+                                                                  dram_native_w=self.sdram.crossbar.get_port(mode="write", data_width=data_width_bits))
+                self.bus.add_slave("dma_ring", self.dma_ring.bus_slv, SoCRegion(origin=self.mem_map.get("dma_ring", 0xF0B00000), size=self.dma_ring.size, cached=False))
+                self.add_constant("DMA_RING_OFFSET", self.bus.regions["dma_ring"].origin & 0x00FFFFFF) # from the slot base
+                self.comb += dma_ring_irq.eq(self.dma_ring.irq)
+                self.comb += dma_event.eq(self.dma_ring.cpl_event)
+                exchange_fifos = (self.dma_share.tosbus[0], self.dma_share.fromsbus[0], self.dma_share.fromsbus_req[0])
+            else:
+                exchange_fifos = (self.tosbus_fifo, self.fromsbus_fifo, self.fromsbus_req_fifo)
             #if (not sdcard): # fixme: temporay exclusion
             self.submodules.exchange_with_mem = ExchangeWithMem(soc=self,
-                                                                platform=platform,
-                                                                tosbus_fifo=self.tosbus_fifo,
-                                                                fromsbus_fifo=self.fromsbus_fifo,
-                                                                fromsbus_req_fifo=self.fromsbus_req_fifo,
-                                                                dram_native_r=self.sdram.crossbar.get_port(mode="read", data_width=data_width_bits),
-                                                                dram_native_w=self.sdram.crossbar.get_port(mode="write", data_width=data_width_bits),
-                                                                mem_size=self.avail_sdram//1048576,
-                                                                burst_size=burst_size,
-                                                                do_checksum = False,
-                                                                clock_domain="nubus")
+                                                          platform=platform,
+                                                          tosbus_fifo=exchange_fifos[0],
+                                                          fromsbus_fifo=exchange_fifos[1],
+                                                          fromsbus_req_fifo=exchange_fifos[2],
+                                                          dram_native_r=self.sdram.crossbar.get_port(mode="read", data_width=data_width_bits),
+                                                          dram_native_w=self.sdram.crossbar.get_port(mode="write", data_width=data_width_bits),
+                                                          mem_size=self.avail_sdram//1048576,
+                                                          burst_size=burst_size,
+                                                          do_checksum = False,
+                                                          clock_domain="nubus")
             self.comb += dma_irq.eq(self.exchange_with_mem.irq)
             #else:
             #    self.add_sdcard_custom()
@@ -356,6 +407,23 @@ class NuBusFPGA(MacPeriphSoC):
             #                                                    burst_size=burst_size,
             #                                                    clock_domain="nubus")
             #    self.comb += dma_irq.eq(self.exchange_with_sd.irq)
+
+            # merge the NuBus stores to the SDRAM in native-width writes
+            # the NuBus reads go through it as well, so that they don't overtake a pending line
+            # both use dedicated native ports when targeting the SDRAM, bypassing the Wishbone crossbar
+            if (write_combining):
+                self.submodules.wcomb = nubus_wcomb.NuBusWriteCombiner(dram_native_w=self.sdram.crossbar.get_port(mode="write"),
+                                                                       dram_native_r=self.sdram.crossbar.get_port(mode="read"),
+                                                                       dram_base=self.bus.regions["main_ram"].origin,
+                                                                       dram_size=self.bus.regions["main_ram"].size,
+                                                                       wb_write=nubus_writemaster_sys,
+                                                                       wb_read=wishbone_master_sys)
+                nubus_readmaster_sys = self.wcomb.bus_read
+            else:
+                nubus_readmaster_sys = wishbone_master_sys
+
+            if (dma_sched):
+                self.submodules.dma_sched = nubus_dma_sched.NuBusDMAScheduler(cd_nubus="nubus")
                 
 
             self.submodules.nubus = nubus_full_unified.NuBus(soc=self,
@@ -368,17 +436,73 @@ class NuBusFPGA(MacPeriphSoC):
                                                              wb_write=nubus_writemaster_sys,
                                                              wb_dma=wishbone_slave_nubus,
                                                              usesampling=usesampling,
+                                                             nubus90=nubus90,
+                                                             wcomb=(self.wcomb if write_combining else None),
+                                                             tryagain_budget=tryagain_budget,
+                                                             dma_bursts=dma_bursts,
+                                                             dma_sched=(self.dma_sched if dma_sched else None),
+                                                             check_unmapped=check_unmapped,
                                                              cd_nubus="nubus")
             
-            self.bus.add_master(name="NuBusBridgeToWishbone", master=wishbone_master_sys)
+            if (dma_ring):
+                self.comb += self.dma_ring.tosbus_err.eq(self.nubus.tosbus_err)
+            self.bus.add_master(name="NuBusBridgeToWishbone", master=nubus_readmaster_sys)
             self.bus.add_slave("DMA", self.wishbone_slave_sys, SoCRegion(origin=self.mem_map.get("master", None), size=0x40000000, cached=False))
             self.bus.add_master(name="NuBusBridgeToWishboneWrite", master=nubus_writemaster_sys)
 
             self.submodules.stat = nubus_stat.NuBusStat(nubus=self.nubus, platform=platform)
             self.bus.add_slave("Stat", self.stat.bus_slv, SoCRegion(origin=self.mem_map.get("stat", None), size=0x1000, cached=False))
+            self.add_constant("STAT_OFFSET", self.bus.regions["Stat"].origin & 0x00FFFFFF) # from the slot base
             
         if (goblin):
-            MacPeriphSoC.mac_add_goblin(self, use_goblin_alt = use_goblin_alt, hdmi = hdmi, goblin_res = goblin_res, goblin_irq = fb_irq, audio_irq = audio_irq)
+            if (goblin_flip is not None):
+                goblin_irq = Signal(reset = 1) # active low, VBL
+            else:
+                goblin_irq = fb_irq
+            if (goblin_audio_ring):
+                goblin_audio_irq = Signal(reset = 1) # active low
+            else:
+                goblin_audio_irq = audio_irq
+            MacPeriphSoC.mac_add_goblin(self, use_goblin_alt = use_goblin_alt, hdmi = hdmi, goblin_res = goblin_res, goblin_irq = goblin_irq, audio_irq = goblin_audio_irq)
+            # the goblin audio interrupts once per buffer played, each falling edge is an event
+            goblin_audio_irq_d = Signal(reset = 1)
+            audio_edge = Signal()
+            self.sync += goblin_audio_irq_d.eq(goblin_audio_irq)
+            self.comb += audio_edge.eq(goblin_audio_irq_d & ~goblin_audio_irq)
+            if (not goblin_audio_ring):
+                self.comb += audio_event.eq(audio_edge)
+            if (goblin_audio_ring):
+                # the goblin audio buffers refilled from a ring, interrupts for the driver at half/full ring only
+                from goblin_audio_ring import GoblinAudioRing
+                self.submodules.goblin_audio_ring = GoblinAudioRing(soc=self)
+                self.bus.add_master(name="goblin_audio_ring_mst", master=self.goblin_audio_ring.bus_mst)
+                self.comb += [
+                    self.goblin_audio_ring.goblin_irq.eq(~goblin_audio_irq),
+                    audio_irq.eq(Mux(self.goblin_audio_ring.owned, ~self.goblin_audio_ring.irq, goblin_audio_irq)),
+                    audio_event.eq(Mux(self.goblin_audio_ring.owned, self.goblin_audio_ring.period_done, audio_edge)),
+                ]
+            if (goblin_flip is not None):
+                # scanout base switched at the start of the vertical blank, flip-done interrupt shares the fb one
+                from goblin_flip import GoblinFlip
+                self.submodules.goblin_flip = GoblinFlip(soc=self, target=goblin_flip)
+                self.bus.add_master(name="goblin_flip_mst", master=self.goblin_flip.bus_mst)
+                self.comb += [
+                    self.goblin_flip.vbl.eq(~goblin_irq),
+                    fb_irq.eq(goblin_irq & ~self.goblin_flip.irq),
+                ]
+            if (goblin_cmdq):
+                # queued accelerator commands, replayed one at a time
+                from goblin_cmdq import GoblinCmdQueue
+                line = None
+                if (goblin_lines):
+                    # Bresenham lines, in the framebuffer where the NuBus side puts it (0x8f8...)
+                    from goblin_line import GoblinLineEngine
+                    self.submodules.goblin_line = line = GoblinLineEngine(fb_base=0x8F800000)
+                    self.bus.add_master(name="goblin_line_mst", master=self.goblin_line.bus)
+                self.submodules.goblin_cmdq = GoblinCmdQueue(accel_base=self.mem_map.get("goblin_accel", 0xF0901000), line=line)
+                self.bus.add_slave("goblin_cmdq", self.goblin_cmdq.bus_slv, SoCRegion(origin=self.mem_map.get("goblin_cmdq", 0xF0B10000), size=0x1000, cached=False))
+                self.bus.add_master(name="goblin_cmdq_mst", master=self.goblin_cmdq.bus_mst)
+                self.add_constant("GOBLIN_CMDQ_OFFSET", self.bus.regions["goblin_cmdq"].origin & 0x00FFFFFF) # from the slot base
 
         if (sdcard): ### WIP WIP WIP WIP
             self.add_sdcard()
@@ -393,14 +517,59 @@ class NuBusFPGA(MacPeriphSoC):
             self.add_ethernet(phy=self.ethphy, data_width = 32)
             print(f"%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%% {self.ethmac.interface.sram.ev.irq}") # FIXME HANDLEME
             from mdio import MDIOCtrl
-            self.submodules.mdio_ctrl = MDIOCtrl(platform=platform)
+            self.submodules.mdio_ctrl = MDIOCtrl(platform=platform, sys_clk_freq=sys_clk_freq)
+            self.comb += eth_irq.eq(~self.mdio_ctrl.irq) # PHY status changes, instead of polling from the Mac
 
-        # for testing
-        if (False):
+        # for testing: NuBus traffic generator, driven from its CSRs
+        if (pingmaster):
             from nubus_master_tst import PingMaster
-            self.submodules.pingmaster = PingMaster(nubus=self.nubus, platform=self.platform)
-            self.bus.add_slave("pingmaster_slv", self.pingmaster.bus_slv, SoCRegion(origin=self.mem_map.get("pingmaster", None), size=0x010, cached=False))
+            self.submodules.pingmaster = PingMaster()
             self.bus.add_master(name="pingmaster_mst", master=self.pingmaster.bus_mst)
+
+        # big-endian apertures: the regions again, byte-swapped, allocated from the top of the slot space down
+        # (or from mem_map["be_apertures"]) below the regions already there, unless placed in mem_map (<name>_be)
+        if (len(be_apertures) > 0):
+            # the CSR region is only added by SoC.finalize (add_csr_bridge), its place and size are known already
+            csr_size = 2**(self.csr.address_width + 2)
+            def region_size(name):
+                if (name in self.bus.regions):
+                    return self.bus.regions[name].size
+                if (name == "csr"):
+                    return csr_size
+                raise ValueError(f"No region {name} for a big-endian aperture")
+            def used_spans():
+                return [ (r.origin, r.size) for r in self.bus.regions.values() ] + [ (self.mem_map["csr"], csr_size) ]
+            be_origin = self.mem_map.get("be_apertures", 0xF1000000)
+            for name in be_apertures:
+                size = region_size(name)
+                if ((name + "_be") in self.mem_map):
+                    be = self.mem_map[name + "_be"]
+                else:
+                    be = (be_origin - size) & ~(size - 1)
+                    clash = [ o for (o, sz) in used_spans() if ((o < (be + size)) and (be < (o + sz))) ]
+                    while (len(clash) > 0):
+                        be = (min(clash) - size) & ~(size - 1)
+                        clash = [ o for (o, sz) in used_spans() if ((o < (be + size)) and (be < (o + sz))) ]
+                    be_origin = be
+                self.bus.add_region(name + "_be", SoCRegion(origin=be, size=size, cached=False))
+                self.nubus.add_be_aperture(name, self.bus.regions[name + "_be"].origin)
+                self.add_constant(name.upper() + "_BE_OFFSET", self.bus.regions[name + "_be"].origin & 0x00FFFFFF) # from the slot base
+
+        # completion words written into Mac RAM, for the engines that have them
+        if (cpl_writeback):
+            from nubus_cpl_wb import CompletionWriter
+            self.submodules.cpl_wb = CompletionWriter()
+            if (dma_ring):
+                self.cpl_wb.add_source("dma_ring", self.dma_ring.cpl_event, self.dma_ring.cpl_status)
+            if (goblin and goblin_cmdq):
+                self.cpl_wb.add_source("goblin_fence", self.goblin_cmdq.fence_event, self.goblin_cmdq.fence_status)
+            if (pingmaster):
+                self.cpl_wb.add_source("pingmaster", self.pingmaster.done_event, self.pingmaster.done_status)
+            self.bus.add_master(name="cpl_wb_mst", master=self.cpl_wb.bus_mst)
+
+        # status CSRs answered from the NuBus domain
+        for name in status_mirror:
+            self.nubus.add_status_mirror(name)
         
 def main():
     parser = argparse.ArgumentParser(description="NuBusFPGA")
@@ -416,6 +585,25 @@ def main():
     parser.add_argument("--flash", action="store_true", help="add a Flash device [V1.2+FLASHTEMP PMod] and configure the ROM to it")
     parser.add_argument("--config-flash", action="store_true", help="Configure the ROM to the internal Flash used for FPGA config")
     parser.add_argument("--ethernet", action="store_true", help="Add Ethernet (V1.2 w/ custom PMod only)")
+    parser.add_argument("--nubus90", action="store_true", help="Use NuBus90 2x block transfers, for DMA when the target supports them and as a slave (block transfers up to 16 words) (V1.2 only)")
+    parser.add_argument("--dma-ring", action="store_true", help="Add descriptor rings for the DMA (own region and registers), next to ExchangeWithMem")
+    parser.add_argument("--write-combining", action="store_true", help="Merge NuBus stores to the SDRAM into native-width writes and serve SDRAM reads from native ports (default: through the Wishbone crossbar, one word at a time)")
+    parser.add_argument("--tryagain-budget", default=0, help="Answer NuBus slave accesses still pending after that many NuBus cycles with 'try again later' (0: stall as before; V1.2 only)")
+    parser.add_argument("--dma-bursts", action="store_true", help="Turn Wishbone bursts and sequential accesses to the DMA region into NuBus block transfers (needs block-capable targets for full speed)")
+    parser.add_argument("--dma-sched", action="store_true", help="Weighted round-robin scheduling of the NuBus DMA sources, configurable in CSRs (instead of fixed priority)")
+    parser.add_argument("--check-unmapped", action="store_true", help="Answer NuBus accesses to addresses without a SoC region with an error status at once, and count them")
+    parser.add_argument("--csr-shadow", action="store_true", help="Generate shadow-register helpers in the CSR headers (field writes without a NuBus read)")
+    parser.add_argument("--be-apertures", default="", help="Comma-separated SoC regions to also expose byte-swapped (big-endian) to the Mac, e.g. csr,dma_ring")
+    parser.add_argument("--csr-be-headers", action="store_true", help="Generate CSR headers accessing the CSRs through their big-endian aperture, without bswap (requires csr in --be-apertures)")
+    parser.add_argument("--pingmaster", action="store_true", help="Add the NuBus traffic generator (bandwidth/latency benchmark, controlled by CSRs)")
+    parser.add_argument("--cpl-writeback", action="store_true", help="Report completions (DMA ring, traffic generator) by writing a sequence/status word into Mac RAM instead of being polled")
+    parser.add_argument("--goblin-cmdq", action="store_true", help="Command queue in front of the goblin accelerator (needs the matching INIT, built with GOBLIN_CMDQ)")
+    parser.add_argument("--goblin-flip", action="store_true", help="Vsync-synchronised scanout base flips for the goblin framebuffer (pending/active base, flip-done interrupt)")
+    parser.add_argument("--goblin-flip-csr", default="goblin_video_framebuffer_dma_base", help="CSR of the goblin holding the scanout base, written by --goblin-flip (named as in the headers)")
+    parser.add_argument("--goblin-audio-ring", action="store_true", help="Ring-buffer front-end for the goblin HDMI audio, half/full ring interrupts (requires --goblin-alt, needs a matching audio driver)")
+    parser.add_argument("--goblin-lines", action="store_true", help="Line engine behind the goblin command queue (needs the matching INIT, built with GOBLIN_LINES)")
+    parser.add_argument("--irq-ctrl", action="store_true", help="Interrupt controller for NMRQ: pending register (write 1 to clear), masks, coalescing (V1.2 only, needs a matching driver)")
+    parser.add_argument("--status-mirror", default="", help="Comma-separated CSRs (named as in the headers, e.g. mdio_ctrl_queue_status) to answer from the NuBus domain without going to sys (V1.2 only)")
     builder_args(parser)
     vivado_build_args(parser)
     args = parser.parse_args()
@@ -432,6 +620,48 @@ def main():
         print(" ***** ERROR ***** : Ethernet not supported on V1.0\n");
         assert(False)
         
+    if (args.nubus90 and (args.version == "V1.0")):
+        print(" ***** ERROR ***** : NuBus90 not supported on V1.0\n");
+        assert(False)
+        
+    if ((int(args.tryagain_budget) != 0) and (args.version == "V1.0")):
+        print(" ***** ERROR ***** : Try-again budget not supported on V1.0\n");
+        assert(False)
+
+    be_apertures = [ name for name in args.be_apertures.split(",") if name != "" ]
+    if ((len(be_apertures) > 0) and (args.version == "V1.0")):
+        print(" ***** ERROR ***** : Big-endian apertures not supported on V1.0\n");
+        assert(False)
+
+    if (args.goblin_cmdq and not args.goblin):
+        print(" ***** ERROR ***** : Goblin command queue requires goblin\n");
+        assert(False)
+
+    if (args.goblin_flip and not args.goblin):
+        print(" ***** ERROR ***** : Goblin flips require goblin\n");
+        assert(False)
+
+    if (args.goblin_audio_ring and not (args.goblin and args.goblin_alt)):
+        print(" ***** ERROR ***** : Goblin audio ring requires goblin with the alternate (audio) HDMI Phy\n");
+        assert(False)
+
+    if (args.goblin_lines and not args.goblin_cmdq):
+        print(" ***** ERROR ***** : Goblin line engine requires the goblin command queue\n");
+        assert(False)
+
+    if (args.irq_ctrl and (args.version == "V1.0")):
+        print(" ***** ERROR ***** : Interrupt controller not supported on V1.0\n");
+        assert(False)
+
+    status_mirror = [ name for name in args.status_mirror.split(",") if name != "" ]
+    if ((len(status_mirror) > 0) and (args.version == "V1.0")):
+        print(" ***** ERROR ***** : Status mirror not supported on V1.0\n");
+        assert(False)
+
+    if (args.csr_be_headers and not ("csr" in be_apertures)):
+        print(" ***** ERROR ***** : Big-endian CSR headers require the csr aperture\n");
+        assert(False)
+        
     if (args.ethernet and args.flash):
         print(" ***** ERROR ***** : Only one PMod usable on V1.2\n");
         assert(False)
@@ -489,7 +719,23 @@ def main():
                     sdcard=args.sdcard,
                     flash=args.flash,
                     config_flash=args.config_flash,
-                    ethernet=args.ethernet)
+                    ethernet=args.ethernet,
+                    nubus90=args.nubus90,
+                    write_combining=args.write_combining,
+                    dma_ring=args.dma_ring,
+                    tryagain_budget=int(args.tryagain_budget),
+                    dma_bursts=args.dma_bursts,
+                    dma_sched=args.dma_sched,
+                    check_unmapped=args.check_unmapped,
+                    pingmaster=args.pingmaster,
+                    be_apertures=be_apertures,
+                    status_mirror=status_mirror,
+                    cpl_writeback=args.cpl_writeback,
+                    irq_ctrl=args.irq_ctrl,
+                    goblin_cmdq=args.goblin_cmdq,
+                    goblin_lines=args.goblin_lines,
+                    goblin_flip=(args.goblin_flip_csr if args.goblin_flip else None),
+                    goblin_audio_ring=args.goblin_audio_ring)
 
     version_for_filename = args.version.replace(".", "_")
 
@@ -505,9 +751,14 @@ def main():
     csr_contents_dict = nubus_to_fpga_export.get_csr_header_split(
         regions   = soc.csr_regions,
         constants = soc.constants,
-        csr_base  = soc.mem_regions['csr'].origin)
+        csr_base  = soc.mem_regions['csr'].origin,
+        with_shadow = args.csr_shadow,
+        be_aperture = (soc.bus.regions["csr_be"].origin if args.csr_be_headers else None))
     for name in csr_contents_dict.keys():
         write_to_file(os.path.join("nubusfpga_csr_{}.h".format(name)), csr_contents_dict[name])
+    write_to_file("nubusfpga_soc.h", nubus_to_fpga_export.get_constants_header(soc.constants))
+    if hasattr(soc, "stat"):
+        write_to_file("nubusfpga_stat.h", nubus_to_fpga_export.get_stat_header(nubus_stat.stat_snapshot_regs, nubus_stat.stat_hist_base, nubus_stat.stat_hist_buckets))
     
     
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+from migen import *
+from migen.genlib.fifo import *
+
+import litex
+from litex.soc.interconnect import wishbone
+
+# Write-combining between the NuBus write FIFO and the SDRAM
+# Sequential stores (including partial ones) to the same DRAM-native line are merged
+# and written in one go through a LiteDRAM native port, with byte enables
+# Everything outside the SDRAM goes to the Wishbone as before, after flushing the line to keep ordering
+# The line is flushed on:
+# - a store to another line (or outside the SDRAM)
+# - a full line
+# - 'timeout' sys cycles without a new store
+# - a NuBus read to the same line (the read is held until the flush is done)
+# With a native read port, NuBus reads to the SDRAM also bypass the Wishbone crossbar
+# (the write path has its own CDC in the NuBus write FIFO, the read path in the NuBus-side WishboneAsyncCrossingMaster)
+class NuBusWriteCombiner(Module):
+    def __init__(self, dram_native_w, dram_base, dram_size, wb_write, wb_read, dram_native_r=None, timeout=64):
+        # from the NuBus write FIFO
+        self.sink_valid = sink_valid = Signal()
+        self.sink_ready = sink_ready = Signal()
+        self.sink_adr = sink_adr = Signal(32)
+        self.sink_data = sink_data = Signal(32)
+        self.sink_sel = sink_sel = Signal(4)
+
+        # gated version of wb_read, to the SoC bus
+        self.bus_read = bus_read = wishbone.Interface(data_width=len(wb_read.dat_r))
+
+        line_width_bits = dram_native_w.data_width
+        line_width = line_width_bits // 8 # bytes
+        line_words = line_width // 4
+        line_shift = log2_int(line_width)
+        assert(line_words >= 1)
+        assert((dram_base % line_width) == 0)
+
+        # current line
+        line_open = Signal()
+        line_adr = Signal(32 - line_shift) # bus address of the line, in lines
+        line_data = Signal(line_width_bits)
+        line_we = Signal(line_width)
+        timer = Signal(max = timeout + 1)
+
+        sink_in_dram = Signal()
+        sink_same_line = Signal()
+        self.comb += [
+            sink_in_dram.eq((sink_adr >= dram_base) & (sink_adr < (dram_base + dram_size))),
+            sink_same_line.eq(line_open & (sink_adr[line_shift:32] == line_adr)),
+        ]
+
+        # merge the incoming word in the line
+        word = Signal(max(1, log2_int(line_words, False)))
+        if (line_words > 1):
+            self.comb += word.eq(sink_adr[2:line_shift])
+        merge_word = [
+            Case(word, { k: [ If(sink_sel[b],
+                                 NextValue(line_data[k*32+b*8:k*32+b*8+8], sink_data[b*8:b*8+8]),
+                                 NextValue(line_we[k*4+b], 1),
+                              ) for b in range(4) ] for k in range(line_words) }),
+            NextValue(timer, timeout),
+        ]
+        # the line will be complete once this word is in
+        sink_fills_line = Signal()
+        self.comb += Case(word, { k: sink_fills_line.eq((line_we | (sink_sel << (k*4))) == ((2**line_width)-1)) for k in range(line_words) })
+
+        # NuBus reads to the open line must wait for the flush
+        read_active = Signal()
+        read_hit = Signal()
+        read_in_dram = Signal()
+        read_native = Signal()
+        if (dram_native_r is not None):
+            assert(dram_native_r.data_width == line_width_bits)
+            self.comb += read_in_dram.eq((wb_read.adr >= (dram_base >> 2)) & (wb_read.adr < ((dram_base + dram_size) >> 2)))
+        self.comb += [
+            read_hit.eq(wb_read.cyc & wb_read.stb & ~read_active & line_open & (wb_read.adr[(line_shift-2):30] == line_adr)),
+            read_native.eq(wb_read.cyc & wb_read.stb & read_in_dram & ~read_hit),
+            bus_read.adr.eq(wb_read.adr),
+            bus_read.dat_w.eq(wb_read.dat_w),
+            bus_read.sel.eq(wb_read.sel),
+            bus_read.we.eq(wb_read.we),
+            bus_read.cti.eq(wb_read.cti),
+            bus_read.bte.eq(wb_read.bte),
+            bus_read.cyc.eq(wb_read.cyc & ~read_hit & ~read_in_dram),
+            bus_read.stb.eq(wb_read.stb & ~read_hit & ~read_in_dram),
+        ]
+        self.sync += [
+            If(bus_read.cyc & bus_read.stb & ~bus_read.ack & ~bus_read.err,
+               read_active.eq(1),
+            ).Else(
+                read_active.eq(0),
+            )
+        ]
+
+        self.submodules.wcomb_fsm = wcomb_fsm = FSM(reset_state = "Reset")
+        wcomb_fsm.act("Reset",
+                      NextValue(line_open, 0),
+                      NextValue(line_we, 0),
+                      NextState("Idle")
+        )
+        wcomb_fsm.act("Idle",
+                      If(read_hit,
+                         NextState("FlushCmd"),
+                      ).Elif(sink_valid & sink_in_dram & sink_same_line,
+                             sink_ready.eq(1),
+                             *merge_word,
+                             If(sink_fills_line,
+                                NextState("FlushCmd"),
+                             )
+                      ).Elif(sink_valid & sink_in_dram & ~line_open,
+                             sink_ready.eq(1),
+                             NextValue(line_open, 1),
+                             NextValue(line_adr, sink_adr[line_shift:32]),
+                             *merge_word, # line_we is all-zero when no line is open
+                             If(sink_fills_line,
+                                NextState("FlushCmd"),
+                             )
+                      ).Elif(sink_valid & line_open, # different line, or outside of the SDRAM
+                             NextState("FlushCmd"),
+                      ).Elif(sink_valid, # outside of the SDRAM, nothing pending
+                             wb_write.cyc.eq(1),
+                             wb_write.stb.eq(1),
+                             wb_write.we.eq(1),
+                             wb_write.adr.eq(sink_adr[2:32]),
+                             wb_write.dat_w.eq(sink_data),
+                             wb_write.sel.eq(sink_sel),
+                             sink_ready.eq(wb_write.ack),
+                      ).Elif(line_open,
+                             If(timer == 0,
+                                NextState("FlushCmd"),
+                             ).Else(
+                                 NextValue(timer, timer - 1),
+                             )
+                      )
+        )
+        wcomb_fsm.act("FlushCmd",
+                      dram_native_w.cmd.valid.eq(1),
+                      dram_native_w.cmd.we.eq(1),
+                      dram_native_w.cmd.addr.eq(line_adr - (dram_base >> line_shift)),
+                      If(dram_native_w.cmd.ready,
+                         NextState("FlushData"),
+                      )
+        )
+        wcomb_fsm.act("FlushData",
+                      dram_native_w.wdata.valid.eq(1),
+                      dram_native_w.wdata.data.eq(line_data),
+                      dram_native_w.wdata.we.eq(line_we),
+                      If(dram_native_w.wdata.ready,
+                         NextValue(line_open, 0),
+                         NextValue(line_we, 0),
+                         NextState("Idle"),
+                      )
+        )
+
+        if (dram_native_r is not None):
+            read_word = Signal(max(1, log2_int(line_words, False)))
+            read_data = Signal(32)
+            read_ack = Signal()
+            if (line_words > 1):
+                self.comb += read_word.eq(wb_read.adr[0:(line_shift-2)])
+            self.submodules.read_fsm = read_fsm = FSM(reset_state = "Reset")
+            read_fsm.act("Reset",
+                         NextState("Idle")
+            )
+            read_fsm.act("Idle",
+                         If(read_native,
+                            NextState("ReadCmd"),
+                         )
+            )
+            read_fsm.act("ReadCmd",
+                         dram_native_r.cmd.valid.eq(1),
+                         dram_native_r.cmd.we.eq(0),
+                         dram_native_r.cmd.addr.eq(wb_read.adr[(line_shift-2):30] - (dram_base >> line_shift)),
+                         If(dram_native_r.cmd.ready,
+                            NextState("ReadData"),
+                         )
+            )
+            read_fsm.act("ReadData",
+                         dram_native_r.rdata.ready.eq(1),
+                         If(dram_native_r.rdata.valid,
+                            Case(read_word, { k: NextValue(read_data, dram_native_r.rdata.data[k*32:k*32+32]) for k in range(line_words) }),
+                            NextState("ReadAck"),
+                         )
+            )
+            read_fsm.act("ReadAck",
+                         read_ack.eq(1),
+                         NextState("Idle"),
+            )
+            self.comb += [
+                If(read_in_dram,
+                   wb_read.dat_r.eq(read_data),
+                   wb_read.ack.eq(read_ack),
+                ).Else(
+                    wb_read.dat_r.eq(bus_read.dat_r),
+                    wb_read.ack.eq(bus_read.ack),
+                    wb_read.err.eq(bus_read.err),
+                )
+            ]
+        else:
+            self.comb += [
+                wb_read.dat_r.eq(bus_read.dat_r),
+                wb_read.ack.eq(bus_read.ack),
+                wb_read.err.eq(bus_read.err),
+            ]
@@ -0,0 +1,135 @@
+from migen import *
+from migen.fhdl.specials import Tristate
+from mdio import MDIOCtrl
+
+# Mock Platform
+class MockPlatform:
+    def __init__(self):
+        self.signals = {}
+    def request(self, name):
+        if name not in self.signals:
+            self.signals[name] = Signal(name=name)
+        return self.signals[name]
+
+# the line is the master's output when it drives it, the PHY's (pulled up when released) otherwise
+class MDIOLine:
+    def __init__(self):
+        self.phy_o = Signal(reset = 1)
+        self.dr = None
+    def lower(self, dr):
+        self.dr = dr
+        m = Module()
+        m.comb += dr.i.eq(Mux(dr.oe, dr.o, self.phy_o))
+        return m
+
+# clause 22 PHY: samples on the rising edge of MDC, and drives the turnaround 0 and the data right after the rising edges
+def phy_model(line, mdc, regs, log):
+    prev = 0
+    ones = 0
+    hdr = None
+    reply = []
+    while True:
+        c = (yield mdc)
+        if c and not prev:
+            if (yield line.dr.oe):
+                bit = (yield line.dr.o)
+            else:
+                bit = (yield line.phy_o)
+            if reply:
+                yield line.phy_o.eq(reply.pop(0))
+            elif hdr is None:
+                if (ones >= 32) and (bit == 0): # ST
+                    hdr = [0]
+                ones = ones + 1 if bit else 0
+            else:
+                hdr.append(bit)
+                op = hdr[2:4]
+                phy = int("".join(map(str, hdr[4:9])) or "0", 2)
+                reg = int("".join(map(str, hdr[9:14])) or "0", 2)
+                if (len(hdr) == 14) and (op == [1, 0]):
+                    val = regs.get((phy, reg), 0xFFFF)
+                    log.append(("R", phy, reg))
+                    reply = [0] + [(val >> (15 - i)) & 1 for i in range(16)] + [1] # TA 0, D15..D0, release
+                    yield line.phy_o.eq(1) # first TA bit: Z
+                    hdr = None
+                    ones = 0
+                elif len(hdr) == 32:
+                    regs[(phy, reg)] = int("".join(map(str, hdr[16:32])), 2)
+                    log.append(("W", phy, reg))
+                    hdr = None
+                    ones = 0
+        prev = c
+        yield
+
+def run(bench, regs):
+    platform = MockPlatform()
+    line = MDIOLine()
+    dut = MDIOCtrl(platform, sys_clk_freq=20e6) # short MDC period for the sim
+    log = []
+    run_simulation(dut, [bench(dut, regs), passive(phy_model)(line, platform.signals["sep_mdc"], regs, log)],
+                   special_overrides={Tristate: line})
+    return log
+
+def single_read(dut, phy, reg):
+    yield from dut.phy_addr.write(phy)
+    yield from dut.reg_addr.write(reg)
+    yield from dut.mdio_command.write(1)
+    yield
+    while (yield dut.mdio_status.fields.busy):
+        yield
+    return (yield dut.mdio_read.fields.val)
+
+def test_read_bit_order():
+    regs = {(1, 2): 0x8000, (1, 3): 0xA5C3, (1, 4): 0x0001}
+    got = {}
+    def bench(dut, regs):
+        for reg in [2, 3, 4]:
+            got[reg] = (yield from single_read(dut, 1, reg))
+    run(bench, regs)
+    assert got == {2: 0x8000, 3: 0xA5C3, 4: 0x0001}
+
+def test_queue():
+    regs = {(1, 1): 0x7809, (1, 0x1f): 0x0058}
+    results = []
+    pending = []
+    def bench(dut, regs):
+        yield from dut.ev_enable.write(1)
+        for val, reg, wr in [(0x1e1, 4, 1), (0, 1, 0), (0, 0x1f, 0), (0, 4, 0)]:
+            yield from dut.queue_cmd.write(val | reg << 16 | 1 << 21 | wr << 26)
+        yield from dut.doorbell.write(1)
+        while not (yield dut.irq):
+            yield
+        pending.append((yield dut.ev_pending.fields.done))
+        while (yield dut.result.fields.valid):
+            results.append(((yield dut.result.fields.reg_addr), (yield dut.result.fields.val)))
+            yield from dut.result_next.write(1)
+            yield
+    log = run(bench, regs)
+    assert log == [("W", 1, 4), ("R", 1, 1), ("R", 1, 0x1f), ("R", 1, 4)]
+    assert pending == [1]
+    assert results == [(1, 0x7809), (0x1f, 0x0058), (4, 0x1e1)]
+
+def test_autopoll_change():
+    regs = {(1, 1): 0x7809, (1, 0x1f): 0x0058}
+    seen = []
+    def bench(dut, regs):
+        yield from dut.ev_enable.write(2)
+        yield from dut.autopoll_interval.write(300)
+        yield from dut.autopoll_ctrl.write(1 | 1 << 1 | 1 << 6 | 0x1f << 11 | 1 << 16)
+        for i in range(3000):
+            yield
+        seen.append(((yield dut.autopoll_value.fields.reg0), (yield dut.autopoll_value.fields.reg1), (yield dut.irq)))
+        regs[(1, 1)] = 0x780d # link up
+        for i in range(3000):
+            if (yield dut.irq):
+                break
+            yield
+        seen.append(((yield dut.autopoll_value.fields.reg0), (yield dut.ev_pending.fields.change)))
+    run(bench, regs)
+    assert seen == [(0x7809, 0x0058, 0), (0x780d, 1)]
+
+if __name__ == "__main__":
+    test_read_bit_order()
+    test_queue()
+    test_autopoll_change()
+    print("done")
@@ -0,0 +1,489 @@
+from migen import *
+from migen.fhdl.specials import Instance, Tristate
+from migen.genlib.fifo import AsyncFIFOBuffered
+from litex.soc.interconnect import wishbone
+from litex.soc.integration.soc import SoCRegion
+from nubus_full_unified import NuBus
+
+M32 = 0xffffffff
+
+# the Migen simulator doesn't truncate '~' of unsigned values to their width as Verilog does,
+# which breaks comparisons such as (slot_ad[27] == ~id_i_n[3]) in the slot decoding
+import migen.sim.core
+from migen.fhdl.structure import _Operator
+from migen.fhdl.bitcontainer import value_bits_sign
+_sim_eval = migen.sim.core.Evaluator.eval
+def _sim_eval_invert(self, node, postcommit=False):
+    if (type(node) is _Operator) and (node.op == "~"):
+        (width, signed) = value_bits_sign(node.operands[0])
+        v = ~_sim_eval(self, node.operands[0], postcommit)
+        return v if signed else (v & ((1 << width) - 1))
+    return _sim_eval(self, node, postcommit)
+migen.sim.core.Evaluator.eval = _sim_eval_invert
+
+# Mock Platform
+class MockPlatform:
+    widths = {"ad_3v3_n": 32, "id_3v3_n": 3, "arb_3v3_n": 4, "arb_o_n": 4}
+    def __init__(self):
+        self.signals = {}
+    def request(self, name):
+        if name not in self.signals:
+            self.signals[name] = Signal(self.widths.get(name, 1), name=name)
+        return self.signals[name]
+    def add_source(self, *args, **kwargs):
+        pass
+
+class MockBus:
+    def __init__(self):
+        self.regions = {}
+
+class MockSoC:
+    def __init__(self):
+        self.bus = MockBus()
+
+# the other cards on the backplane: what they drive (active low, released is 1)
+class Backplane:
+    def __init__(self):
+        self.startn = Signal(reset = 1)
+        self.tm0n = Signal(reset = 1)
+        self.tm1n = Signal(reset = 1)
+        self.tm2n = Signal(reset = 1)
+        self.ackn = Signal(reset = 1)
+        self.rqstn = Signal(reset = 1)
+        self.adn = Signal(32, reset = M32)
+        self.ad_oe = Signal() # the FPGA drives AD
+        self.ad_o_n = Signal(32)
+
+# nubus_sampling.v: registered on the falling edge (the "_neg" domain in the sim)
+class SamplingModel(Module):
+    def __init__(self, p):
+        sync = getattr(self.sync, p["nub_clkn"].cd + "_neg")
+        regs = {}
+        for n, w, r in [("tm0n", 1, 1), ("tm1n", 1, 1), ("startn", 1, 1), ("rqstn", 1, 1), ("ackn", 1, 1), ("tm2n", 1, 1), ("adn", 32, 0)]:
+            regs[n] = Signal(w, reset = r)
+            sync += regs[n].eq(p["nub_" + n])
+        busy = Signal()
+        sync += busy.eq(~busy & p["nub_ackn"] & ~p["nub_startn"] | busy & p["nub_ackn"])
+        outs = {"tm0": ~regs["tm0n"], "tm1": ~regs["tm1n"], "start": ~regs["startn"], "rqst": ~regs["rqstn"],
+                "ack": ~regs["ackn"], "tm2": ~regs["tm2n"], "ad": ~regs["adn"], "busy": busy}
+        for k, v in outs.items():
+            if k in p:
+                self.comb += p[k].eq(v)
+        a = regs["adn"]
+        t0 = regs["tm0n"]
+        t1 = regs["tm1n"]
+        if "sel" in p:
+            self.comb += p["sel"].eq(Cat(~t1 & a[1] & a[0] & ~t0 | ~t1 & a[1] & ~a[0] & t0 | ~t1 & a[1] & a[0] & t0,
+                                         ~t1 & a[1] & ~a[0] & ~t0 | ~t1 & a[1] & ~a[0] & t0 | ~t1 & a[1] & a[0] & t0,
+                                         ~t1 & ~a[1] & a[0] & ~t0 | ~t1 & ~a[1] & ~a[0] & t0 | ~t1 & a[1] & a[0] & t0,
+                                         ~t1 & ~a[1] & ~a[0] & ~t0 | ~t1 & ~a[1] & ~a[0] & t0 | ~t1 & a[1] & a[0] & t0))
+        if "block" in p:
+            self.comb += p["block"].eq(~a[1] & a[0] & t0)
+
+# nubus_cpldinfpga.v: wired-OR of our outputs (when enabled) and the other cards, arbitration always won
+class CPLDModel(Module):
+    def __init__(self, p, platform, bp):
+        pins = platform.signals
+        def drive(pin, oe, val, other):
+            self.comb += pins[pin].eq(other & Mux(oe, val, 1))
+        drive("tm0_3v3_n", ~p["tmoen"], p["tm0_n_3v3"], bp.tm0n)
+        drive("tm1_3v3_n", ~p["tmoen"], p["tm1_n_3v3"], bp.tm1n)
+        drive("ack_3v3_n", ~p["tmoen"], p["ack_n_3v3"], bp.ackn)
+        drive("tm2_3v3_n", ~p["tm2oen"], p["tm2_n_3v3"], bp.tm2n)
+        drive("start_3v3_n", p["nubus_master_dir"], p["start_n_3v3"], bp.startn)
+        drive("rqst_3v3_n", ~p["rqst_oe_n"], p["rqst_n_3v3"], bp.rqstn)
+        self.comb += p["grant"].eq(~p["arbcy_n"])
+
+def params(inst):
+    return { it.name: it.expr for it in inst.items if hasattr(it, "expr") }
+
+class InstanceModel:
+    def __init__(self, platform, bp):
+        self.platform = platform
+        self.bp = bp
+    def lower(self, dr):
+        p = params(dr)
+        if dr.of == "nubus_sampling":
+            return SamplingModel(p)
+        if dr.of == "nubus_cpldinfpga":
+            return CPLDModel(p, self.platform, self.bp)
+        return Module()
+
+class ADModel:
+    def __init__(self, bp):
+        self.bp = bp
+    def lower(self, dr):
+        m = Module()
+        m.comb += [
+            dr.i.eq(Mux(dr.oe, dr.o, self.bp.adn)),
+            self.bp.ad_oe.eq(dr.oe),
+            self.bp.ad_o_n.eq(dr.o),
+        ]
+        return m
+
+class DUT(Module):
+    def __init__(self, **kwargs):
+        burst_size = 4
+        self.platform = platform = MockPlatform()
+        self.bp = Backplane()
+        soc = MockSoC()
+        soc.platform = platform
+        soc.tosbus_layout = [("address", 32), ("data", burst_size*32)]
+        soc.fromsbus_layout = [("blkaddress", 28), ("data", burst_size*32)]
+        soc.fromsbus_req_layout = [("blkaddress", 28), ("dmaaddress", 32)]
+        soc.hold_reset = Signal()
+        self.submodules.tosbus_fifo = ClockDomainsRenamer({"read": "nubus", "write": "sys"})(AsyncFIFOBuffered(width=layout_len(soc.tosbus_layout), depth=16))
+        self.submodules.fromsbus_fifo = ClockDomainsRenamer({"write": "nubus", "read": "sys"})(AsyncFIFOBuffered(width=layout_len(soc.fromsbus_layout), depth=16))
+        self.submodules.fromsbus_req_fifo = ClockDomainsRenamer({"read": "nubus", "write": "sys"})(AsyncFIFOBuffered(width=layout_len(soc.fromsbus_req_layout), depth=16))
+        self.wb_read = wishbone.Interface() # nubus
+        self.wb_write = wishbone.Interface() # sys
+        self.wb_dma = wishbone.Interface() # nubus
+        self.submodules.nubus = NuBus(soc=soc, version="V1.2", burst_size=burst_size,
+                                      tosbus_fifo=self.tosbus_fifo, fromsbus_fifo=self.fromsbus_fifo, fromsbus_req_fifo=self.fromsbus_req_fifo,
+                                      wb_read=self.wb_read, wb_write=self.wb_write, wb_dma=self.wb_dma, **kwargs)
+        for name in ["tm0_3v3_n", "tm1_3v3_n", "ack_3v3_n", "start_3v3_n", "rqst_3v3_n", "tm2_3v3_n"]:
+            platform.request(name)
+        self.comb += platform.request("id_3v3_n").eq(~0x6 & 0x7) # slot E
+        self.clock_domains.cd_sys = ClockDomain()
+        self.clock_domains.cd_nubus = ClockDomain()
+        self.clock_domains.cd_nubus90 = ClockDomain()
+
+# the rising edges of clk and clk2x are aligned, sampling is on the falling edges
+clocks = {"sys": 10, "nubus": 100, "nubus_neg": (100, 50), "nubus90": (50, 25), "nubus90_neg": 50}
+slot = 0xFE000000
+
+def run(dut, generators):
+    run_simulation(dut, generators, clocks=clocks,
+                   special_overrides={Instance: InstanceModel(dut.platform, dut.bp), Tristate: ADModel(dut.bp)})
+
+# SDRAM behind wb_read (nubus) and wb_write (sys)
+def wb_read_mem(dut, mem, delay = 2, log = None):
+    wb = dut.wb_read
+    while True:
+        if (yield wb.cyc) and (yield wb.stb):
+            adr = (yield wb.adr)
+            if log is not None:
+                log.append(adr)
+            for i in range(delay): yield
+            yield wb.dat_r.eq(mem.get(adr, 0xA0000000 | (adr & 0xffff)))
+            yield wb.ack.eq(1)
+            yield
+            yield wb.ack.eq(0)
+        yield
+
+def wb_write_mem(dut, mem):
+    wb = dut.wb_write
+    while True:
+        if (yield wb.cyc) and (yield wb.stb):
+            adr = (yield wb.adr)
+            dat = (yield wb.dat_w)
+            sel = (yield wb.sel)
+            mask = sum(0xff << (8*b) for b in range(4) if (sel >> b) & 1)
+            mem[adr] = (mem.get(adr, 0xA0000000 | (adr & 0xffff)) & ~mask) | (dat & mask)
+            yield wb.ack.eq(1)
+            yield
+            yield wb.ack.eq(0)
+        yield
+
+def sdram_adr(offset): # first 8 MiB of the slot space
+    return (0x8F800000 | offset) >> 2
+
+def status(tm1n, tm0n):
+    return {(0, 0): "ok", (1, 1): "tryagain", (0, 1): "error", (1, 0): "timeout"}[(tm1n, tm0n)]
+
+blk_codes = {2: 0b010, 4: 0b0110, 8: 0b01110, 16: 0b011110, 32: 0b0111110}
+
+# Other cards, in nubus90: each yield is half a NuBus cycle, the values read after a yield are the ones during that half.
+class Card:
+    def __init__(self, dut):
+        self.dut = dut
+        self.bp = dut.bp
+        self.pins = dut.platform.signals
+        self.tick = 0
+    def step(self, n = 1):
+        for i in range(n):
+            yield
+            self.tick += 1
+    def release(self):
+        for s in [self.bp.startn, self.bp.tm0n, self.bp.tm1n, self.bp.tm2n, self.bp.ackn]:
+            yield s.eq(1)
+        yield self.bp.adn.eq(M32)
+    def ack_pins(self):
+        return ((yield self.pins["ack_3v3_n"]), (yield self.pins["tm0_3v3_n"]), (yield self.pins["tm1_3v3_n"]), (yield self.pins["tm2_3v3_n"]))
+
+    # master accesses to our slave, starting on a NuBus clock edge (odd ticks)
+    def start(self, adn, write, tm0n = 1, tm2n = 1):
+        if (self.tick % 2) == 0:
+            yield from self.step()
+        yield self.bp.startn.eq(0)
+        yield self.bp.adn.eq(adn)
+        yield self.bp.tm0n.eq(tm0n)
+        yield self.bp.tm1n.eq(0 if write else 1)
+        yield self.bp.tm2n.eq(tm2n)
+        yield from self.step(2)
+        yield self.bp.startn.eq(1)
+        yield self.bp.tm0n.eq(1)
+        yield self.bp.tm1n.eq(1)
+        yield self.bp.tm2n.eq(1)
+
+    def access(self, adr, write = False, data = 0):
+        yield from self.start((~adr & 0xfffffffc) | 0x3, write)
+        yield self.bp.adn.eq((~data & M32) if write else M32)
+        for i in range(400):
+            yield from self.step()
+            (ackn, tm0n, tm1n, tm2n) = yield from self.ack_pins()
+            if not ackn:
+                d = (~(yield self.bp.ad_o_n)) & M32
+                yield from self.release()
+                yield from self.step()
+                return (status(tm1n, tm0n), d)
+        yield from self.release()
+        return ("nobody", 0)
+
+    # block transfer, at 2x from the second word if the slave answers the first one with TM2
+    def block(self, adr, n, write = False, words = None, ask2x = True):
+        yield from self.start(~(adr | blk_codes[n]) & M32, write, tm2n = 0 if ask2x else 1)
+        yield self.bp.adn.eq((~words[0] & M32) if write else M32)
+        k = 0
+        got = []
+        fast = False
+        for i in range(400):
+            yield from self.step()
+            (ackn, tm0n, tm1n, tm2n) = yield from self.ack_pins()
+            if ackn and tm0n:
+                continue
+            got.append((~(yield self.bp.ad_o_n)) & M32)
+            k = k + 1
+            fast = fast or not tm2n
+            if not ackn:
+                yield from self.release()
+                yield from self.step()
+                return (status(tm1n, tm0n), fast, got)
+            if (not fast) or (k == 1):
+                yield from self.step() # second half of a 1x response
+            if write:
+                yield self.bp.adn.eq(~words[k] & M32)
+        yield from self.release()
+        return ("nobody", fast, got)
+
+# NuBus90 slave for our DMA, the first response at 1x with TM2, then a word every clk2x cycle
+def slave90(dut, mem, log, abort):
+    card = Card(dut)
+    bp = dut.bp
+    while True:
+        yield from card.step()
+        if (yield card.pins["start_3v3_n"]):
+            continue
+        adr = (~(yield bp.ad_o_n)) & M32
+        we = (yield card.pins["tm1_3v3_n"]) == 0
+        ask2x = (yield card.pins["tm2_3v3_n"]) == 0
+        base = adr & ~0xf
+        abort_k = 2 if (base, we) in abort else None
+        abort.discard((base, we))
+        log.append(("W" if we else "R", hex(base), "2x" if ask2x else "1x"))
+        yield from card.step()
+        if not ask2x:
+            for k in range(4):
+                yield bp.tm0n.eq(0)
+                if k == 3:
+                    yield bp.ackn.eq(0)
+                    yield bp.tm1n.eq(0)
+                if not we:
+                    yield bp.adn.eq(~mem.get(base + 4*k, base + 4*k) & M32)
+                yield from card.step(2)
+                if we:
+                    mem[base + 4*k] = (~(yield bp.ad_o_n)) & M32
+            yield from card.release()
+            continue
+        yield bp.tm0n.eq(0)
+        yield bp.tm2n.eq(0)
+        if not we:
+            yield bp.adn.eq(~mem.get(base, base) & M32)
+        yield from card.step(2)
+        if we:
+            mem[base] = (~(yield bp.ad_o_n)) & M32
+        yield bp.tm2n.eq(1)
+        for k in range(1, 4):
+            last = (k == 3) or (k == abort_k)
+            if last:
+                yield bp.ackn.eq(0)
+                yield bp.tm1n.eq(0)
+                yield bp.tm0n.eq(1 if (k == abort_k) else 0) # error status when aborting
+            if not we:
+                yield bp.adn.eq(~mem.get(base + 4*k, base + 4*k) & M32)
+            yield from card.step()
+            if we and (k != abort_k):
+                mem[base + 4*k] = (~(yield bp.ad_o_n)) & M32
+            if last:
+                break
+        yield from card.step() # the ACK lasts a whole NuBus cycle
+        yield from card.release()
+        yield from card.step()
+        if (yield bp.ad_oe):
+            log.append(("still driving", hex(base)))
+
+def test_nubus90_dma():
+    dut = DUT(nubus90=True)
+    mem = {}
+    log = []
+    abort = set()
+    got = []
+    def tosbus_write(adr, words):
+        yield dut.tosbus_fifo.din.eq(adr | sum(w << (32 + 32*i) for i, w in enumerate(words)))
+        yield dut.tosbus_fifo.we.eq(1)
+        yield
+        yield dut.tosbus_fifo.we.eq(0)
+    def fromsbus_req(adr, blk):
+        yield dut.fromsbus_req_fifo.din.eq(blk | (adr << 28))
+        yield dut.fromsbus_req_fifo.we.eq(1)
+        yield
+        yield dut.fromsbus_req_fifo.we.eq(0)
+    def bench():
+        yield dut.fromsbus_fifo.re.eq(1)
+        for (adr, err) in [(0x10000100, False), (0x10000200, True)]:
+            if err:
+                abort.add((adr, True))
+            yield from tosbus_write(adr, [adr + 0x11, adr + 0x22, adr + 0x33, adr + 0x44])
+            for i in range(500): yield
+            if err:
+                abort.add((adr, False))
+            yield from fromsbus_req(adr, 5)
+            for i in range(500):
+                yield
+                if (yield dut.fromsbus_fifo.readable):
+                    v = (yield dut.fromsbus_fifo.dout)
+                    got.append([(v >> (28 + 32*i)) & M32 for i in range(4)])
+    run(dut, {"sys": [bench()], "nubus90": [passive(slave90)(dut, mem, log, abort)]})
+    # the aborted 2x transfers are retried at 1x
+    assert log == [("W", "0x10000100", "2x"), ("R", "0x10000100", "2x"),
+                   ("W", "0x10000200", "2x"), ("W", "0x10000200", "1x"), ("R", "0x10000200", "2x"), ("R", "0x10000200", "1x")]
+    assert [mem[0x10000200 + 4*k] for k in range(4)] == [0x10000211, 0x10000222, 0x10000233, 0x10000244]
+    assert got == [[0x10000111, 0x10000122, 0x10000133, 0x10000144], [0x10000211, 0x10000222, 0x10000233, 0x10000244]]
+
+def test_nubus90_slave():
+    dut = DUT(nubus90=True)
+    mem = {}
+    res = {}
+    def mac():
+        card = Card(dut)
+        yield from card.step(10)
+        w4 = [0x1000 + i for i in range(4)]
+        res["w4"] = (yield from card.block(slot | 0x1000, 4, write=True, words=w4))[0:2]
+        yield from card.step(20)
+        res["r4"] = (yield from card.block(slot | 0x1000, 4))
+        w8 = [0x2000 + i for i in range(8)]
+        res["w8"] = (yield from card.block(slot | 0x2000, 8, write=True, words=w8, ask2x=False))[0:2]
+        res["r8"] = (yield from card.block(slot | 0x2000, 8, ask2x=False))
+        yield from card.step(60)
+        w16 = [0x3000 + i for i in range(16)]
+        res["w16"] = (yield from card.block(slot | 0x3000, 16, write=True, words=w16))[0:2]
+        yield from card.step(60)
+        res["r16"] = (yield from card.block(slot | 0x3000, 16))
+        res["r32"] = (yield from card.block(slot | 0x3000, 32))[0]
+        # a write right behind a 2x block write, while the block is still going to the write FIFO
+        w4 = [0x4000 + i for i in range(4)]
+        yield from card.block(slot | 0x4000, 4, write=True, words=w4)
+        res["single"] = (yield from card.access(slot | 0x4004, write=True, data=0x4444))[0]
+        res["readback"] = (yield from card.access(slot | 0x4004))
+        yield from card.step(40)
+    run(dut, {"nubus90": [mac()], "nubus": [passive(wb_read_mem)(dut, mem)], "sys": [passive(wb_write_mem)(dut, mem)]})
+    assert res["w4"] == ("ok", True)
+    assert res["r4"] == ("ok", True, [0x1000 + i for i in range(4)])
+    assert res["w8"] == ("ok", False)
+    assert res["r8"] == ("ok", False, [0x2000 + i for i in range(8)])
+    assert res["w16"] == ("ok", True)
+    assert res["r16"] == ("ok", True, [0x3000 + i for i in range(16)])
+    assert res["r32"] == "error"
+    assert res["single"] == "ok"
+    assert res["readback"] == ("ok", 0x4444)
+    assert [mem.get(sdram_adr(0x4000 + 4*i)) for i in range(4)] == [0x4000, 0x4444, 0x4002, 0x4003]
+
+# wb_dma read bursts go as block reads, the block serving the rest of the burst only
+def test_dma_read_burst():
+    dut = DUT(dma_bursts=True)
+    mem = {}
+    log = []
+    res = {}
+    blk = 0x10000300
+    def wb_cycle(adr, cti):
+        wb = dut.wb_dma
+        yield wb.adr.eq(adr >> 2)
+        yield wb.we.eq(0)
+        yield wb.cti.eq(cti)
+        yield wb.bte.eq(0)
+        yield wb.cyc.eq(1)
+        yield wb.stb.eq(1)
+        for i in range(400):
+            yield
+            if (yield wb.ack):
+                break
+        d = (yield wb.dat_r)
+        yield wb.cyc.eq(0)
+        yield wb.stb.eq(0)
+        yield
+        return d
+    def burst(adr, n, last = True):
+        r = []
+        for k in range(n):
+            r.append((yield from wb_cycle(adr + 4*k, 0b111 if (last and (k == n - 1)) else 0b010)))
+        return r
+    def bench():
+        for i in range(20): yield
+        res["full"] = (yield from burst(blk, 4))
+        for k in range(4):
+            mem[blk + 4*k] = 0x100 + k
+        res["partial"] = (yield from burst(blk, 2, last = False)) # ends without CTI 0b111
+        for k in range(4):
+            mem[blk + 4*k] = 0x200 + k
+        res["again"] = (yield from burst(blk, 2, last = False)) # new burst, same block
+        for k in range(4):
+            mem[blk + 4*k] = 0x300 + k
+        for i in range(40): yield
+        res["late"] = (yield from burst(blk + 8, 2)) # where the last one stopped, but much later
+    run(dut, {"nubus": [bench()], "nubus90": [passive(slave90)(dut, mem, log, set())]})
+    assert res["full"] == [blk + 4*k for k in range(4)]
+    assert res["partial"] == [0x100, 0x101]
+    assert res["again"] == [0x200, 0x201]
+    assert res["late"] == [0x302, 0x303]
+    assert log == [("R", hex(blk), "1x")] * 4
+
+# slow reads get a try-again, their data waits in the completion buffer for the retry, but not forever;
+# CSR reads wait for their data instead
+def test_tryagain_buffer():
+    dut = DUT(tryagain_budget=4)
+    dut.nubus.soc.bus.regions["csr"] = SoCRegion(origin=0xF0A00000, size=0x10000)
+    mem = {}
+    fetches = []
+    res = {}
+    adr = sdram_adr(0x5000)
+    def mac():
+        card = Card(dut)
+        yield from card.step(10)
+        mem[adr] = 0x1111
+        res["first"] = (yield from card.access(slot | 0x5000))[0]
+        yield from card.step(100) # the fetch is done
+        res["retry"] = (yield from card.access(slot | 0x5000))
+        res["again"] = (yield from card.access(slot | 0x5000))[0]
+        yield from card.step(100)
+        mem[adr] = 0x2222
+        yield from card.step(100) # the buffer has expired
+        res["expired"] = (yield from card.access(slot | 0x5000))[0]
+        yield from card.step(100)
+        res["expired_retry"] = (yield from card.access(slot | 0x5000))
+        res["csr"] = (yield from card.access(slot | 0xA00010))
+        yield from card.step(20)
+    run(dut, {"nubus90": [mac()], "nubus": [passive(wb_read_mem)(dut, mem, 30, fetches)]})
+    assert res["first"] == "tryagain"
+    assert res["retry"] == ("ok", 0x1111)
+    assert res["again"] == "tryagain"
+    assert res["expired"] == "tryagain"
+    assert res["expired_retry"] == ("ok", 0x2222)
+    assert res["csr"] == ("ok", 0xA0000000 | ((0xF0A00010 >> 2) & 0xffff))
+    assert fetches == [adr, adr, adr, 0xF0A00010 >> 2]
+
+if __name__ == "__main__":
+    test_nubus90_dma()
+    test_nubus90_slave()
+    test_dma_read_burst()
+    test_tryagain_buffer()
+    print("done")
@@ -0,0 +1,113 @@
+from migen import *
+from litex.soc.interconnect import wishbone
+from litedram.common import LiteDRAMNativePort
+from nubus_wcomb import NuBusWriteCombiner
+
+dram_base = 0x80000000
+
+class DUT(Module):
+    def __init__(self):
+        self.port = LiteDRAMNativePort("write", address_width=24, data_width=128)
+        self.wb_write = wishbone.Interface()
+        self.wb_read = wishbone.Interface()
+        self.submodules.wcomb = NuBusWriteCombiner(self.port, dram_base, 0x10000000, self.wb_write, self.wb_read, timeout=8)
+
+def push(dut, adr, data, sel):
+    wcomb = dut.wcomb
+    yield wcomb.sink_valid.eq(1)
+    yield wcomb.sink_adr.eq(adr)
+    yield wcomb.sink_data.eq(data)
+    yield wcomb.sink_sel.eq(sel)
+    yield
+    while not (yield wcomb.sink_ready):
+        yield
+    yield wcomb.sink_valid.eq(0)
+
+# the native port: each flush as (line address, data, byte enables)
+def dram_bench(dut, log):
+    port = dut.port
+    yield port.cmd.ready.eq(1)
+    yield port.wdata.ready.eq(1)
+    adr = None
+    while True:
+        if (yield port.cmd.valid):
+            adr = (yield port.cmd.addr)
+        if (yield port.wdata.valid):
+            log.append(("dram", adr, (yield port.wdata.data), (yield port.wdata.we)))
+        yield
+
+def wb_bench(dut, log):
+    while True:
+        if (yield dut.wb_write.cyc) and (yield dut.wb_write.stb):
+            log.append(("wb", (yield dut.wb_write.adr) << 2, (yield dut.wb_write.dat_w)))
+            yield dut.wb_write.ack.eq(1)
+            yield
+            yield dut.wb_write.ack.eq(0)
+        bus_read = dut.wcomb.bus_read
+        if (yield bus_read.cyc) and (yield bus_read.stb) and not (yield bus_read.ack):
+            log.append(("rd", (yield bus_read.adr) << 2))
+            yield bus_read.dat_r.eq(0x5a5a5a5a)
+            yield bus_read.ack.eq(1)
+            yield
+            yield bus_read.ack.eq(0)
+        yield
+
+def run(bench):
+    dut = DUT()
+    log = []
+    run_simulation(dut, [bench(dut, log), passive(dram_bench)(dut, log), passive(wb_bench)(dut, log)])
+    return log
+
+def line(words):
+    return sum(w << (32*k) for (k, w) in enumerate(words))
+
+# four sequential stores fill a line, flushed at once as one native write
+def test_merge_full_line():
+    def bench(dut, log):
+        for i in range(4):
+            yield from push(dut, dram_base + 0x10 + 4*i, 0x11111111*(i+1), 0xf)
+        for i in range(5):
+            yield
+    log = run(bench)
+    assert log == [("dram", 1, line([0x11111111, 0x22222222, 0x33333333, 0x44444444]), 0xffff)]
+
+# partial stores are merged with their byte enables, and the line goes out on the timeout
+def test_partial_line():
+    def bench(dut, log):
+        yield from push(dut, dram_base + 0x20, 0x000000a0, 0x1)
+        yield from push(dut, dram_base + 0x20, 0x0000b000, 0x2)
+        yield from push(dut, dram_base + 0x28, 0xc0000000, 0x8)
+        for i in range(5):
+            yield
+        assert log == [] # still open
+        for i in range(15):
+            yield
+    log = run(bench)
+    assert log == [("dram", 2, line([0x0000b0a0, 0, 0xc0000000, 0]), 0x0803)]
+
+# a store elsewhere flushes the open line first, so the order is kept
+def test_flush_on_other_access():
+    def bench(dut, log):
+        yield from push(dut, dram_base + 0x40, 0xdead, 0x3)
+        yield from push(dut, 0xf0000000, 0xbeef, 0xf)
+        for i in range(5):
+            yield
+    log = run(bench)
+    assert log == [("dram", 4, line([0xdead, 0, 0, 0]), 0x0003), ("wb", 0xf0000000, 0xbeef)]
+
+# a read to the open line is held until the line is written
+def test_flush_on_read_hit():
+    def bench(dut, log):
+        yield from push(dut, dram_base + 0x50, 0x1234, 0xf)
+        yield dut.wb_read.cyc.eq(1)
+        yield dut.wb_read.stb.eq(1)
+        yield dut.wb_read.adr.eq((dram_base + 0x54) >> 2)
+        while not (yield dut.wb_read.ack):
+            yield
+        log.append(("data", (yield dut.wb_read.dat_r)))
+        yield dut.wb_read.cyc.eq(0)
+        yield dut.wb_read.stb.eq(0)
+        for i in range(15):
+            yield
+    log = run(bench)
+    assert log == [("dram", 5, line([0x1234, 0, 0, 0]), 0x000f), ("rd", dram_base + 0x54), ("data", 0x5a5a5a5a)]
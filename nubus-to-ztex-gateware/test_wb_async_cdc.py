@@ -0,0 +1,101 @@
+from migen import *
+from wb_async_cdc import WishboneAsyncCrossingMaster
+import litex.soc.interconnect.wishbone
+
+class DUT(Module):
+    def __init__(self, posted_writes):
+        self.slave = litex.soc.interconnect.wishbone.Interface()
+        self.submodules.cdc = WishboneAsyncCrossingMaster(slave=self.slave, cd_master="sys", cd_slave="nubus", posted_writes=posted_writes)
+        self.clock_domains.cd_sys = ClockDomain()
+        self.clock_domains.cd_nubus = ClockDomain()
+
+def slave_bench(dut, mem, slave_log):
+    # slow slave, acks after a few nubus cycles
+    slave = dut.slave
+    while True:
+        if (yield slave.cyc) and (yield slave.stb):
+            for i in range(2): yield
+            adr = (yield slave.adr)
+            if (yield slave.we) and (adr == 0x3ff): # no one there
+                slave_log.append(("E", adr))
+                yield slave.err.eq(1)
+                yield
+                yield slave.err.eq(0)
+                yield
+                continue
+            if (yield slave.we):
+                mem[adr] = (yield slave.dat_w)
+                slave_log.append(("W", adr))
+            else:
+                yield slave.dat_r.eq(mem.get(adr, 0xdead0000 | adr))
+                slave_log.append(("R", adr))
+            yield slave.ack.eq(1)
+            yield
+            yield slave.ack.eq(0)
+        yield
+
+def run(bench, posted_writes):
+    mem = {}
+    slave_log = []
+    res = {}
+    dut = DUT(posted_writes)
+    run_simulation(dut, {"sys": [bench(dut, mem, slave_log, res)], "nubus": [passive(slave_bench)(dut, mem, slave_log)]},
+                   clocks={"sys": 10, "nubus": 100})
+    return mem, slave_log, res
+
+def ordering_bench(dut, mem, slave_log, res):
+    bus = dut.cdc
+    for i in range(10): yield
+    # back-to-back writes
+    for k in range(4):
+        yield from bus.write(0x100 + k, 0x11110000 + k)
+    # a read right behind them must see the last write
+    res["raw"] = (yield from bus.read(0x103))
+    res["read"] = (yield from bus.read(0x200))
+
+def check_ordering(posted_writes):
+    mem, slave_log, res = run(ordering_bench, posted_writes)
+    assert res["raw"] == 0x11110003
+    assert res["read"] == 0xdead0200
+    assert [a for (t, a) in slave_log] == [0x100, 0x101, 0x102, 0x103, 0x103, 0x200]
+    for k in range(4):
+        assert mem.get(0x100 + k) == 0x11110000 + k
+
+def test_ordering():
+    check_ordering(posted_writes=False)
+
+def test_ordering_posted():
+    check_ordering(posted_writes=True)
+
+def test_posted_error():
+    def bench(dut, mem, slave_log, res):
+        bus = dut.cdc
+        for i in range(10): yield
+        yield from bus.write(0x3ff, 0)
+        res["read"] = (yield from bus.read(0x100)) # behind it in the FIFO
+        for i in range(30): yield
+        res["errors"] = (yield bus.posted_errors.status)
+    mem, slave_log, res = run(bench, posted_writes=True)
+    assert res["read"] == 0xdead0100
+    assert res["errors"] == 1
+
+# the master gives up on a read before the response is back, then starts another one:
+# the new read must get its own data, not the late response to the aborted one
+def test_abort_then_new_request():
+    def bench(dut, mem, slave_log, res):
+        bus = dut.cdc
+        for i in range(10): yield
+        yield bus.adr.eq(0x300)
+        yield bus.we.eq(0)
+        yield bus.cyc.eq(1)
+        yield bus.stb.eq(1)
+        for i in range(5): yield
+        yield bus.cyc.eq(0)
+        yield bus.stb.eq(0)
+        yield
+        res["read"] = (yield from bus.read(0x301))
+        res["after"] = (yield from bus.read(0x302))
+    mem, slave_log, res = run(bench, posted_writes=True)
+    assert res["read"] == 0xdead0301
+    assert res["after"] == 0xdead0302
+    assert slave_log == [("R", 0x300), ("R", 0x301), ("R", 0x302)]
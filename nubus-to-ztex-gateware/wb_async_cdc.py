@@ -0,0 +1,134 @@
+from migen import *
+from migen.genlib.fifo import *
+from migen.genlib.cdc import PulseSynchronizer
+
+import litex
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.csr import *
+
+# Wishbone clock-domain crossing through a pair of asynchronous FIFOs (gray-coded pointers)
+# Requests go from cd_master to cd_slave in the command FIFO, responses come back in the response FIFO
+# Every transaction is handed over as a FIFO entry, so back-to-back transactions need no extra delay
+# (unlike WishboneDomainCrossingMaster and its force_delay)
+# With posted_writes, writes are acked as soon as they are queued, so several can be outstanding
+# (and a read queued behind them); ordering is kept by the FIFO
+# An error on a posted write can't be reported to the master, it sets the sticky write_err instead (slave domain)
+# and is counted in the posted_errors CSR (so with posted_writes, cd_master must be sys)
+class WishboneAsyncCrossingMaster(Module, wishbone.Interface, AutoCSR):
+    def __init__(self, slave, cd_master="sys", cd_slave="nubus", depth=4, posted_writes=False):
+        wishbone.Interface.__init__(self, data_width=len(slave.dat_w), adr_width=len(slave.adr))
+        self.write_err = Signal()
+        if (posted_writes):
+            self.posted_errors = CSRStatus(32, description = "Posted writes that ended with a bus error")
+
+        cmd_layout = [
+            ("adr", len(slave.adr)),
+            ("dat_w", len(slave.dat_w)),
+            ("sel", len(slave.sel)),
+            ("we", 1),
+            ("cti", 3),
+            ("bte", 2),
+        ]
+        rsp_layout = [
+            ("dat_r", len(slave.dat_r)),
+            ("err", 1),
+        ]
+
+        self.submodules.cmd_fifo = cmd_fifo = ClockDomainsRenamer({"write": cd_master, "read": cd_slave})(AsyncFIFOBuffered(width=layout_len(cmd_layout), depth=depth))
+        self.submodules.rsp_fifo = rsp_fifo = ClockDomainsRenamer({"write": cd_slave, "read": cd_master})(AsyncFIFOBuffered(width=layout_len(rsp_layout), depth=depth))
+        cmd_din = Record(cmd_layout)
+        cmd_dout = Record(cmd_layout)
+        rsp_din = Record(rsp_layout)
+        rsp_dout = Record(rsp_layout)
+        self.comb += [
+            cmd_fifo.din.eq(cmd_din.raw_bits()),
+            cmd_dout.raw_bits().eq(cmd_fifo.dout),
+            rsp_fifo.din.eq(rsp_din.raw_bits()),
+            rsp_dout.raw_bits().eq(rsp_fifo.dout),
+        ]
+
+        # master side: queue the request, then wait for the response (reads, or writes when not posted)
+        self.comb += [
+            cmd_din.adr.eq(self.adr),
+            cmd_din.dat_w.eq(self.dat_w),
+            cmd_din.sel.eq(self.sel),
+            cmd_din.we.eq(self.we),
+            cmd_din.cti.eq(self.cti),
+            cmd_din.bte.eq(self.bte),
+        ]
+        self.submodules.master_fsm = master_fsm = ClockDomainsRenamer(cd_master)(FSM(reset_state = "Reset"))
+        master_fsm.act("Reset",
+                       NextState("Idle")
+        )
+        master_fsm.act("Idle",
+                       If(self.cyc & self.stb & cmd_fifo.writable,
+                          cmd_fifo.we.eq(1),
+                          If(self.we & posted_writes,
+                             self.ack.eq(1),
+                          ).Else(
+                              NextState("WaitRsp"),
+                          )
+                       )
+        )
+        # if the master drops cyc while we wait, the response belongs to the aborted cycle:
+        # it is drained here before a new request is queued, so it can't be taken for the new one's
+        rsp_stale = Signal()
+        master_fsm.act("WaitRsp",
+                       If(~self.cyc,
+                          NextValue(rsp_stale, 1),
+                       ),
+                       If(rsp_fifo.readable,
+                          rsp_fifo.re.eq(1),
+                          self.dat_r.eq(rsp_dout.dat_r),
+                          self.ack.eq(self.cyc & self.stb & ~rsp_stale & ~rsp_dout.err),
+                          self.err.eq(self.cyc & self.stb & ~rsp_stale & rsp_dout.err),
+                          NextValue(rsp_stale, 0),
+                          NextState("Idle"),
+                       )
+        )
+
+        # slave side: replay the requests in order
+        # only start when there's room for the response, so the slave is never kept waiting on the master
+        rsp_needed = Signal()
+        self.comb += rsp_needed.eq(~cmd_dout.we | (not posted_writes))
+        self.submodules.slave_fsm = slave_fsm = ClockDomainsRenamer(cd_slave)(FSM(reset_state = "Reset"))
+        slave_fsm.act("Reset",
+                      NextState("Idle")
+        )
+        slave_fsm.act("Idle",
+                      If(cmd_fifo.readable & (rsp_fifo.writable | ~rsp_needed),
+                         NextState("Access"),
+                      )
+        )
+        slave_fsm.act("Access",
+                      slave.cyc.eq(1),
+                      slave.stb.eq(1),
+                      slave.adr.eq(cmd_dout.adr),
+                      slave.dat_w.eq(cmd_dout.dat_w),
+                      slave.sel.eq(cmd_dout.sel),
+                      slave.we.eq(cmd_dout.we),
+                      slave.cti.eq(cmd_dout.cti),
+                      slave.bte.eq(cmd_dout.bte),
+                      If(slave.ack | slave.err,
+                         cmd_fifo.re.eq(1),
+                         rsp_fifo.we.eq(rsp_needed),
+                         rsp_din.dat_r.eq(slave.dat_r),
+                         rsp_din.err.eq(slave.err),
+                         If(slave.err & ~rsp_needed,
+                            NextValue(self.write_err, 1),
+                         ),
+                         NextState("Idle"),
+                      )
+        )
+
+        if (posted_writes):
+            posted_errors = Signal(32)
+            self.submodules.write_err_sync = PulseSynchronizer(idomain = cd_slave, odomain = cd_master)
+            self.comb += [
+                self.write_err_sync.i.eq(slave_fsm.ongoing("Access") & slave.err & ~rsp_needed),
+                self.posted_errors.status.eq(posted_errors),
+            ]
+            master_sync = getattr(self.sync, cd_master)
+            master_sync += If(self.write_err_sync.o,
+                              posted_errors.eq(posted_errors + 1),
+            )